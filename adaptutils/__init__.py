@@ -1 +1,2 @@
-from .templates import get_branch_source_dump
+from .templates import get_branch_source_dump, get_branch_files, get_branch_snapshot
+from .snapshot import SourceSnapshot, render_source
\ No newline at end of file
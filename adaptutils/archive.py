@@ -0,0 +1,88 @@
+import os
+import fnmatch
+import tempfile
+import zipfile
+from typing import IO, Iterator, Optional, Tuple
+
+import requests
+
+CHUNK_SIZE = 1024 * 1024
+# Archives up to this size stay in memory, bigger ones roll over to a temporary file
+SPOOL_BYTES = 32 * 1024 * 1024
+
+
+def max_file_bytes() -> int:
+    """Largest file kept from an archive, GITHUB_ZIP_MAX_FILE_BYTES (default 2 MiB). Bigger files are skipped."""
+    return int(os.getenv("GITHUB_ZIP_MAX_FILE_BYTES", 2 * 1024 * 1024))
+
+
+def max_total_bytes() -> int:
+    """Total size kept from an archive, GITHUB_ZIP_MAX_TOTAL_BYTES (default 512 MiB). Extraction stops there."""
+    return int(os.getenv("GITHUB_ZIP_MAX_TOTAL_BYTES", 512 * 1024 * 1024))
+
+
+def spool_response(response: requests.Response) -> IO[bytes]:
+    """The body of a streamed response in a spooled temporary file, read in chunks instead of as one bytes object."""
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_BYTES)
+    for chunk in response.iter_content(CHUNK_SIZE):
+        spool.write(chunk)
+    spool.seek(0)
+    return spool
+
+
+def selected(path: str, include_extensions: list = None, exclude_paths: list = None) -> bool:
+    if path.endswith("/"):  # Skip directories
+        return False
+    if include_extensions and not any(path.endswith(ext) for ext in include_extensions):
+        return False
+    return not any(fnmatch.fnmatch(path, pattern) for pattern in exclude_paths or [])
+
+
+def iter_zip_files(
+    archive: IO[bytes],
+    include_extensions: list = None,
+    exclude_paths: list = None,
+    file_limit: Optional[int] = None,
+    total_limit: Optional[int] = None,
+) -> Iterator[Tuple[str, str]]:
+    """
+    Yield (path, content) for the files of a zip archive, one at a time.
+
+    Members are chosen from the central directory by extension and path glob before anything is decompressed, and
+    files over file_limit are skipped, so only the file being yielded is held in memory. Extraction stops once
+    total_limit bytes were yielded.
+    """
+    file_limit = file_limit if file_limit is not None else max_file_bytes()
+    total_limit = total_limit if total_limit is not None else max_total_bytes()
+    total = 0
+    with zipfile.ZipFile(archive) as z:
+        for file_info in z.infolist():
+            # Step 1: Filter on the central directory entry
+            if not selected(file_info.filename, include_extensions, exclude_paths):
+                continue
+            if file_info.file_size > file_limit:
+                print(f"Skipping {file_info.filename}: {file_info.file_size} bytes is over the {file_limit} byte limit")
+                continue
+            if total + file_info.file_size > total_limit:
+                print(f"Stopping extraction at {file_info.filename}: over the {total_limit} byte total limit")
+                break
+
+            # Step 2: Decompress the member, never more than the limit whatever its header claims
+            try:
+                with z.open(file_info) as file:
+                    data = file.read(file_limit + 1)
+            except Exception as e:
+                print(f"Failed to process {file_info.filename}: {e}")
+                continue
+            if len(data) > file_limit:
+                print(f"Skipping {file_info.filename}: over the {file_limit} byte limit")
+                continue
+
+            total += len(data)
+            yield file_info.filename, data.decode("utf-8", errors="ignore")
+
+
+def iter_response_zip_files(response: requests.Response, include_extensions: list = None, exclude_paths: list = None) -> Iterator[Tuple[str, str]]:
+    """iter_zip_files over the zip body of a response opened with stream=True."""
+    with spool_response(response) as archive:
+        yield from iter_zip_files(archive, include_extensions, exclude_paths)
@@ -1,39 +1,322 @@
 import os
+import re
+import json
+import base64
+import time
+import hashlib
+import threading
 import requests
-import zipfile, io
+import zipfile
+from urllib.parse import quote
 import tempfile
-from typing import Tuple
+from typing import Tuple, Optional, Dict, Iterator, Union
 from github import Github, PullRequest
+from github.Repository import Repository
+from requests.adapters import HTTPAdapter
 import git
 
+from core.llm_handlers.cache import CacheBackend, FileCacheBackend
+from .archive import iter_response_zip_files, selected, max_file_bytes, max_total_bytes
+from .snapshot import SourceSnapshot
+from .mirrors import GitMirrorPool, default_mirror_pool
+from .providers import SourceProvider, source_provider_from_env
+from .minify import default_minifier, path_matches
+
+
+class GitHubResponse:
+    def __init__(self, url: str, status_code: int, content: bytes, headers: dict, from_cache: bool = False):
+        self.url = url
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers
+        self.from_cache = from_cache
+
+    @property
+    def text(self) -> str:
+        return self.content.decode("utf-8", errors="replace")
+
+    def json(self):
+        return json.loads(self.content)
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.exceptions.HTTPError(f"{self.status_code} Error for url: {self.url}")
+
+
+class GitHubHTTP:
+    """
+    One pooled requests.Session for every GitHub call of the process, with conditional GETs.
+
+    Responses carrying an ETag or Last-Modified are stored with those validators. A later GET of the same URL and
+    Accept header sends If-None-Match / If-Modified-Since, and a 304 is answered from the stored body.
+    GitHub does not count 304s against the rate limit. The rate-limit headers of every response are kept for stats().
+    """
+
+    def __init__(self, cache: CacheBackend = None, pool_size: int = 16):
+        self.cache = cache
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.not_modified = 0
+        self.calls: Dict[str, int] = {}
+        self.rate_limits: Dict[str, dict] = {}
+
+    def key(self, url: str, headers: dict) -> str:
+        # The Authorization header is left out, the same URL and media type is the same document for every token
+        payload = json.dumps({"url": url, "accept": headers.get("Accept")}, sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, url: str, headers: dict = None, kind: str = "other") -> GitHubResponse:
+        headers = dict(headers or {})
+        key = self.key(url, headers)
+        stored = self.load(key)
+        if stored is not None:
+            if stored.get("etag"):
+                headers["If-None-Match"] = stored["etag"]
+            if stored.get("last_modified"):
+                headers["If-Modified-Since"] = stored["last_modified"]
+
+        response = self.session.get(url, headers=headers)
+        self.record(response, kind)
+        if response.status_code == 304 and stored is not None:
+            with self.lock:
+                self.not_modified += 1
+            return GitHubResponse(url, 200, base64.b64decode(stored["body"]), dict(response.headers), from_cache=True)
+
+        if response.status_code == 200 and self.cache is not None and (response.headers.get("ETag") or response.headers.get("Last-Modified")):
+            self.cache.set(key, json.dumps({
+                "etag": response.headers.get("ETag"),
+                "last_modified": response.headers.get("Last-Modified"),
+                "body": base64.b64encode(response.content).decode("ascii"),
+            }))
+        return GitHubResponse(url, response.status_code, response.content, dict(response.headers))
+
+    def load(self, key: str) -> Optional[dict]:
+        if self.cache is None:
+            return None
+        stored = self.cache.get(key)
+        return json.loads(stored) if stored is not None else None
+
+    def count(self, kind: str):
+        """Count a REST call made outside this session, e.g. through PyGithub."""
+        with self.lock:
+            self.calls[kind] = self.calls.get(kind, 0) + 1
+
+    def record(self, response: requests.Response, kind: str = "other"):
+        self.count(kind)
+        with self.lock:
+            self.requests += 1
+            if "X-RateLimit-Remaining" not in response.headers:
+                return
+            resource = response.headers.get("X-RateLimit-Resource", "core")
+            self.rate_limits[resource] = {
+                "limit": int(response.headers.get("X-RateLimit-Limit", 0)),
+                "remaining": int(response.headers["X-RateLimit-Remaining"]),
+                "used": int(response.headers.get("X-RateLimit-Used", 0)),
+                "reset": int(response.headers.get("X-RateLimit-Reset", 0)),
+            }
+
+    def call_counts(self) -> Dict[str, int]:
+        with self.lock:
+            return dict(self.calls)
+
+    def calls_since(self, before: Dict[str, int]) -> Dict[str, int]:
+        """REST calls per kind made since call_counts() returned before."""
+        return {kind: count - before.get(kind, 0) for kind, count in self.call_counts().items() if count > before.get(kind, 0)}
+
+    def rate_limit(self, resource: str = "core") -> Optional[dict]:
+        """Rate-limit headroom GitHub reported on the latest response for resource."""
+        with self.lock:
+            return dict(self.rate_limits[resource]) if resource in self.rate_limits else None
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "requests": self.requests,
+                "not_modified": self.not_modified,
+                "not_modified_rate": self.not_modified / self.requests if self.requests else 0.0,
+                "calls": dict(self.calls),
+                "rate_limits": {resource: dict(limits) for resource, limits in self.rate_limits.items()},
+                "cache": self.cache.stats() if self.cache is not None else None,
+            }
+
+
+_github_http: Optional[GitHubHTTP] = None
+_github_http_lock = threading.Lock()
+
+
+def default_github_http() -> GitHubHTTP:
+    """
+    Process-wide GitHubHTTP. Set GITHUB_HTTP_CACHE_DIR to keep response bodies for conditional requests,
+    bounded by GITHUB_HTTP_CACHE_MAX_BYTES.
+    """
+    global _github_http
+    with _github_http_lock:
+        if _github_http is None:
+            root = os.getenv("GITHUB_HTTP_CACHE_DIR")
+            cache = FileCacheBackend(root, max_bytes=int(os.getenv("GITHUB_HTTP_CACHE_MAX_BYTES", 256 * 1024 * 1024))) if root else None
+            _github_http = GitHubHTTP(cache)
+        return _github_http
+
+
+class HandleCache:
+    """
+    Per-process cache of PyGithub repository and pull-request objects, each kept for ttl seconds.
+
+    One detection or propagation run looks the same PR and repository up several times, a handle that is still
+    fresh saves the REST call. Long-running services share default_handle_cache(), a one-shot run such as GitHub
+    detection keeps its own for the length of the run.
+    """
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries: Dict[tuple, Tuple[float, object]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: tuple, load, valid=None):
+        """The cached object for key, or load() when it is missing, expired or fails valid(object)."""
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and now - entry[0] < self.ttl and (valid is None or valid(entry[1])):
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        value = load()
+        with self.lock:
+            self.entries[key] = (time.monotonic(), value)
+            # Expired entries are dropped as new ones come in
+            self.entries = {key: entry for key, entry in self.entries.items() if time.monotonic() - entry[0] < self.ttl}
+        return value
+
+    def invalidate(self, key: tuple):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"entries": len(self.entries), "hits": self.hits, "misses": self.misses}
+
+
+_handle_cache: Optional[HandleCache] = None
+
+
+def default_handle_cache() -> HandleCache:
+    """Process-wide HandleCache, handles live GITHUB_HANDLE_TTL_SECONDS (default 60)."""
+    global _handle_cache
+    with _github_http_lock:
+        if _handle_cache is None:
+            _handle_cache = HandleCache(float(os.getenv("GITHUB_HANDLE_TTL_SECONDS", 60)))
+        return _handle_cache
+
+
+def snapshot_cache_from_env() -> Optional[CacheBackend]:
+    """
+    Cache of branch snapshots configured through GITHUB_SNAPSHOT_CACHE_DIR and GITHUB_SNAPSHOT_CACHE_MAX_BYTES.
+    A snapshot is a manifest keyed by commit SHA plus one entry per file content, so snapshots never go stale, need
+    no TTL and share the files they have in common. Disabled when the directory is unset.
+    """
+    root = os.getenv("GITHUB_SNAPSHOT_CACHE_DIR")
+    if not root:
+        return None
+    return FileCacheBackend(root, max_bytes=int(os.getenv("GITHUB_SNAPSHOT_CACHE_MAX_BYTES", 2 * 1024 * 1024 * 1024)))
+
+
+def snapshot_key(owner: str, repo: str, sha: str, include_extensions: list = None) -> str:
+    # The extraction limits decide which files a snapshot holds, a snapshot cut short under one limit is not reused under another
+    payload = json.dumps({
+        "repo": f"{owner}/{repo}",
+        "sha": sha,
+        "extensions": sorted(include_extensions or []),
+        "paths": "relative",
+        "layout": "manifest",
+        "limits": [max_file_bytes(), max_total_bytes()],
+    })
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def blob_key(content: str) -> str:
+    return hashlib.sha256(f"blob:{content}".encode("utf-8")).hexdigest()
+
+
+def branch_head_key(owner: str, repo: str, branch: str, include_extensions: list = None) -> str:
+    """Key of the SHA of the latest snapshot cached for a branch, the base of the next incremental update."""
+    payload = json.dumps({"repo": f"{owner}/{repo}", "branch": branch, "extensions": sorted(include_extensions or []), "paths": "relative"})
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def incremental_max_files() -> int:
+    """Changed files above which a fresh zipball is cheaper than one request per file, GITHUB_INCREMENTAL_MAX_FILES (default 50)."""
+    return int(os.getenv("GITHUB_INCREMENTAL_MAX_FILES", 50))
 
 
 class GitHubApp:
-    def __init__(self, auth_token: str):
+    def __init__(self, auth_token: str, snapshot_cache: CacheBackend = None, http: GitHubHTTP = None, mirrors: GitMirrorPool = None, handles: HandleCache = None, source_provider: SourceProvider = None):
         self.auth_token = auth_token
         self.g = Github(auth_token)
+        self.snapshot_cache = snapshot_cache if snapshot_cache is not None else snapshot_cache_from_env()
+        self.http = http or default_github_http()
+        self.mirrors = mirrors or default_mirror_pool()
+        self.handles = handles or default_handle_cache()
+        self.source_provider = source_provider or source_provider_from_env(self)
+        self.minifier = default_minifier()
 
-    def get_pr(self, owner: str, repo: str, pr_number: int) -> PullRequest:
-        # Step 1: Access the repository
-        repository = self.g.get_repo(f"{owner}/{repo}")
+    def api_headers(self, accept: str = "application/vnd.github+json") -> dict:
+        headers = {"Accept": accept}
+        if self.auth_token:
+            headers["Authorization"] = f"Bearer {self.auth_token}"
+        return headers
 
-        # Step 2: Get the pull request
-        pr = repository.get_pull(pr_number)
-        return pr
+    def resolve_commit_sha(self, owner: str, repo: str, ref: str) -> Optional[str]:
+        """Commit SHA a branch or tag points at, from a single small API call. None when it cannot be resolved."""
+        if re.fullmatch(r"[0-9a-f]{40}", ref):
+            return ref
+        # Conditional, an unchanged branch costs a 304 and no rate limit
+        response = self.http.get(
+            f"https://api.github.com/repos/{owner}/{repo}/commits/{ref}",
+            headers=self.api_headers("application/vnd.github.sha"),
+            kind="commits.sha",
+        )
+        if response.status_code != 200:
+            print(f"Failed to resolve {owner}/{repo}@{ref} to a commit: {response.status_code}")
+            return None
+        return response.text.strip()
 
-    def get_pr_diff(self, owner: str, repo: str, pr_number: int) -> str:
-        # Step 1: Access the repository
-        repository = self.g.get_repo(f"{owner}/{repo}")
+    def get_repo(self, owner: str, repo: str) -> Repository:
+        # Lazy, the handle only carries the URL and costs no call until it is used
+        return self.handles.get(("repo", owner, repo), lambda: self.g.get_repo(f"{owner}/{repo}", lazy=True))
 
-        # Step 2: Get the pull request
-        pr = repository.get_pull(pr_number)
+    def get_pr(self, owner: str, repo: str, pr_number: int, head_sha: str = None) -> PullRequest:
+        """The pull request, reused within the handle TTL unless head_sha says its head moved."""
+        return self.handles.get(
+            ("pr", owner, repo, pr_number),
+            lambda: self.fetch_pr(owner, repo, pr_number),
+            valid=lambda pr: head_sha is None or pr.head.sha == head_sha,
+        )
+
+    def fetch_pr(self, owner: str, repo: str, pr_number: int) -> PullRequest:
+        # Step 1: Fetch the pull request with a conditional request instead of two PyGithub round trips
+        response = self.http.get(f"https://api.github.com/repos/{owner}/{repo}/pulls/{pr_number}", headers=self.api_headers(), kind="pulls.get")
+        response.raise_for_status()
+
+        # Step 2: Wrap it in the PyGithub object callers expect
+        return self.g.create_from_raw_data(PullRequest.PullRequest, response.json(), dict(response.headers))
 
-        # Step 3: Fetch the diff using the diff_url attribute
-        response = requests.get(
-            pr.diff_url, headers={"Accept": "application/vnd.github.v3.diff"}
+    def get_pr_diff(self, owner: str, repo: str, pr_number: int) -> str:
+        # Step 1: Fetch the diff of the pull request from the API, which answers conditional requests
+        response = self.http.get(
+            f"https://api.github.com/repos/{owner}/{repo}/pulls/{pr_number}",
+            headers=self.api_headers("application/vnd.github.v3.diff"),
+            kind="pulls.diff",
         )
 
-        # Step 4: Check for a successful response
+        # Step 2: Check for a successful response
         if response.status_code == 200:
             return response.text  # Return the raw diff text
         else:
@@ -42,8 +325,8 @@ class GitHubApp:
 
     def get_pr_diff_from_diff_url(self, diff_url: str):
         # Step 1: Use the diff_url to make a GET request for the diff content
-        response = requests.get(
-            diff_url, headers={"Accept": "application/vnd.github.v3.diff"}
+        response = self.http.get(
+            diff_url, headers={"Accept": "application/vnd.github.v3.diff"}, kind="pulls.diff"
         )
 
         # Step 2: Check for a successful response
@@ -53,48 +336,199 @@ class GitHubApp:
             print(f"Error: {response.status_code}")
             return ""
 
+    def iter_branch_files(self, owner: str, repo: str, branch: str, include_extensions: list = None, sha: str = None) -> Iterator[Tuple[str, str]]:
+        """
+        Yield (path, content) for the files of a branch, or of the commit sha when given, with repository-relative
+        paths. Served from the snapshot cache when the commit was downloaded before with the same extension filter.
+        Raises on download errors.
+        """
+        # Step 1: Pin the branch to a commit so the cache entry and the download describe the same tree
+        sha = sha or self.resolve_commit_sha(owner, repo, branch)
+        key = snapshot_key(owner, repo, sha, include_extensions) if sha else None
+        cache = self.snapshot_cache if key else None
+        served = set()
+        if cache is not None:
+            manifest = self.cached_manifest(owner, repo, branch, include_extensions, sha, key)
+
+            # Step 1.1: Read the files one at a time, like the download below
+            if manifest is not None:
+                for path, (blob, _) in manifest.items():
+                    content = cache.get(blob)
+                    if content is None:
+                        break
+                    served.add(path)
+                    yield path, content
+                else:
+                    return
+                print(f"Snapshot of {owner}/{repo}@{sha} lost files to cache eviction, downloading it again")
+
+        # Step 2: Download the files the cache could not serve
+        for path, content in self.download_branch_files(owner, repo, branch, include_extensions, sha, key):
+            if path not in served:
+                yield path, content
+
+    def branch_snapshot(self, owner: str, repo: str, branch: str, include_extensions: list = None, sha: str = None) -> SourceSnapshot:
+        """
+        The files of a branch, or of the commit sha when given, as a SourceSnapshot that reads each file from the
+        snapshot cache on first access. Only the manifest is held up front. Without a snapshot cache the files are
+        read into the snapshot as they are extracted.
+        """
+        sha = sha or self.resolve_commit_sha(owner, repo, branch)
+        if self.snapshot_cache is None or sha is None:
+            return SourceSnapshot.from_pairs(self.iter_branch_files(owner, repo, branch, include_extensions, sha), ref=sha or branch)
+
+        # Step 1: The cached or incrementally updated manifest, or a download that fills the cache one file at a time
+        key = snapshot_key(owner, repo, sha, include_extensions)
+        manifest = self.cached_manifest(owner, repo, branch, include_extensions, sha, key)
+        if manifest is None:
+            manifest = {}
+            for path, content in self.download_branch_files(owner, repo, branch, include_extensions, sha, key):
+                manifest[path] = [blob_key(content), len(content.encode("utf-8"))]
+
+        # Step 2: Read files on demand, one evicted since is fetched again on its own
+        def load(path: str) -> str:
+            content = self.snapshot_cache.get(manifest[path][0])
+            if content is None:
+                content = self.fetch_file(owner, repo, path, sha).decode("utf-8", errors="ignore")
+                self.store_blob(content)
+            return content
+
+        return SourceSnapshot(manifest.keys(), load, ref=sha)
+
+    def cached_manifest(self, owner: str, repo: str, branch: str, include_extensions: list, sha: str, key: str) -> Optional[Dict[str, list]]:
+        """The manifest of the snapshot at sha, from the cache or patched from the branch's previous snapshot."""
+        manifest = self.load_manifest(key)
+        if manifest is not None:
+            print(f"Snapshot cache hit for {owner}/{repo}@{sha}")
+            return manifest
+        # Patch the branch's previous snapshot with the files changed since, when that is cheaper
+        manifest = self.update_snapshot(owner, repo, branch, include_extensions, sha)
+        if manifest is not None:
+            self.store_manifest(key, manifest, branch_head_key(owner, repo, branch, include_extensions), sha)
+        return manifest
+
+    def download_branch_files(self, owner: str, repo: str, branch: str, include_extensions: list, sha: Optional[str], key: Optional[str]) -> Iterator[Tuple[str, str]]:
+        """Yield (path, content) from the zipball, storing each file and finally the manifest when there is a key to store them under."""
+        cache = self.snapshot_cache if key else None
+
+        # Step 1: Stream the zipped source code to a spooled file. Pinned to a commit it never changes, the snapshot cache covers it
+        zip_url = f"https://api.github.com/repos/{owner}/{repo}/zipball/{sha or branch}"
+        response = self.http.session.get(zip_url, headers=self.api_headers(), stream=True)
+        self.http.record(response, "zipball")
+        response.raise_for_status()
+
+        # Step 2: Extract the selected files one at a time, each goes to the snapshot cache as it passes
+        manifest = {}
+        with response:
+            for path, content in iter_response_zip_files(response, include_extensions):
+                # Drop the owner-repo-sha/ directory GitHub wraps the tree in
+                path = path.split("/", 1)[-1]
+                if cache is not None:
+                    manifest[path] = self.store_blob(content)
+                yield path, content
+
+        if cache is not None:
+            self.store_manifest(key, manifest, branch_head_key(owner, repo, branch, include_extensions), sha)
+
+    def fetch_file(self, owner: str, repo: str, path: str, sha: str) -> bytes:
+        """Raw content of one file at sha."""
+        response = self.http.get(
+            f"https://api.github.com/repos/{owner}/{repo}/contents/{quote(path)}?ref={sha}",
+            headers=self.api_headers("application/vnd.github.raw"),
+            kind="contents",
+        )
+        response.raise_for_status()
+        return response.content
+
+    def load_manifest(self, key: str) -> Optional[Dict[str, list]]:
+        """Path to [file entry key, size in bytes] of a cached snapshot."""
+        cached = self.snapshot_cache.get(key)
+        return json.loads(cached) if cached is not None else None
+
+    def store_blob(self, content: str) -> list:
+        key = blob_key(content)
+        self.snapshot_cache.set(key, content)
+        return [key, len(content.encode("utf-8"))]
+
+    def store_manifest(self, key: str, manifest: Dict[str, list], head_key: str, sha: str):
+        # Written after its files, so a manifest never points at entries that were not stored yet
+        self.snapshot_cache.set(key, json.dumps(manifest))
+        self.snapshot_cache.set(head_key, sha)
+
+    def update_snapshot(self, owner: str, repo: str, branch: str, include_extensions: list, sha: str) -> Optional[Dict[str, list]]:
+        """
+        The manifest of the files at sha, built from the last snapshot cached for the branch plus the files the
+        compare API reports changed since. None when there is no base snapshot, the history diverged, too many
+        files changed or the result is over the total size limit.
+        """
+        # Step 1: Find the base snapshot
+        base_sha = self.snapshot_cache.get(branch_head_key(owner, repo, branch, include_extensions))
+        if base_sha is None or base_sha == sha:
+            return None
+        manifest = self.load_manifest(snapshot_key(owner, repo, base_sha, include_extensions))
+        if manifest is None:
+            return None
+
+        # Step 2: List what changed. After a force push the compare is against the merge base, not the base snapshot
+        response = self.http.get(f"https://api.github.com/repos/{owner}/{repo}/compare/{base_sha}...{sha}", headers=self.api_headers(), kind="compare")
+        if response.status_code != 200:
+            return None
+        comparison = response.json()
+        changed = comparison.get("files", [])
+        # The compare API lists at most 300 files
+        if comparison.get("status") not in ("ahead", "identical") or len(changed) >= 300 or len(changed) > incremental_max_files():
+            return None
+
+        # Step 3: Apply the changes to the base snapshot, fetching only the changed files the filter keeps
+        file_limit = max_file_bytes()
+        for file in changed:
+            if file.get("previous_filename"):
+                manifest.pop(file["previous_filename"], None)
+            if file["status"] == "removed":
+                manifest.pop(file["filename"], None)
+                continue
+            if not selected(file["filename"], include_extensions):
+                continue
+            content = self.fetch_file(owner, repo, file["filename"], sha)
+            if len(content) > file_limit:
+                manifest.pop(file["filename"], None)
+                continue
+            manifest[file["filename"]] = self.store_blob(content.decode("utf-8", errors="ignore"))
+
+        # Step 4: A zipball stops extracting at the total limit, only a download tells which files that leaves out
+        total_limit = max_total_bytes()
+        if sum(size for _, size in manifest.values()) > total_limit:
+            print(f"Updated snapshot of {owner}/{repo} is over the {total_limit} byte total limit, downloading it instead")
+            return None
+
+        print(f"Updated snapshot of {owner}/{repo} from {base_sha[:7]} to {sha[:7]} with {len(changed)} changed files")
+        return manifest
+
+    def get_branch_files(self, owner: str, repo: str, branch: str, include_extensions: list = None, sha: str = None) -> dict:
+        return self.get_branch_snapshot(owner, repo, branch, include_extensions, sha).as_dict()
+
+    def get_branch_snapshot(self, owner: str, repo: str, branch: str, include_extensions: list = None, sha: str = None, exclude_paths: list = None, minify: bool = True) -> SourceSnapshot:
+        """
+        The branch source from the configured provider, GitHub unless SOURCE_PROVIDER says otherwise, without the
+        excluded paths. minify=False keeps file contents verbatim, for callers whose output has to apply to them.
+        """
+        snapshot = self.source_provider.snapshot(owner, repo, branch, include_extensions, sha)
+        if os.getenv("SOURCE_MINIFY", "true").lower() != "true":
+            return snapshot.subset(path for path in snapshot if not any(path_matches(path, pattern) for pattern in exclude_paths or []))
+        return self.minifier.apply(snapshot, f"{owner}/{repo}", exclude_paths, rewrite=minify)
+
     def get_repo_branch_source(
         self,
         owner: str,
         repo: str,
         branch: str,
         include_extensions: list = None,
-    ) -> dict:
+        sha: str = None,
+        exclude_paths: list = None,
+        minify: bool = True,
+    ) -> Union[SourceSnapshot, dict]:
         try:
-            # Step 1: Access the repository
-            # repository = self.g.get_repo(f"{owner}/{repo}")
-
-            # Step 2: Get the zipball archive link for the branch
-            # zip_url = repository.get_archive_link("zipball", ref=branch)
-            zip_url = f"https://api.github.com/repos/{owner}/{repo}/zipball/{branch}"
-
-            # Step 3: Fetch the zipped source code
-            response = requests.get(zip_url)
-            response.raise_for_status()
-
-            # Step 4: Load the zip archive into memory and extract file contents
-            source_code = {}
-            with zipfile.ZipFile(io.BytesIO(response.content)) as z:
-                for file_info in z.infolist():
-                    if file_info.filename.endswith("/"):  # Skip directories
-                        continue
-
-                    # Step 4.1 Extract only specific file extensions (if specified)
-                    if include_extensions and not any(
-                        file_info.filename.endswith(ext) for ext in include_extensions
-                    ):
-                        continue
-
-                    # Step 4.2: Read file content
-                    with z.open(file_info.filename) as file:
-                        try:
-                            content = file.read().decode("utf-8", errors="ignore")
-                            source_code[file_info.filename] = content
-                        except Exception as e:
-                            print(f"Failed to process {file_info.filename}: {e}")
-
-            return source_code
-
+            return self.get_branch_snapshot(owner, repo, branch, include_extensions, sha, exclude_paths, minify)
         except requests.exceptions.RequestException as e:
             return {"error": f"Failed to fetch zipball: {e}"}
         except zipfile.BadZipFile:
@@ -102,29 +536,8 @@ class GitHubApp:
         except Exception as e:
             return {"error": str(e)}
 
-    def prepare_repo_feature_branch(self, temp_dir: str, owner: str, repository: str, base_branch: str, feature_branch: str) -> Tuple[bool, git.Repo]:
-        """Clone repo, checkout to feature branch"""
-        repo_url = f"git@github.com:{owner}/{repository}.git"
-        print(f"Cloning repository {owner}/{repository} into {temp_dir}...")
-
-        # Clone repository
-        repo_path = os.path.join(temp_dir, repository)
-        repo = git.Repo.clone_from(repo_url, repo_path)
-
-        # Fetch the latest changes
-        repo.git.fetch()
-
-        # Ensure we are on the latest base branch
-        print(f"Checking out base branch {base_branch}...")
-        repo.git.checkout(base_branch)
-        repo.git.pull("origin", base_branch)
-
-        # Create and checkout new feature branch from base branch
-        print(f"Creating new branch {feature_branch} from {base_branch}...")
-        new_branch = repo.create_head(feature_branch)
-        repo.head.reference = new_branch
-        repo.head.reset(index=True, working_tree=True)
-        return True, repo
+    def rate_limit(self) -> Optional[dict]:
+        return self.http.rate_limit()
 
     def apply_diff(self, repo: git.Repo, diff_file: str) -> bool:
         # Apply the diff
@@ -149,9 +562,10 @@ class GitHubApp:
         return True
 
     def create_pull_request(self, owner: str, repository: str, title: str, description: str, feature_branch: str, base_branch: str) -> Tuple[bool, int, str]:
-        repo = self.g.get_repo(f"{owner}/{repository}")
+        repo = self.get_repo(owner, repository)
         # Create a pull request
         print("Creating a Pull Request...")
+        self.http.count("pulls.create")
         pr = repo.create_pull(
             title=title,
             body=description,
@@ -162,10 +576,8 @@ class GitHubApp:
         return True, pr.id, pr.html_url
 
     def apply_diff_and_raise_pr(self, owner: str, repository: str, feature_branch: str, base_branch: str, commit_message: str, pr_title: str, pr_description: str, diff_file_path: str = "", diff_str: str = "") -> Tuple[bool, int, str]:
-        with tempfile.TemporaryDirectory() as temp_dir:
-            ok, repo = self.prepare_repo_feature_branch(temp_dir, owner, repository, base_branch, feature_branch)
-            if not ok:
-                return False, -1, ""
+        # Work in a worktree of the local mirror, only what changed since the last PR against the repository is fetched
+        with tempfile.TemporaryDirectory() as temp_dir, self.mirrors.worktree(owner, repository, base_branch, feature_branch) as repo:
             if diff_str:
                 diff_file_path = os.path.join(temp_dir, "pr.diff")
                 with open(diff_file_path, "w") as file:
@@ -0,0 +1,252 @@
+import io
+import os
+import json
+import tokenize
+import fnmatch
+import threading
+from typing import Dict, Iterable, List
+
+from core.llm_handlers.tokens import estimate_tokens
+from .snapshot import SourceSnapshot, compact
+
+# Paths that never help a model understand a service: dependencies, lockfiles, generated code and docs
+DEFAULT_EXCLUDES = [
+    "vendor/*", "node_modules/*", "third_party/*",
+    "go.sum", "package-lock.json", "yarn.lock", "pnpm-lock.yaml", "poetry.lock", "Pipfile.lock", "Cargo.lock",
+    "*.pb.go", "*.pb.gw.go", "*_gen.go", "*.min.js", "*.map",
+    "docs/docs.go", "docs/swagger.json", "docs/swagger.yaml",
+]
+TEST_EXCLUDES = ["*_test.go", "test_*.py", "*_test.py", "*.spec.ts", "*.test.ts", "*.test.js", "test/*", "tests/*", "testdata/*", "__tests__/*"]
+
+SLASH_COMMENTS = (".go", ".js", ".jsx", ".ts", ".tsx", ".java", ".kt", ".cs", ".c", ".h", ".cpp", ".rs", ".swift", ".scala")
+# YAML is left alone: a " # " inside a block-scalar description is text, not a comment
+HASH_COMMENTS = (".py", ".rb", ".sh", ".toml")
+# Single-quoted shell words and TOML literal strings take no escapes
+LITERAL_SINGLE_QUOTES = (".sh", ".toml")
+DATA_FILES = (".json", ".yaml", ".yml")
+# Only fixture data is collapsed, API specs and project descriptions are what the prompts are about
+DEFAULT_FIXTURE_PATHS = ["testdata/*", "fixtures/*", "__fixtures__/*"]
+SPEC_FILE_HINTS = (".project.json", "openapi", "swagger", "asyncapi")
+
+
+def path_matches(path: str, pattern: str) -> bool:
+    """
+    Glob match of a repository path. Patterns without a slash match file names anywhere, patterns with one match
+    the path or any of its sub-paths, so "vendor/*" also excludes "cmd/api/vendor/x.go".
+    """
+    if "/" not in pattern:
+        return fnmatch.fnmatch(os.path.basename(path), pattern)
+    parts = path.split("/")
+    return any(fnmatch.fnmatch("/".join(parts[index:]), pattern) for index in range(len(parts)))
+
+
+def strip_slash_comments(content: str) -> str:
+    """
+    Drop // and /* */ comments, leaving string, rune and raw string literals alone. // comments that start with @
+    are kept: swaggo annotations such as "// @Router /users [get]" are the API spec of a Go service.
+    """
+    out: List[str] = []
+    index, length = 0, len(content)
+    while index < length:
+        char = content[index]
+        if char in "\"'`":
+            end = index + 1
+            while end < length and content[end] != char:
+                if content[end] == "\\" and char != "`":
+                    end += 1
+                elif content[end] == "\n" and char != "`":
+                    break
+                end += 1
+            out.append(content[index:end + 1])
+            index = end + 1
+        elif content.startswith("//", index):
+            end = content.find("\n", index)
+            end = length if end == -1 else end
+            if content[index + 2:end].lstrip().startswith("@"):
+                out.append(content[index:end])
+            index = end
+        elif content.startswith("/*", index):
+            end = content.find("*/", index + 2)
+            index = length if end == -1 else end + 2
+        else:
+            out.append(char)
+            index += 1
+    return "".join(out)
+
+
+def strip_python_comments(content: str) -> str:
+    """Drop # comments found by tokenize, so strings and docstrings are never cut. Source that does not tokenize is kept."""
+    cuts = {}
+    try:
+        for token in tokenize.generate_tokens(io.StringIO(content).readline):
+            if token.type != tokenize.COMMENT:
+                continue
+            row, column = token.start
+            if row <= 2 and column == 0 and (token.string.startswith("#!") or "coding" in token.string):
+                continue
+            cuts[row - 1] = column
+    except (tokenize.TokenError, SyntaxError):
+        return content
+    lines = content.split("\n")
+    if lines[-1] == "":
+        lines.pop()
+    return "\n".join(line[:cuts[number]].rstrip() if number in cuts else line for number, line in enumerate(lines))
+
+
+def strip_hash_comments(content: str, single_quote_escapes: bool = True) -> str:
+    """
+    Drop # comments that start a line or follow whitespace outside quotes. Strings may span lines and be triple
+    quoted, and a backslash escapes the next character except inside single quotes when single_quote_escapes is
+    off (shell, TOML literal strings). Shebangs and encoding lines are kept. Content that ends inside a string was
+    not understood and is returned as is.
+    """
+    lines = content.split("\n")
+    if lines[-1] == "":
+        lines.pop()
+    quote = None
+    for number, line in enumerate(lines):
+        if number < 2 and line.startswith("#") and ("!" in line[:2] or "coding" in line):
+            continue
+        position = 0
+        while position < len(line):
+            char = line[position]
+            if char == "\\" and (quote is None or quote[0] == '"' or single_quote_escapes):
+                position += 2
+            elif quote:
+                if line.startswith(quote, position):
+                    position += len(quote)
+                    quote = None
+                else:
+                    position += 1
+            elif char in "\"'":
+                quote = char * 3 if line.startswith(char * 3, position) else char
+                position += len(quote)
+            elif char == "#" and (position == 0 or line[position - 1] in " \t"):
+                lines[number] = line[:position].rstrip()
+                break
+            else:
+                position += 1
+    if quote:
+        return content
+    return "\n".join(lines)
+
+
+def collapse_json(value, max_items: int):
+    if isinstance(value, list):
+        collapsed = [collapse_json(item, max_items) for item in value[:max_items]]
+        if len(value) > max_items:
+            collapsed.append(f"... {len(value) - max_items} more items")
+        return collapsed
+    if isinstance(value, dict):
+        return {key: collapse_json(item, max_items) for key, item in value.items()}
+    return value
+
+
+class Minifier:
+    """
+    Shrinks a source snapshot before it goes into a prompt.
+
+    Paths are excluded by glob first, without reading any file: the default dependency, lockfile and generated-code
+    globs, tests unless keep_tests, and the per-branch excluded_paths. When rewrite is on, the files that remain
+    lose their comments and blank-line runs, and JSON/YAML fixtures under fixture_paths over max_data_bytes are
+    cut down to a sample. API specs are never cut, wherever they live.
+    Tokens saved are tallied per repository as files are read.
+    """
+
+    def __init__(self, excludes: Iterable[str] = (), keep_tests: bool = False, strip_comments: bool = True, max_data_bytes: int = 16 * 1024, max_data_items: int = 3, fixture_paths: Iterable[str] = None):
+        self.excludes = list(DEFAULT_EXCLUDES) + ([] if keep_tests else list(TEST_EXCLUDES)) + list(excludes)
+        self.strip_comments = strip_comments
+        self.max_data_bytes = max_data_bytes
+        self.max_data_items = max_data_items
+        self.fixture_paths = list(DEFAULT_FIXTURE_PATHS if fixture_paths is None else fixture_paths)
+        self.lock = threading.Lock()
+        self.reports: Dict[str, dict] = {}
+
+    @classmethod
+    def from_env(cls) -> "Minifier":
+        """SOURCE_EXCLUDE_PATHS adds comma-separated globs for every repository, the SOURCE_MINIFY_* variables tune the rest."""
+        fixture_paths = os.getenv("SOURCE_MINIFY_FIXTURE_PATHS")
+        return cls(
+            excludes=[pattern.strip() for pattern in os.getenv("SOURCE_EXCLUDE_PATHS", "").split(",") if pattern.strip()],
+            keep_tests=os.getenv("SOURCE_MINIFY_KEEP_TESTS", "false").lower() == "true",
+            strip_comments=os.getenv("SOURCE_MINIFY_STRIP_COMMENTS", "true").lower() == "true",
+            max_data_bytes=int(os.getenv("SOURCE_MINIFY_MAX_DATA_BYTES", 16 * 1024)),
+            fixture_paths=None if fixture_paths is None else [pattern.strip() for pattern in fixture_paths.split(",") if pattern.strip()],
+        )
+
+    def excluded(self, path: str, excludes: Iterable[str] = ()) -> bool:
+        return any(path_matches(path, pattern) for pattern in [*self.excludes, *excludes])
+
+    def fixture(self, path: str) -> bool:
+        if any(hint in path.lower() for hint in SPEC_FILE_HINTS):
+            return False
+        return path.endswith(DATA_FILES) and any(path_matches(path, pattern) for pattern in self.fixture_paths)
+
+    def rewrite(self, path: str, content: str) -> str:
+        if self.strip_comments and path.endswith(SLASH_COMMENTS):
+            content = strip_slash_comments(content)
+        elif self.strip_comments and path.endswith(".py"):
+            content = strip_python_comments(content)
+        elif self.strip_comments and path.endswith(HASH_COMMENTS):
+            content = strip_hash_comments(content, single_quote_escapes=not path.endswith(LITERAL_SINGLE_QUOTES))
+        if len(content) > self.max_data_bytes and self.fixture(path):
+            content = self.collapse_data(path, content)
+        return compact(content)
+
+    def collapse_data(self, path: str, content: str) -> str:
+        if path.endswith(".json"):
+            try:
+                return json.dumps(collapse_json(json.loads(content), self.max_data_items), indent=1)
+            except ValueError:
+                pass
+        return f"{content[:self.max_data_bytes]}\n# ... {len(content) - self.max_data_bytes} more bytes"
+
+    def record(self, repo: str, before: int, after: int, excluded: int = 0, excluded_tokens: int = 0):
+        with self.lock:
+            report = self.reports.setdefault(repo, {"files_excluded": 0, "tokens_excluded": 0, "files_rewritten": 0, "tokens_before": 0, "tokens_after": 0})
+            report["files_excluded"] += excluded
+            report["tokens_excluded"] += excluded_tokens
+            if before or after:
+                report["files_rewritten"] += 1
+                report["tokens_before"] += before
+                report["tokens_after"] += after
+
+    def apply(self, snapshot: SourceSnapshot, repo: str, excludes: Iterable[str] = (), rewrite: bool = True) -> SourceSnapshot:
+        """The snapshot without excluded paths, with files rewritten as they are read when rewrite is on."""
+        excludes = list(excludes or [])
+        kept = [path for path in snapshot if not self.excluded(path, excludes)]
+        # Excluded files are only counted when their content was read anyway, listing them costs nothing
+        excluded = set(snapshot) - set(kept)
+        excluded_tokens = sum(estimate_tokens(snapshot.contents[path]) for path in excluded if path in snapshot.contents)
+        self.record(repo, 0, 0, excluded=len(excluded), excluded_tokens=excluded_tokens)
+        if not rewrite:
+            return snapshot.subset(kept)
+
+        def load(path: str) -> str:
+            content = snapshot[path]
+            minified = self.rewrite(path, content)
+            self.record(repo, estimate_tokens(content), estimate_tokens(minified))
+            return minified
+
+        return SourceSnapshot(kept, load, ref=snapshot.ref)
+
+    def stats(self) -> Dict[str, dict]:
+        """Per repository: files excluded and rewritten, their tokens, and the tokens saved in total."""
+        with self.lock:
+            return {
+                repo: {**report, "tokens_saved": report["tokens_excluded"] + report["tokens_before"] - report["tokens_after"]}
+                for repo, report in self.reports.items()
+            }
+
+
+_minifier = None
+_minifier_lock = threading.Lock()
+
+
+def default_minifier() -> Minifier:
+    """Process-wide Minifier configured from the environment."""
+    global _minifier
+    with _minifier_lock:
+        if _minifier is None:
+            _minifier = Minifier.from_env()
+        return _minifier
@@ -0,0 +1,157 @@
+import os
+import uuid
+import shutil
+import tempfile
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional
+
+import git
+
+# Remote branches live under refs/remotes/origin in the mirror, so a push never rewrites what a fetch brought in
+FETCH_REFSPEC = "+refs/heads/*:refs/remotes/origin/*"
+
+
+def directory_size(path: str) -> int:
+    total = 0
+    for directory, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(directory, name))
+            except OSError:
+                pass
+    return total
+
+
+class GitMirrorPool:
+    """
+    Local bare mirrors of remote repositories, one per repository, with a throwaway worktree per feature branch.
+
+    The first use of a repository clones it, later uses only fetch what changed. worktree() checks a branch out of
+    the mirror in its own directory, shares the mirror's objects and removes itself afterwards. Once the mirrors
+    grow past max_bytes the least recently used ones not in use are deleted.
+    """
+
+    def __init__(self, root: str, max_bytes: int = 0, url_template: str = "git@github.com:{owner}/{repo}.git"):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.url_template = url_template
+        self.lock = threading.Lock()
+        self.repo_locks: Dict[str, threading.Lock] = {}
+        self.in_use: Dict[str, int] = {}
+        self.clones = 0
+        self.fetches = 0
+        self.evictions = 0
+
+    @classmethod
+    def from_env(cls) -> "GitMirrorPool":
+        """Mirrors under GIT_MIRROR_DIR, bounded by GIT_MIRROR_MAX_BYTES (0 for no limit)."""
+        return cls(
+            root=os.getenv("GIT_MIRROR_DIR", os.path.join(tempfile.gettempdir(), "adapt-git-mirrors")),
+            max_bytes=int(os.getenv("GIT_MIRROR_MAX_BYTES", 0)),
+            url_template=os.getenv("GIT_MIRROR_URL_TEMPLATE", "git@github.com:{owner}/{repo}.git"),
+        )
+
+    def mirror_path(self, owner: str, repo: str) -> str:
+        return os.path.abspath(os.path.join(self.root, "mirrors", owner, f"{repo}.git"))
+
+    def repo_lock(self, path: str) -> threading.Lock:
+        with self.lock:
+            return self.repo_locks.setdefault(path, threading.Lock())
+
+    def mirror(self, owner: str, repo: str) -> git.Repo:
+        """The up-to-date bare mirror of owner/repo, cloned on first use and fetched afterwards."""
+        path = self.mirror_path(owner, repo)
+        with self.repo_lock(path):
+            if os.path.isdir(path):
+                mirror = git.Repo(path)
+                mirror.git.fetch("origin", "--prune")
+                mirror.git.worktree("prune")
+                self.fetches += 1
+            else:
+                url = self.url_template.format(owner=owner, repo=repo)
+                print(f"Creating mirror of {owner}/{repo} in {path}...")
+                mirror = git.Repo.clone_from(url, path, bare=True)
+                mirror.git.config("remote.origin.fetch", FETCH_REFSPEC)
+                mirror.git.fetch("origin")
+                # The bare clone's own copies of the branches would shadow the fetched ones
+                for head in list(mirror.heads):
+                    mirror.git.update_ref("-d", head.path)
+                self.clones += 1
+            os.utime(path)
+            return mirror
+
+    @contextmanager
+    def worktree(self, owner: str, repo: str, base_branch: str, feature_branch: str) -> Iterator[git.Repo]:
+        """A checkout of feature_branch created from the latest base_branch, removed when the block exits."""
+        mirror_path = self.mirror_path(owner, repo)
+        with self.lock:
+            self.in_use[mirror_path] = self.in_use.get(mirror_path, 0) + 1
+        path = os.path.join(os.path.abspath(self.root), "worktrees", f"{owner}-{repo}-{uuid.uuid4().hex[:12]}")
+        mirror = None
+        try:
+            mirror = self.mirror(owner, repo)
+            print(f"Checking out {feature_branch} from {base_branch} in {path}...")
+            mirror.git.worktree("add", "-B", feature_branch, path, f"origin/{base_branch}")
+            yield git.Repo(path)
+        finally:
+            if mirror is not None:
+                with self.repo_lock(mirror_path):
+                    if os.path.isdir(path):
+                        mirror.git.worktree("remove", "--force", path)
+                    mirror.git.worktree("prune")
+                    if feature_branch in [head.name for head in mirror.heads]:
+                        mirror.git.branch("-D", feature_branch)
+            with self.lock:
+                self.in_use[mirror_path] -= 1
+            self.enforce_limit()
+
+    def mirrors(self) -> List[str]:
+        base = os.path.abspath(os.path.join(self.root, "mirrors"))
+        if not os.path.isdir(base):
+            return []
+        return [
+            os.path.join(base, owner, name)
+            for owner in os.listdir(base)
+            for name in os.listdir(os.path.join(base, owner))
+        ]
+
+    def enforce_limit(self):
+        """Delete the least recently used idle mirrors until the pool fits in max_bytes."""
+        if self.max_bytes <= 0:
+            return
+        sizes = {path: directory_size(path) for path in self.mirrors()}
+        total = sum(sizes.values())
+        for path in sorted(sizes, key=os.path.getmtime):
+            if total <= self.max_bytes:
+                break
+            with self.lock:
+                if self.in_use.get(path, 0) > 0:
+                    continue
+            with self.repo_lock(path):
+                shutil.rmtree(path, ignore_errors=True)
+            total -= sizes[path]
+            self.evictions += 1
+            print(f"Evicted git mirror {path}, pool is {total} bytes")
+
+    def stats(self) -> dict:
+        return {
+            "mirrors": len(self.mirrors()),
+            "size_bytes": sum(directory_size(path) for path in self.mirrors()),
+            "clones": self.clones,
+            "fetches": self.fetches,
+            "evictions": self.evictions,
+        }
+
+
+_mirror_pool: Optional[GitMirrorPool] = None
+_mirror_pool_lock = threading.Lock()
+
+
+def default_mirror_pool() -> GitMirrorPool:
+    """Process-wide GitMirrorPool configured from the environment."""
+    global _mirror_pool
+    with _mirror_pool_lock:
+        if _mirror_pool is None:
+            _mirror_pool = GitMirrorPool.from_env()
+        return _mirror_pool
@@ -0,0 +1,96 @@
+import os
+from abc import ABC, abstractmethod
+
+import git
+
+from .archive import selected, max_file_bytes
+from .snapshot import SourceSnapshot
+from .mirrors import GitMirrorPool, default_mirror_pool
+
+
+class SourceProvider(ABC):
+    """Where the source of a branch comes from."""
+
+    @abstractmethod
+    def snapshot(self, owner: str, repo: str, branch: str, include_extensions: list = None, sha: str = None) -> SourceSnapshot:
+        pass
+
+
+class GitHubSourceProvider(SourceProvider):
+    """Branch sources from github.com zipballs, through the GitHubApp's caches."""
+
+    def __init__(self, app):
+        self.app = app
+
+    def snapshot(self, owner: str, repo: str, branch: str, include_extensions: list = None, sha: str = None) -> SourceSnapshot:
+        return self.app.branch_snapshot(owner, repo, branch, include_extensions, sha)
+
+
+class LocalGitSourceProvider(SourceProvider):
+    """
+    Branch sources from repositories on disk: the bare mirrors of a GitMirrorPool, or repositories found through
+    path_template such as fixtures and clones kept current by someone else.
+
+    Mirrors are fetched before a branch is read, only a commit the mirror already holds is read without a fetch.
+    The tree is listed up front and file contents are read on first access through GitPython's persistent
+    `git cat-file --batch` process, so a snapshot only reads the blobs that are used.
+    """
+
+    def __init__(self, path_template: str = None, mirrors: GitMirrorPool = None):
+        if (path_template is None) == (mirrors is None):
+            raise ValueError("LocalGitSourceProvider needs either a path_template or a mirror pool")
+        self.path_template = path_template
+        self.mirrors = mirrors
+
+    def repository(self, owner: str, repo: str, sha: str = None) -> git.Repo:
+        if self.mirrors is None:
+            return git.Repo(self.path_template.format(owner=owner, repo=repo))
+        # A commit never changes once the mirror has it, a branch or a new PR head needs a fetch
+        path = self.mirrors.mirror_path(owner, repo)
+        if sha and os.path.isdir(path):
+            repository = git.Repo(path)
+            try:
+                repository.commit(sha)
+                return repository
+            except (git.BadName, ValueError):
+                pass
+        return self.mirrors.mirror(owner, repo)
+
+    def resolve(self, repository: git.Repo, branch: str, sha: str = None) -> git.Commit:
+        if sha:
+            return repository.commit(sha)
+        # Mirrors keep branches as remote-tracking refs, plain clones and fixtures as local branches
+        for ref in (f"refs/remotes/origin/{branch}", f"refs/heads/{branch}", branch):
+            try:
+                return repository.commit(ref)
+            except (git.BadName, ValueError):
+                continue
+        raise ValueError(f"Branch {branch} not found in {repository.git_dir}")
+
+    def snapshot(self, owner: str, repo: str, branch: str, include_extensions: list = None, sha: str = None) -> SourceSnapshot:
+        repository = self.repository(owner, repo, sha)
+        commit = self.resolve(repository, branch, sha)
+        file_limit = max_file_bytes()
+        blobs = {
+            blob.path: blob.binsha
+            for blob in commit.tree.traverse()
+            if blob.type == "blob" and selected(blob.path, include_extensions) and blob.size <= file_limit
+        }
+
+        def load(path: str) -> str:
+            return repository.odb.stream(blobs[path]).read().decode("utf-8", errors="ignore")
+
+        return SourceSnapshot(blobs.keys(), load, ref=commit.hexsha)
+
+
+def source_provider_from_env(app) -> SourceProvider:
+    """
+    SOURCE_PROVIDER=local reads branches from the repositories LOCAL_SOURCE_PATH_TEMPLATE points at when it is set,
+    otherwise from the git mirror pool's mirrors, fetched as they are read. Anything else fetches them from GitHub.
+    """
+    if os.getenv("SOURCE_PROVIDER", "github") == "local":
+        path_template = os.getenv("LOCAL_SOURCE_PATH_TEMPLATE")
+        if path_template:
+            return LocalGitSourceProvider(path_template)
+        return LocalGitSourceProvider(mirrors=default_mirror_pool())
+    return GitHubSourceProvider(app)
@@ -0,0 +1,114 @@
+import os
+import re
+import json
+import fnmatch
+from typing import Callable, Dict, Iterable, Iterator, List, Mapping, Optional, Tuple
+
+from core.llm_handlers.budget import render_files
+
+
+def render_raw(files: Mapping[str, str]) -> str:
+    """The `--- path ---` layout every source dump in this repo uses."""
+    return render_files(files)
+
+
+def render_fenced(files: Mapping[str, str]) -> str:
+    """One Markdown code fence per file, tagged with the path."""
+    return "".join(f"```{path}\n{content}\n```\n" for path, content in files.items())
+
+
+def render_compact(files: Mapping[str, str]) -> str:
+    """The raw layout without trailing whitespace and blank-line runs, which cost tokens and carry no meaning."""
+    return render_files({path: compact(content) for path, content in files.items()})
+
+
+def render_json(files: Mapping[str, str]) -> str:
+    """A JSON object of path to content, encoded once."""
+    return json.dumps(dict(files.items()))
+
+
+def compact(content: str) -> str:
+    content = re.sub(r"[ \t]+$", "", content, flags=re.MULTILINE)
+    return re.sub(r"\n{3,}", "\n\n", content).strip("\n")
+
+
+RENDERERS: Dict[str, Callable[[Mapping[str, str]], str]] = {
+    "raw": render_raw,
+    "fenced": render_fenced,
+    "compact": render_compact,
+    "json": render_json,
+}
+
+
+def register_renderer(name: str, renderer: Callable[[Mapping[str, str]], str]):
+    RENDERERS[name] = renderer
+
+
+def default_renderer() -> str:
+    """Renderer prompts use, SOURCE_RENDERER (default raw)."""
+    return os.getenv("SOURCE_RENDERER", "raw")
+
+
+def render_source(files: Mapping[str, str], renderer: Optional[str] = None) -> str:
+    """files as prompt text, with the named renderer or the default one."""
+    name = renderer or default_renderer()
+    if name not in RENDERERS:
+        raise ValueError(f"Unknown source renderer {name}, expected one of {sorted(RENDERERS)}")
+    return RENDERERS[name](files)
+
+
+class SourceSnapshot(Mapping[str, str]):
+    """
+    The files of one source tree at one ref, as a read-only mapping of repository-relative path to content.
+
+    The path index is known up front while contents are loaded on first access and kept, so a provider can list
+    a tree cheaply and only read the files a prompt ends up using. render() turns the snapshot, or any subset of
+    it, into prompt text without a second encoding pass.
+    """
+
+    def __init__(self, paths: Iterable[str], load: Callable[[str], str], ref: str = None):
+        self.paths: List[str] = list(paths)
+        self.index = set(self.paths)
+        self.load = load
+        self.ref = ref
+        self.contents: Dict[str, str] = {}
+
+    @classmethod
+    def from_files(cls, files: Mapping[str, str], ref: str = None) -> "SourceSnapshot":
+        snapshot = cls(files.keys(), files.__getitem__, ref)
+        snapshot.contents = dict(files.items())
+        return snapshot
+
+    @classmethod
+    def from_pairs(cls, pairs: Iterable[Tuple[str, str]], ref: str = None) -> "SourceSnapshot":
+        return cls.from_files(dict(pairs), ref)
+
+    def __getitem__(self, path: str) -> str:
+        if path not in self.index:
+            raise KeyError(path)
+        if path not in self.contents:
+            self.contents[path] = self.load(path)
+        return self.contents[path]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.paths)
+
+    def __len__(self) -> int:
+        return len(self.paths)
+
+    def __contains__(self, path) -> bool:
+        return path in self.index
+
+    def glob(self, pattern: str) -> List[str]:
+        return [path for path in self.paths if fnmatch.fnmatch(path, pattern)]
+
+    def subset(self, paths: Iterable[str]) -> "SourceSnapshot":
+        """The snapshot restricted to paths, sharing loaded contents."""
+        wanted = set(paths)
+        return SourceSnapshot([path for path in self.paths if path in wanted], self.__getitem__, self.ref)
+
+    def render(self, renderer: Optional[str] = None) -> str:
+        return render_source(self, renderer)
+
+    def as_dict(self) -> Dict[str, str]:
+        return {path: self[path] for path in self.paths}
@@ -1,13 +1,14 @@
+import os
 import requests
 import zipfile
-import io
-import json
 from github import Github
 
+from .snapshot import SourceSnapshot
 
-def get_branch_source(repo: str, branch: str, include_extensions: list = None) -> str:
+
+def get_branch_files(repo: str, branch: str, include_extensions: list = None) -> dict:
     """
-    Fetch the source content of a branch in a GitHub repository and save it as a single text file.
+    Fetch the files of a branch in a GitHub repository.
 
     Args:
         repo (str): The GitHub repository in the format "owner/repo".
@@ -15,44 +16,50 @@ def get_branch_source(repo: str, branch: str, include_extensions: list = None) -
         include_extensions (list): List of file extensions to include (e.g., ['.py', '.txt']). If None, include all files.
 
     Returns:
-        str: output string
+        dict: file path -> file content
+    """
+    # Imported here, githubutils pulls in GitPython which only the propagation engine needs installed
+    from .githubutils import GitHubApp
+
+    # Served from the commit-keyed snapshot cache when GITHUB_SNAPSHOT_CACHE_DIR is set
+    owner, name = repo.split("/")
+    return GitHubApp(os.getenv("GITHUB_API_TOKEN")).get_branch_files(owner, name, branch, include_extensions)
+
+
+def get_branch_snapshot(repo: str, branch: str, include_extensions: list = None, exclude_paths: list = None) -> SourceSnapshot:
+    """
+    Fetch the source snapshot of a branch in a GitHub repository.
+
+    Args:
+        repo (str): The GitHub repository in the format "owner/repo".
+        branch (str): The branch name to fetch the source for.
+        include_extensions (list): List of file extensions to include (e.g., ['.py', '.txt']). If None, include all files.
+        exclude_paths (list): Globs of paths to leave out (e.g., ['docs/*']), on top of the minifier's defaults.
+
+    Returns:
+        SourceSnapshot: file path -> minified file content, rendered for prompts with render()
     """
-    # GitHub API URL to get branch content
-    archive_url = f"https://api.github.com/repos/{repo}/zipball/{branch}"
+    from .githubutils import GitHubApp
+
+    owner, name = repo.split("/")
+    return GitHubApp(os.getenv("GITHUB_API_TOKEN")).get_branch_snapshot(owner, name, branch, include_extensions, exclude_paths=exclude_paths)
 
+
+def get_branch_source(repo: str, branch: str, include_extensions: list = None, renderer: str = None) -> str:
+    """
+    Fetch the source content of a branch in a GitHub repository as a single text.
+
+    Args:
+        repo (str): The GitHub repository in the format "owner/repo".
+        branch (str): The branch name to fetch the source for.
+        include_extensions (list): List of file extensions to include (e.g., ['.py', '.txt']). If None, include all files.
+        renderer (str): Name of the SourceSnapshot renderer, SOURCE_RENDERER when not given.
+
+    Returns:
+        str: output string
+    """
     try:
-        # Fetch the zipped source code
-        response = requests.get(archive_url)
-        response.raise_for_status()
-
-        # Load the zip archive into memory
-        with zipfile.ZipFile(io.BytesIO(response.content)) as z:
-            # Filter files by extension and collect content
-            collected_content = []
-            for file_info in z.infolist():
-                if file_info.filename.endswith("/"):  # Skip directories
-                    continue
-
-                # Filter by specified extensions
-                if include_extensions:
-                    if not any(
-                        file_info.filename.endswith(ext) for ext in include_extensions
-                    ):
-                        continue
-
-                # Read and collect file content
-                with z.open(file_info.filename) as file:
-                    try:
-                        content = file.read().decode(
-                            "utf-8", errors="ignore"
-                        )  # Decode file content
-                        collected_content.append(
-                            f"--- {file_info.filename} ---\n{content}\n"
-                        )
-                    except Exception as e:
-                        print(f"Failed to process {file_info.filename}: {e}")
-
-        return "\n".join(collected_content)
+        return get_branch_snapshot(repo, branch, include_extensions).render(renderer)
     except requests.exceptions.RequestException as e:
         return f"Error fetching branch source: {e}"
     except zipfile.BadZipFile:
@@ -60,8 +67,8 @@ def get_branch_source(repo: str, branch: str, include_extensions: list = None) -
 
 
 def get_branch_source_dump(repo: str, branch: str, included_extensions: list) -> str:
-    source = get_branch_source(repo, branch, included_extensions)
-    return json.dumps(source)
+    # A JSON object of path to content, rather than the rendered text encoded as one JSON string
+    return get_branch_source(repo, branch, included_extensions, renderer="json")
 
 
 if __name__ == "__main__":
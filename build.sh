@@ -25,6 +25,7 @@ if [ "$1" == "centralsystem" ] || [ "$1" == "all" ]; then
     # Copy the necessary files for the central system into the build directory
     cp -r ../central_system .
     cp -r ../adaptutils .
+    cp -r ../core .
     cp central_system/dockerfile .
     cp central_system/requirements.txt .
     cp central_system/main.py .
@@ -60,6 +61,7 @@ if [ "$1" == "detectionengine.github" ] || [ "$1" == "all" ]; then
     # Copy the necessary files for the detection engine into the build directory
     cp -r ../detection_engine .
     cp -r ../adaptutils .
+    cp -r ../core .
     cp detection_engine/github/dockerfile .
     cp detection_engine/requirements.txt .
     cp detection_engine/github/app.py .
@@ -94,6 +96,7 @@ if [ "$1" == "detectionengine.jira" ] || [ "$1" == "all" ]; then
     # Copy the necessary files for the detection engine into the build directory
     cp -r ../detection_engine .
     cp -r ../adaptutils .
+    cp -r ../core .
     cp detection_engine/jira/dockerfile .
     cp detection_engine/requirements.txt .
     cp detection_engine/jira/app.py .
@@ -112,6 +115,37 @@ if [ "$1" == "detectionengine.jira" ] || [ "$1" == "all" ]; then
 fi
 
 
+# Check if the first argument is llmgateway or not, and if it's the case or if the first argument is all.
+if [ "$1" == "llmgateway" ] || [ "$1" == "all" ]; then
+    # Log the start of building the LLM gateway
+    echo "Building LLM Gateway"
+
+    # Remove any existing build directory to ensure a clean build
+    cd $cwd
+    rm -rf build
+
+    # Create a new build directory
+    mkdir build
+
+    # Change into the build directory
+    cd build
+
+    # Copy the necessary files for the LLM gateway into the build directory
+    cp -r ../llm_gateway .
+    cp -r ../core .
+    cp llm_gateway/dockerfile .
+    cp llm_gateway/requirements.txt .
+    cp llm_gateway/app.py .
+
+    # Build a Docker image tagged as sms2sakthivel/adapt_llm_gateway:latest and log the success message
+    IMAGE_NAME="sms2sakthivel/adapt_llm_gateway"
+    docker build -t $IMAGE_NAME:latest .
+    if [ "$2" == "push" ] || [ "$3" == "push" ] || [ "$4" == "push" ]; then
+        # Push the image if the build succeeds
+        docker push "$IMAGE_NAME:latest"
+    fi
+    echo "LLM Gateway is built Successfully...!"
+fi
 
 # Check if the first argument is propagationengine or not, and if it's the case or if the first argument is all.
 if [ "$1" == "propagationengine" ] || [ "$1" == "all" ]; then
@@ -131,6 +165,7 @@ if [ "$1" == "propagationengine" ] || [ "$1" == "all" ]; then
     # Copy the necessary files for the propagation engine into the build directory
     cp -r ../propagation_engine .
     cp -r ../adaptutils .
+    cp -r ../core .
     cp propagation_engine/dockerfile .
     cp propagation_engine/requirements.txt .
     cp propagation_engine/app.py .
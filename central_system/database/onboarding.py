@@ -129,6 +129,7 @@ class RepoBranch(Base, TimestampMixin):
     repository_id = Column(Integer, ForeignKey("repositories.id"))
     branch = Column(String, nullable=False)
     included_extensions = Column(JSONEncodedList, nullable=False)
+    excluded_paths = Column(JSONEncodedList)
     status = Column(Enum(Status), nullable=False)
     guid = Column(String, unique=True)
     jira_instance_url = Column(String)
@@ -57,6 +57,42 @@ class OnboardingDataModel(BaseModel):
     communication_protocol: str
     is_tls_supported: bool
 
+    @classmethod
+    def merge(cls, parts: List["OnboardingDataModel"]) -> "OnboardingDataModel":
+        """Combine the results of analysing a repository chunk by chunk."""
+        exposed: Dict[str, ExposedEndpoint] = {}
+        consumed: Dict[tuple, ConsumedEndpoint] = {}
+        for part in parts:
+            for endpoint in part.exposed_endpoints:
+                merged = exposed.setdefault(endpoint.endpoint, ExposedEndpoint(endpoint=endpoint.endpoint, methods=[]))
+                known = {method.method for method in merged.methods}
+                merged.methods.extend(method for method in endpoint.methods if method.method not in known)
+            for endpoint in part.consumed_endpoints:
+                key = (endpoint.endpoint, endpoint.port)
+                merged = consumed.setdefault(key, endpoint.model_copy(update={"methods": []}))
+                known = {method.method for method in merged.methods}
+                merged.methods.extend(method for method in endpoint.methods if method.method not in known)
+
+        # Service level details come from the first chunk that found them
+        def first(field: str):
+            for part in parts:
+                value = getattr(part, field)
+                if value and (not isinstance(value, Branch) or value.project_name):
+                    return value
+            return getattr(parts[0], field)
+
+        return cls(
+            exposed_endpoints=list(exposed.values()),
+            consumed_endpoints=list(consumed.values()),
+            is_swagger_supported=any(part.is_swagger_supported for part in parts),
+            swagger_endpoint=first("swagger_endpoint"),
+            repository=first("repository"),
+            branch=first("branch"),
+            port=first("port"),
+            communication_protocol=first("communication_protocol"),
+            is_tls_supported=any(part.is_tls_supported for part in parts),
+        )
+
     def add_specifications(self, specifications: List[Specification]) -> "OnboardingDataModelWithSpec":
         output = OnboardingDataModelWithSpec(
             exposed_endpoints= [],
@@ -98,6 +134,18 @@ class OnboardingDataModelWithSpec(BaseModel):
 class SpecExtractionOutput(BaseModel):
     endpoints: List[Specification]
 
+    @classmethod
+    def merge(cls, parts: List["SpecExtractionOutput"]) -> "SpecExtractionOutput":
+        """Keep one specification per path and method, the most detailed one seen in any chunk."""
+        merged: Dict[tuple, Specification] = {}
+        for part in parts:
+            for specification in part.endpoints:
+                key = (specification.path, specification.method)
+                detail = len(specification.model_dump(exclude_none=True))
+                if key not in merged or detail > len(merged[key].model_dump(exclude_none=True)):
+                    merged[key] = specification
+        return cls(endpoints=list(merged.values()))
+
 class ProjectDataModel(BaseModel):
     repository_url: str
     branch_name: str
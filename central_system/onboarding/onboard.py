@@ -1,4 +1,5 @@
-from typing import List
+from typing import List, Mapping
+import os
 import time
 import json
 
@@ -9,7 +10,16 @@ from .onboarding_handler import OnboardingHandler
 from central_system.database import SessionLocal
 from central_system.database.onboarding import Repository, RepoBranch, Status
 
-from adaptutils import get_branch_source_dump
+from adaptutils import get_branch_snapshot, render_source
+from adaptutils.minify import default_minifier
+from core.llm_handlers.cache import cache_backend_from_env
+from core.llm_handlers.prompt import layered_prompt
+from core.llm_handlers.usage import usage_tracker
+from core.llm_handlers.context import Stage
+from core.llm_handlers.coalesce import crew_request_key
+from core.llm_handlers.cascade import kickoff_cascade, cascade_stats
+from core.llm_handlers.budget import ContextBudget, path_keywords, task_sections
+from core.llm_handlers.batch import BatchError, BatchRunner, batch_backend_from_env, task_request
 
 
 class OnboardingCrew:
@@ -22,6 +32,18 @@ class OnboardingCrew:
         self.endpoint_specification_extraction_task: Task = self.get_endpoint_specification_extraction_task()
         self.extraction_crew: Crew = self.get_extraction_crew()
 
+        self.response_cache = cache_backend_from_env()
+        self.budget = ContextBudget.from_env()
+
+        # Spec extraction goes through a batch endpoint when LLM_BATCH_BACKEND is set
+        batch_backend = batch_backend_from_env()
+        self.batch_runner = BatchRunner(
+            batch_backend,
+            batch_dir=os.getenv("LLM_BATCH_DIR", "data/llm_batches"),
+            poll_interval=float(os.getenv("LLM_BATCH_POLL_SECONDS", 30)),
+            timeout=float(os.getenv("LLM_BATCH_TIMEOUT_SECONDS", 24 * 60 * 60)),
+        ) if batch_backend is not None else None
+
     def get_source_code_analyzer_agent(self) -> Agent:
         return Agent(
             role="Source Code Analyzer",
@@ -32,7 +54,10 @@ class OnboardingCrew:
 
     def get_source_code_analysis_task(self) -> Task:
         return Task(
-            description="instructions:\nGenerate only the JSON Output exactly same as example_json_output. Do not include any other text or comments in the output.,\nExtract the Exposed endpoints and capture them to the JSON Output.,\nExtract the consumed endpoints and capture them to the JSON Output.,\nExtract the bringup configurations such as port number, tls protocol, etc., and capture them to the JSON Output.\nsource:{source}\n example_json_output: {example_json_output}",
+            description=layered_prompt(
+                "instructions:\nGenerate only the JSON Output exactly same as example_json_output. Do not include any other text or comments in the output.,\nExtract the Exposed endpoints and capture them to the JSON Output.,\nExtract the consumed endpoints and capture them to the JSON Output.,\nExtract the bringup configurations such as port number, tls protocol, etc., and capture them to the JSON Output.\n example_json_output: {example_json_output}",
+                snapshot="source:{source}",
+            ),
             expected_output="Generate the JSON output as per the below JSON example json output using the extract information.\nexample json outout:{example_json_output}",
             output_file="output.json",
             output_json=OnboardingDataModel,
@@ -57,11 +82,12 @@ class OnboardingCrew:
 
     def get_endpoint_specification_extraction_task(self) -> Task:
         return Task(
-            description="Instructions :\n Steps:\n" + str(
-                extratction_system_prompt["system_prompt"]["instructions"]["steps"]
-            )
-            + "\nThe Github Source Code is as follows:\n{source_code}. The list of endpoint specifications to be extracted are {endpoints_list}",
-            expected_output="Generate the JSON output using the extracted information.\nExample json outout :{example_output}",
+            # The source is picked per endpoint, so it goes after the instructions and example every endpoint shares
+            description=layered_prompt(
+                "Instructions :\n Steps:\n" + str(extratction_system_prompt["system_prompt"]["instructions"]["steps"]) + "\nExample json outout :{example_output}",
+                variable="The Github Source Code is as follows:\n{source_code}.\nThe list of endpoint specifications to be extracted are {endpoints_list}",
+            ),
+            expected_output="Generate the JSON output using the extracted information, shaped like the example json output.",
             output_json=SpecExtractionOutput,
             verbose=True,
             agent=self.endpoint_specification_extractor_agent,
@@ -74,40 +100,128 @@ class OnboardingCrew:
             verbose=True,
         )
 
+    def kickoff(self, crew: Crew, inputs: dict, stage: Stage) -> str:
+        """
+        Run the crew and return its JSON output, served from the response cache when the same inputs were seen before.
+        Concurrent kickoffs with the same inputs share a single run.
+        """
+        key = crew_request_key(crew, inputs)
+        if self.response_cache is not None:
+            cached = self.response_cache.get(key)
+            if cached is not None:
+                print(f"Response cache hit for {crew.tasks[0].agent.role}. Cache stats: {self.response_cache.stats()}")
+                return cached
+
+        output = kickoff_cascade(crew, inputs, stage)
+        if output is not None and self.response_cache is not None:
+            self.response_cache.set(key, output)
+        return output
+
+    def analyze_source(self, files: Mapping[str, str]) -> str:
+        """Run the onboarding crew over the source, map-reducing over chunks when it does not fit the context window."""
+        example_output = extract_onboarding_informations["example_json_output"]
+        sections = task_sections(self.source_code_analysis_task, {"example_json_output": example_output})
+        chunks = self.budget.plan(files, sections)
+        if len(chunks) == 1:
+            inputs = {"source": render_source(chunks[0]), "example_json_output": example_output}
+            return self.kickoff(self.onboarding_crew, inputs, Stage.ONBOARDING)
+
+        parts: List[OnboardingDataModel] = []
+        for index, chunk in enumerate(chunks, start=1):
+            print(f"Analysing source chunk {index}/{len(chunks)} with {len(chunk)} files")
+            inputs = {"source": render_source(chunk), "example_json_output": example_output}
+            results = self.kickoff(self.onboarding_crew, inputs, Stage.ONBOARDING)
+            try:
+                parts.append(OnboardingDataModel.model_validate_json(results))
+            except Exception as e:
+                print(f"Skipping source chunk {index}/{len(chunks)}, invalid crew output: {e}")
+        if not parts:
+            return results
+        return OnboardingDataModel.merge(parts).model_dump_json()
+
+    def extraction_inputs(self, files: Mapping[str, str], onboarding_data: OnboardingDataModel) -> List[List[dict]]:
+        """Crew inputs of every exposed endpoint and method, one entry per source chunk."""
+        example_output = json.dumps(extratction_system_prompt["system_prompt"]["instructions"]["example_output"])
+        endpoint_inputs = []
+        for endpoint in onboarding_data.exposed_endpoints:
+            for method in endpoint.methods:
+                endpoints_list = str([{"endpoint":endpoint.endpoint, "method": method.method}])
+                sections = task_sections(self.endpoint_specification_extraction_task, {"example_output": example_output, "endpoints_list": endpoints_list})
+                chunks = self.budget.plan(files, sections, keywords=path_keywords(endpoint.endpoint))
+                endpoint_inputs.append([
+                    {"source_code": render_source(chunk), "example_output": example_output, "endpoints_list": endpoints_list}
+                    for chunk in chunks
+                ])
+        return endpoint_inputs
+
+    def extract_specifications(self, files: Mapping[str, str], onboarding_data: OnboardingDataModel) -> List[Specification]:
+        """Extract the specification of every exposed endpoint from the files most relevant to it."""
+        if self.batch_runner is not None:
+            try:
+                return self.extract_specifications_batch(files, onboarding_data)
+            except (TimeoutError, BatchError) as e:
+                # A stuck or failed batch must not hold up the onboarding daemon, the crews answer instead
+                print(f"{e}, extracting the specifications endpoint by endpoint")
+
+        specifications: List[Specification] = []
+        for chunk_inputs in self.extraction_inputs(files, onboarding_data):
+            parts: List[SpecExtractionOutput] = []
+            for extraction_inputs in chunk_inputs:
+                print(f"Extracting Specification For {extraction_inputs['endpoints_list']}")
+                results = self.kickoff(self.extraction_crew, extraction_inputs, Stage.SPEC_EXTRACTION)
+                print(f"Extraction Complete. Results : {results}")
+                parts.append(SpecExtractionOutput.model_validate_json(results))
+            specifications.extend(SpecExtractionOutput.merge(parts).endpoints)
+        self.log_prefix_cache()
+        return specifications
+
+    def log_prefix_cache(self):
+        # The endpoints share the prompt up to their endpoint list, so most prompt tokens should come from the cache
+        for summary in usage_tracker().summary(stage=Stage.SPEC_EXTRACTION.value):
+            print(f"Spec extraction prefix cache [{summary.model}]: {summary.cached_tokens}/{summary.prompt_tokens} prompt tokens cached ({summary.cache_hit_rate:.0%})")
+
+    def extract_specifications_batch(self, files: Mapping[str, str], onboarding_data: OnboardingDataModel) -> List[Specification]:
+        """Submit the extraction of every endpoint as one batch instead of one crew run per endpoint."""
+        task = self.endpoint_specification_extraction_task
+        # crewai model names carry a provider prefix such as "openai/"
+        model_name = os.getenv("MODEL", "gpt-4o-mini").split("/")[-1]
+        endpoint_requests = [
+            [task_request(f"{index}-{chunk}", task, extraction_inputs, model_name) for chunk, extraction_inputs in enumerate(chunk_inputs)]
+            for index, chunk_inputs in enumerate(self.extraction_inputs(files, onboarding_data))
+        ]
+        results = self.batch_runner.run([request for requests in endpoint_requests for request in requests])
+
+        specifications: List[Specification] = []
+        for requests in endpoint_requests:
+            parts = [results[request.custom_id] for request in requests if results[request.custom_id] is not None]
+            if len(parts) < len(requests):
+                print(f"Batch extraction incomplete for request {requests[0].custom_id}, {len(parts)}/{len(requests)} chunks succeeded")
+            specifications.extend(SpecExtractionOutput.merge(parts).endpoints)
+        return specifications
+
     def onboard(
-        self, repository: str, branch: str, included_extensions: List[str]
+        self, repository: str, branch: str, included_extensions: List[str], excluded_paths: List[str] = None
     ) -> str:
-        source_code = get_branch_source_dump(
+        files = get_branch_snapshot(
             repo=repository,
             branch=branch,
-            included_extensions=included_extensions,
+            include_extensions=included_extensions,
+            exclude_paths=excluded_paths,
         )
-        example_output = extract_onboarding_informations["example_json_output"]
-        inputs = {"source": source_code, "example_json_output": example_output}
 
         # Step 2.2: Run the Crew and get the Final output
-        onboarding_results = self.onboarding_crew.kickoff(inputs=inputs)
+        onboarding_results = self.analyze_source(files)
 
         # Step 2.3: Validate the Agent output and Onboard the Repository
         meta_data = ProjectDataModel(repository_url=repository, branch_name=branch)
         handler = OnboardingHandler(meta_data)
 
-        ok, error = handler.validate_onboarding_data(onboarding_results.json)
+        ok, error = handler.validate_onboarding_data(onboarding_results)
         if not ok:
             print(error)
             return ok, error
     
-        extraction_inputs = {
-            "source_code": source_code,
-            "example_output": json.dumps(extratction_system_prompt["system_prompt"]["instructions"]["example_output"]),
-        }
-        specifications: List[Specification] = []
-        for endpoint in handler.onboarding_data.exposed_endpoints:
-            for method in endpoint.methods:
-                extraction_inputs["endpoints_list"] = str([{"endpoint":endpoint.endpoint, "method": method.method}])
-                results = self.extraction_crew.kickoff(inputs=extraction_inputs)
-                specifications.extend(SpecExtractionOutput.model_validate_json(results.json).endpoints)
-
+        specifications = self.extract_specifications(files, handler.onboarding_data)
         data = handler.onboarding_data.add_specifications(specifications)
 
         ok, error = handler.onboard(data)
@@ -116,6 +230,8 @@ class OnboardingCrew:
             return ok, error
 
         print(f"Onboarding Repo: {repository} Branch: {branch} successful.")
+        print(f"Model cascade stats: {cascade_stats().stats()}")
+        print(f"Source minification: {default_minifier().stats()}")
         return True, "Success"
 
     def run_demon(self) -> str:
@@ -131,22 +247,23 @@ class OnboardingCrew:
                     )
                     for repository in result:
                         for repo_branch in repository.repo_branches:
-                            # Step 2.1: Retreive Source Code from the Repository and Prepare Agent inputs
-                            source_code = get_branch_source_dump(
-                                repo=repository.url,
-                                branch=repo_branch.branch,
-                                included_extensions=repo_branch.included_extensions,
-                            )
-                            example_output = extract_onboarding_informations[
-                                "example_json_output"
-                            ]
-                            inputs = {
-                                "source": source_code,
-                                "example_json_output": example_output,
-                            }
+                            # Step 2.1: Retreive Source Code from the Repository
+                            try:
+                                files = get_branch_snapshot(
+                                    repo=repository.url,
+                                    branch=repo_branch.branch,
+                                    include_extensions=repo_branch.included_extensions,
+                                    exclude_paths=repo_branch.excluded_paths,
+                                )
+                            except Exception as e:
+                                # A deleted branch or an exhausted rate limit would otherwise be retried every second
+                                print(f"Failed to fetch {repository.url} Branch: {repo_branch.branch}: {e}")
+                                repo_branch.status = Status.FAILED
+                                db.commit()
+                                continue
 
                             # Step 2.2: Run the Crew and get the Final output
-                            onboarding_results = self.onboarding_crew.kickoff(inputs=inputs)
+                            onboarding_results = self.analyze_source(files)
                             print(f"Onboarding Crew Completed...!")
 
                             # Step 2.3: Validate the Agent output and Onboard the Repository
@@ -157,28 +274,13 @@ class OnboardingCrew:
                             handler = OnboardingHandler(meta_data)
                             
                             # Step 2.4: Validate Onboarding Crew Response
-                            ok, error = handler.validate_onboarding_data(onboarding_results.json)
+                            ok, error = handler.validate_onboarding_data(onboarding_results)
                             if not ok:
                                 print(error)
                                 return ok, error
                             
                             # Step 2.5: Extract the API Endpoint Specifications for exposed endpoints
-                            extraction_inputs = {
-                                "source_code": source_code,
-                                "example_output": json.dumps(extratction_system_prompt["system_prompt"]["instructions"]["example_output"]),
-                            }
-                            specifications: List[Specification] = []
-                            for endpoint in handler.onboarding_data.exposed_endpoints:
-                                # if endpoint.endpoint.find("swagger") != -1:
-                                #     continue
-                                for method in endpoint.methods:
-                                    # if method.method.find("DELETE") != -1:
-                                    extraction_inputs["endpoints_list"] = str([{"endpoint":endpoint.endpoint, "method": method.method}])
-                                    print(f"Extracting Specification For Endpoint {endpoint.endpoint} and Method: {method.method}")
-                                    results = self.extraction_crew.kickoff(inputs=extraction_inputs)
-                                    print(f"Extraction Complete. Results : {results}")
-                                    specifications.extend(SpecExtractionOutput.model_validate_json(results.json).endpoints)
-                                    print(f"Validation Complete For Endpoint {endpoint.endpoint} and Method: {method.method}")
+                            specifications = self.extract_specifications(files, handler.onboarding_data)
 
                             print("Extraction Loop Complete...!")
                             data = handler.onboarding_data.add_specifications(specifications)
@@ -229,17 +331,15 @@ class OnboardingCrew:
         ]
         # Step 2: Iterate through the repositories and onboard one by one.
         for repo_data in repository_details:
-            # Step 2.1: Retreive Source Code from the Repository and Prepare Agent inputs
-            source_code = get_branch_source_dump(
+            # Step 2.1: Retreive Source Code from the Repository
+            files = get_branch_snapshot(
                 repo=repo_data["repository"],
                 branch=repo_data["branch"],
-                included_extensions=repo_data["included_extensions"],
+                include_extensions=repo_data["included_extensions"],
             )
-            example_output = extract_onboarding_informations["example_json_output"]
-            inputs = {"source": source_code, "example_json_output": example_output}
 
             # Step 2.2: Run the Crew and get the Final output
-            onboarding_results = self.onboarding_crew.kickoff(inputs=inputs)
+            onboarding_results = self.analyze_source(files)
 
             # Step 2.3: Validate the Agent output and Onboard the Repository
             meta_data = ProjectDataModel(
@@ -248,22 +348,13 @@ class OnboardingCrew:
             handler = OnboardingHandler(meta_data)
 
             # Step 2.4: Validate Onboarding Crew Response
-            ok, error = handler.validate_onboarding_data(onboarding_results.json)
+            ok, error = handler.validate_onboarding_data(onboarding_results)
             if not ok:
                 print(error)
                 return ok, error
             
             # Step 2.5: Extract the API Endpoint Specifications for exposed endpoints
-            extraction_inputs = {
-                "source_code": source_code,
-                "example_output": json.dumps(extratction_system_prompt["system_prompt"]["instructions"]["example_output"]),
-            }
-            specifications: List[Specification] = []
-            for endpoint in handler.onboarding_data.exposed_endpoints:
-                for method in endpoint.methods:
-                    extraction_inputs["endpoints_list"] = str([{"endpoint":endpoint.endpoint, "method": method.method}])
-                    results = self.extraction_crew.kickoff(inputs=extraction_inputs)
-                    specifications.extend(SpecExtractionOutput.model_validate_json(results.json).endpoints)
+            specifications = self.extract_specifications(files, handler.onboarding_data)
 
             data = handler.onboarding_data.add_specifications(specifications)
 
@@ -1,3 +1,4 @@
 from .repository import repository_query, repository_mutation
 from .endpoint import endpoint_query
 from .actionitems import action_item_query
+from .usage import usage_query
\ No newline at end of file
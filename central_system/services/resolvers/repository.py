@@ -100,6 +100,7 @@ def resolve_repositories(_, info, page=1, size=100):
                             "id": repo_branch.id,
                             "branch": repo_branch.branch,
                             "included_extensions": repo_branch.included_extensions,
+                            "excluded_paths": repo_branch.excluded_paths,
                             "status": repo_branch.status.value,
                             "services": services,
                             "clients": clients,
@@ -192,6 +193,7 @@ def resolve_repository(_, info, id):
                         "id": repo_branch.id,
                         "branch": repo_branch.branch,
                         "included_extensions": repo_branch.included_extensions,
+                        "excluded_paths": repo_branch.excluded_paths,
                         "status": repo_branch.status.value,
                         "services": services,
                         "clients": clients,
@@ -216,7 +218,7 @@ def resolve_repository(_, info, id):
 
 @repository_mutation.field("onboardRepository")
 def resolve_onboard_repository(
-    _, info, url: str, branch: str, included_extensions: list
+    _, info, url: str, branch: str, included_extensions: list, excluded_paths: list = None
 ):
     with SessionLocal() as db:
         try:
@@ -227,6 +229,7 @@ def resolve_onboard_repository(
                 repository_id=repository.id,
                 branch=branch,
                 included_extensions=included_extensions,
+                excluded_paths=excluded_paths,
                 status=Status.PENDING,
             )
             db.add(repo_branch)
@@ -239,6 +242,7 @@ def resolve_onboard_repository(
                         "id": repo_branch.id,
                         "branch": repo_branch.branch,
                         "included_extensions": repo_branch.included_extensions,
+                        "excluded_paths": repo_branch.excluded_paths,
                         "status": repo_branch.status.value,
                         "services": [],
                         "clients": [],
@@ -0,0 +1,31 @@
+from ariadne import QueryType
+
+from central_system.services import queries
+from core.llm_handlers.usage import usage_tracker
+
+usage_query = QueryType()
+
+
+@usage_query.field("llmUsage")
+def resolve_llm_usage(_, info, stage: str = None, model: str = None, since: float = None):
+    # The onboarding daemon runs in its own process, set LLM_USAGE_LOG so its records are visible here
+    return [
+        {
+            "stage": summary.stage,
+            "model": summary.model,
+            "calls": summary.calls,
+            "failures": summary.failures,
+            "promptTokens": summary.prompt_tokens,
+            "completionTokens": summary.completion_tokens,
+            "totalTokens": summary.total_tokens,
+            "cachedTokens": summary.cached_tokens,
+            "cacheHitRate": summary.cache_hit_rate,
+            "wallTimeSeconds": summary.wall_time,
+            "avgWallTimeSeconds": summary.avg_wall_time,
+            "p95WallTimeSeconds": summary.p95_wall_time,
+            "avgTimeToFirstTokenSeconds": summary.avg_time_to_first_token,
+        }
+        for summary in usage_tracker().summary(stage=stage, model=model, since=since)
+    ]
+
+queries.append(usage_query)
@@ -0,0 +1,331 @@
+import os
+import json
+import time
+import uuid
+import threading
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Type, List, Dict, Union
+from pydantic import BaseModel
+from openai import OpenAI
+
+from .interface import LLMInterface
+from .usage import track_call, cached_prompt_tokens
+from .continuation import strip_fence
+
+TERMINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+
+
+class BatchError(Exception):
+    """Raised when a batch could not be submitted or ended without completing."""
+
+
+class BatchRequest(BaseModel):
+    custom_id: str
+    system_prompt: str
+    user_prompt: str
+    model_name: str
+    json_schema: Optional[Type[BaseModel]] = None
+    max_tokens: int = -1
+
+    def line(self) -> dict:
+        """The request as one line of an OpenAI batch input file."""
+        body = {
+            "model": self.model_name,
+            "messages": [
+                {"role": "system", "content": self.system_prompt},
+                {"role": "user", "content": self.user_prompt},
+            ],
+        }
+        if self.max_tokens > 0:
+            body["max_tokens"] = self.max_tokens
+        if self.json_schema is not None:
+            body["response_format"] = {
+                "type": "json_schema",
+                "json_schema": {"name": self.json_schema.__name__, "schema": self.json_schema.model_json_schema()},
+            }
+        return {"custom_id": self.custom_id, "method": "POST", "url": "/v1/chat/completions", "body": body}
+
+
+class BatchResult(BaseModel):
+    custom_id: str
+    content: Optional[str] = None
+    error: Optional[str] = None
+    prompt_tokens: Optional[int] = None
+    completion_tokens: Optional[int] = None
+    cached_tokens: Optional[int] = None
+
+
+def task_request(custom_id: str, task, inputs: Dict[str, str], model_name: str) -> BatchRequest:
+    """BatchRequest equivalent to running a single-task crewai Crew with inputs."""
+    def interpolate(text: str) -> str:
+        for name, value in inputs.items():
+            text = text.replace(f"{{{name}}}", str(value))
+        return text
+
+    return BatchRequest(
+        custom_id=custom_id,
+        system_prompt=f"You are {task.agent.role}. {task.agent.backstory}\nYour personal goal is: {task.agent.goal}",
+        user_prompt=f"{interpolate(task.description)}\n\nThis is the expected criteria for your final answer: {interpolate(task.expected_output)}",
+        model_name=model_name,
+        json_schema=task.output_json,
+    )
+
+
+def write_batch_file(requests: List[BatchRequest], path: str) -> str:
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, "w") as file:
+        for request in requests:
+            file.write(json.dumps(request.line()) + "\n")
+    return path
+
+
+def parse_output_line(line: dict) -> BatchResult:
+    """Read one line of an OpenAI batch output or error file."""
+    response = line.get("response") or {}
+    body = response.get("body") or {}
+    if line.get("error") or response.get("status_code", 200) != 200:
+        error = line.get("error") or body.get("error")
+        return BatchResult(custom_id=line["custom_id"], error=json.dumps(error))
+    usage = body.get("usage") or {}
+    return BatchResult(
+        custom_id=line["custom_id"],
+        content=body["choices"][0]["message"]["content"],
+        prompt_tokens=usage.get("prompt_tokens"),
+        completion_tokens=usage.get("completion_tokens"),
+        cached_tokens=cached_prompt_tokens(usage),
+    )
+
+
+class BatchBackend(ABC):
+    provider: str
+
+    @abstractmethod
+    def submit(self, input_path: str) -> str:
+        """Submit a batch input file and return the batch id."""
+        pass
+
+    @abstractmethod
+    def status(self, batch_id: str) -> str:
+        pass
+
+    @abstractmethod
+    def results(self, batch_id: str) -> List[BatchResult]:
+        pass
+
+    @abstractmethod
+    def cancel(self, batch_id: str):
+        """Stop a batch that is no longer waited for."""
+        pass
+
+
+class OpenAIBatchBackend(BatchBackend):
+    provider = "openai"
+
+    def __init__(self, api_key: str, completion_window: str = "24h"):
+        self.client = OpenAI(api_key=api_key)
+        self.completion_window = completion_window
+
+    def submit(self, input_path: str) -> str:
+        with open(input_path, "rb") as file:
+            input_file = self.client.files.create(file=file, purpose="batch")
+        batch = self.client.batches.create(
+            input_file_id=input_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window=self.completion_window,
+        )
+        return batch.id
+
+    def status(self, batch_id: str) -> str:
+        return self.client.batches.retrieve(batch_id).status
+
+    def results(self, batch_id: str) -> List[BatchResult]:
+        batch = self.client.batches.retrieve(batch_id)
+        results = []
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if not file_id:
+                continue
+            for line in self.client.files.content(file_id).text.splitlines():
+                if line.strip():
+                    results.append(parse_output_line(json.loads(line)))
+        return results
+
+    def cancel(self, batch_id: str):
+        self.client.batches.cancel(batch_id)
+
+
+class LocalBatchBackend(BatchBackend):
+    """
+    File-based stand-in for the OpenAI batch API.
+
+    Each batch is a directory holding input.jsonl, status and output.jsonl in the OpenAI formats.
+    A background thread answers the requests with the given handler, so callers poll exactly as they would remotely.
+    """
+
+    provider = "local"
+
+    def __init__(self, root: str, handler: LLMInterface, workers: int = 4):
+        self.root = root
+        self.handler = handler
+        self.workers = workers
+        self.threads: Dict[str, threading.Thread] = {}
+        self.cancelled = set()
+        os.makedirs(self.root, exist_ok=True)
+
+    def batch_path(self, batch_id: str, name: str) -> str:
+        return os.path.join(self.root, batch_id, name)
+
+    def write_status(self, batch_id: str, status: str):
+        with open(self.batch_path(batch_id, "status"), "w") as file:
+            file.write(status)
+
+    def submit(self, input_path: str) -> str:
+        batch_id = f"batch_{uuid.uuid4().hex}"
+        os.makedirs(os.path.join(self.root, batch_id))
+        with open(input_path, "r") as source, open(self.batch_path(batch_id, "input.jsonl"), "w") as target:
+            target.write(source.read())
+        self.write_status(batch_id, "validating")
+        self.threads[batch_id] = threading.Thread(target=self.process, args=(batch_id,), daemon=True)
+        self.threads[batch_id].start()
+        return batch_id
+
+    def answer(self, batch_id: str, line: dict) -> dict:
+        if batch_id in self.cancelled:
+            return {"custom_id": line["custom_id"], "response": None, "error": {"message": "batch cancelled"}}
+        body = line["body"]
+        messages = {message["role"]: message["content"] for message in body["messages"]}
+        try:
+            content = self.handler.generate_text(messages.get("system", ""), messages.get("user", ""), body["model"], body.get("max_tokens", -1))
+        except Exception as e:
+            return {"custom_id": line["custom_id"], "response": None, "error": {"message": str(e)}}
+        return {
+            "custom_id": line["custom_id"],
+            "response": {"status_code": 200, "body": {"choices": [{"message": {"role": "assistant", "content": content}}]}},
+            "error": None,
+        }
+
+    def process(self, batch_id: str):
+        self.write_status(batch_id, "in_progress")
+        with open(self.batch_path(batch_id, "input.jsonl"), "r") as file:
+            lines = [json.loads(line) for line in file if line.strip()]
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                outputs = list(executor.map(lambda line: self.answer(batch_id, line), lines))
+        except Exception as e:
+            print(f"Local batch {batch_id} failed: {e}")
+            self.write_status(batch_id, "failed")
+            return
+        if batch_id in self.cancelled:
+            return
+        with open(self.batch_path(batch_id, "output.jsonl"), "w") as file:
+            for output in outputs:
+                file.write(json.dumps(output) + "\n")
+        self.write_status(batch_id, "completed")
+
+    def status(self, batch_id: str) -> str:
+        with open(self.batch_path(batch_id, "status"), "r") as file:
+            return file.read().strip()
+
+    def results(self, batch_id: str) -> List[BatchResult]:
+        path = self.batch_path(batch_id, "output.jsonl")
+        if not os.path.exists(path):
+            return []
+        with open(path, "r") as file:
+            return [parse_output_line(json.loads(line)) for line in file if line.strip()]
+
+    def cancel(self, batch_id: str):
+        # Requests not yet answered are skipped, the running ones finish and are dropped
+        self.cancelled.add(batch_id)
+        self.write_status(batch_id, "cancelled")
+
+
+def batch_backend_from_env() -> Optional[BatchBackend]:
+    """Batch backend configured through LLM_BATCH_BACKEND (openai or local). Batch mode is off when unset."""
+    backend = os.getenv("LLM_BATCH_BACKEND")
+    if not backend:
+        return None
+    if backend == "openai":
+        return OpenAIBatchBackend(os.environ["OPENAI_API_KEY"])
+    elif backend == "local":
+        # Imported here, the factory builds the handler that answers the local batches
+        from .factory import create_llm_handler
+        handler = create_llm_handler(
+            provider=os.getenv("LLM_BATCH_LOCAL_PROVIDER", "lmstudio"),
+            api_key=os.getenv("OPENAI_API_KEY", ""),
+            api_url=os.getenv("LMSTUDIO_CHAT_COMPLETION_URL"),
+        )
+        return LocalBatchBackend(os.path.join(os.getenv("LLM_BATCH_DIR", "data/llm_batches"), "local"), handler)
+    else:
+        raise ValueError(f"Unknown batch backend: {backend}")
+
+
+class BatchRunner:
+    """Writes pending requests to a batch file, submits it, polls until it finishes and returns the parsed results."""
+
+    def __init__(self, backend: BatchBackend, batch_dir: str = "data/llm_batches", poll_interval: float = 30.0, timeout: Optional[float] = None):
+        self.backend = backend
+        self.batch_dir = batch_dir
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+
+    def run(self, requests: List[BatchRequest]) -> Dict[str, Union[BaseModel, str, None]]:
+        """
+        Map each custom_id to its parsed response, or None when that request failed. Raises BatchError when the batch
+        could not be submitted or did not complete, and TimeoutError after cancelling a batch that ran out of time.
+        """
+        if not requests:
+            return {}
+        # One usage record for the whole batch, timed from submit to results
+        with track_call(f"{self.backend.provider}-batch", requests[0].model_name) as call:
+            results = self.wait(requests)
+            call.requests = len(results)
+            call.set_usage(
+                sum(result.prompt_tokens or 0 for result in results),
+                sum(result.completion_tokens or 0 for result in results),
+                sum(result.cached_tokens or 0 for result in results),
+            )
+
+        schemas = {request.custom_id: request.json_schema for request in requests}
+        parsed: Dict[str, Union[BaseModel, str, None]] = {request.custom_id: None for request in requests}
+        for result in results:
+            if result.error is not None or result.content is None:
+                print(f"Batch request {result.custom_id} failed: {result.error}")
+                continue
+            schema = schemas.get(result.custom_id)
+            try:
+                if schema is None:
+                    parsed[result.custom_id] = result.content
+                else:
+                    # Local models like to wrap JSON in a markdown fence
+                    parsed[result.custom_id] = schema.model_validate_json(strip_fence(result.content))
+            except ValueError as e:
+                print(f"Batch request {result.custom_id} returned invalid JSON: {e}")
+        return parsed
+
+    def wait(self, requests: List[BatchRequest]) -> List[BatchResult]:
+        """Submit the requests as one batch and return its results once it completed."""
+        input_path = write_batch_file(requests, os.path.join(self.batch_dir, f"input_{uuid.uuid4().hex}.jsonl"))
+        try:
+            batch_id = self.backend.submit(input_path)
+        except Exception as e:
+            raise BatchError(f"Submitting a batch of {len(requests)} requests failed: {e}") from e
+        print(f"Submitted batch {batch_id} with {len(requests)} requests")
+
+        started_at = time.monotonic()
+        status = self.backend.status(batch_id)
+        while status not in TERMINAL_STATUSES:
+            if self.timeout is not None and time.monotonic() - started_at > self.timeout:
+                # Whoever falls back to answering the requests another way must not pay for them twice
+                try:
+                    self.backend.cancel(batch_id)
+                except Exception as e:
+                    print(f"Cancelling batch {batch_id} failed: {e}")
+                raise TimeoutError(f"Batch {batch_id} did not finish within {self.timeout} seconds, last status {status}")
+            time.sleep(self.poll_interval)
+            status = self.backend.status(batch_id)
+        print(f"Batch {batch_id} finished with status {status} after {time.monotonic() - started_at:.1f}s")
+        if status != "completed":
+            raise BatchError(f"Batch {batch_id} ended with status {status}")
+        return self.backend.results(batch_id)
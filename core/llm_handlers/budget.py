@@ -0,0 +1,173 @@
+import os
+import re
+from typing import Dict, List, Tuple, Iterable
+
+from .tokens import estimate_tokens
+
+# Paths that usually describe how a service is wired up, worth keeping even without a keyword match
+ENTRYPOINT_HINTS = ("main.", "route", "router", "handler", "controller", "api", "server", ".project.json", "go.mod", "openapi", "swagger")
+LOW_VALUE_HINTS = ("_test.", "/test/", "/tests/", "vendor/", "mock", "generated", ".pb.go")
+
+
+def render_files(files: Dict[str, str]) -> str:
+    """The `--- path ---` layout every source dump in this repo uses."""
+    return "".join(f"--- {path} ---\n{content}\n" for path, content in files.items())
+
+
+def file_tokens(path: str, content: str) -> int:
+    return estimate_tokens(f"--- {path} ---\n{content}\n")
+
+
+def path_keywords(path: str) -> List[str]:
+    """Words of an endpoint path or file path, e.g. "/users/{id}/orders" -> ["users", "orders"]."""
+    return [word for word in re.split(r"[^a-zA-Z0-9]+", path.lower()) if len(word) > 2 and not word.isdigit()]
+
+
+def diff_paths(diff: str) -> List[str]:
+    """Files touched by a unified diff."""
+    return re.findall(r"^diff --git a/(\S+) b/", diff, flags=re.MULTILINE)
+
+
+class ContextBudget:
+    """
+    Token budget of one prompt.
+
+    max_tokens is the model's context window and reserved_tokens what the completion and the crew's own
+    scaffolding need. Whatever the fixed prompt sections leave is available for source files.
+    """
+
+    def __init__(self, max_tokens: int, reserved_tokens: int = 4096):
+        self.max_tokens = max_tokens
+        self.reserved_tokens = reserved_tokens
+
+    @classmethod
+    def from_env(cls) -> "ContextBudget":
+        return cls(
+            max_tokens=int(os.getenv("LLM_CONTEXT_TOKENS", 32768)),
+            reserved_tokens=int(os.getenv("LLM_CONTEXT_RESERVED_TOKENS", 4096)),
+        )
+
+    def count_sections(self, sections: Dict[str, str]) -> Dict[str, int]:
+        return {name: estimate_tokens(text) for name, text in sections.items()}
+
+    def available(self, sections: Dict[str, str]) -> int:
+        """Tokens left for source files after the fixed sections of the prompt."""
+        used = sum(self.count_sections(sections).values())
+        return max(self.max_tokens - self.reserved_tokens - used, 0)
+
+    def score_files(self, files: Dict[str, str], keywords: Iterable[str] = (), priority_paths: Iterable[str] = ()) -> Dict[str, int]:
+        """Relevance of each file. Positive scores mark files worth keeping, the rest is background."""
+        keywords = [keyword.lower() for keyword in keywords if keyword]
+        priority_paths = list(priority_paths)
+        scores = {}
+        for path, content in files.items():
+            lowered_path = path.lower()
+            score = 0
+            if any(lowered_path.endswith(priority) for priority in priority_paths):
+                score += 100
+            if any(hint in lowered_path for hint in ENTRYPOINT_HINTS):
+                score += 3
+            if any(hint in lowered_path for hint in LOW_VALUE_HINTS):
+                score -= 5
+            lowered_content = content.lower()
+            for keyword in keywords:
+                if keyword in lowered_path:
+                    score += 5
+                score += min(lowered_content.count(keyword), 10)
+            scores[path] = score
+        return scores
+
+    def rank_files(self, files: Dict[str, str], keywords: Iterable[str] = (), priority_paths: Iterable[str] = ()) -> List[str]:
+        """Paths ordered from most to least relevant. Ties prefer smaller files so more of them fit."""
+        scores = self.score_files(files, keywords, priority_paths)
+        return sorted(files, key=lambda path: (-scores[path], len(files[path]), path))
+
+    def select_files(self, files: Dict[str, str], budget_tokens: int, keywords: Iterable[str] = (), priority_paths: Iterable[str] = ()) -> Tuple[Dict[str, str], List[str]]:
+        """Most relevant files that fit in budget_tokens, in their original order, and the paths left out."""
+        selected = set()
+        dropped = []
+        used = 0
+        for path in self.rank_files(files, keywords, priority_paths):
+            tokens = file_tokens(path, files[path])
+            if used + tokens <= budget_tokens:
+                selected.add(path)
+                used += tokens
+            else:
+                dropped.append(path)
+        return {path: content for path, content in files.items() if path in selected}, dropped
+
+    def chunk_files(self, files: Dict[str, str], budget_tokens: int) -> List[Dict[str, str]]:
+        """Split files into groups that each fit in budget_tokens. A file too large on its own is split by lines."""
+        chunks: List[Dict[str, str]] = []
+        current: Dict[str, str] = {}
+        used = 0
+        for path, content in files.items():
+            for part_path, part in self.split_file(path, content, budget_tokens):
+                tokens = file_tokens(part_path, part)
+                if current and used + tokens > budget_tokens:
+                    chunks.append(current)
+                    current, used = {}, 0
+                current[part_path] = part
+                used += tokens
+        if current:
+            chunks.append(current)
+        return chunks
+
+    def split_file(self, path: str, content: str, budget_tokens: int) -> List[Tuple[str, str]]:
+        if file_tokens(path, content) <= budget_tokens:
+            return [(path, content)]
+        parts: List[str] = []
+        lines: List[str] = []
+        used = estimate_tokens(path) + 8
+        for line in content.splitlines(keepends=True):
+            tokens = estimate_tokens(line)
+            if lines and used + tokens > budget_tokens:
+                parts.append("".join(lines))
+                lines, used = [], estimate_tokens(path) + 8
+            lines.append(line)
+            used += tokens
+        if lines:
+            parts.append("".join(lines))
+        return [(f"{path} (part {index}/{len(parts)})", part) for index, part in enumerate(parts, start=1)]
+
+    def fit(self, files: Dict[str, str], sections: Dict[str, str], keywords: Iterable[str] = (), priority_paths: Iterable[str] = ()) -> Dict[str, str]:
+        """The files when they fit next to the sections, otherwise the most relevant ones that do."""
+        budget_tokens = self.available(sections)
+        total = sum(file_tokens(path, content) for path, content in files.items())
+        if total <= budget_tokens:
+            return files
+        selected, dropped = self.select_files(files, budget_tokens, keywords, priority_paths)
+        print(f"Context budget: {total} source tokens over the {budget_tokens} token budget, kept {len(selected)} files and dropped {len(dropped)}")
+        return selected
+
+    def plan(self, files: Dict[str, str], sections: Dict[str, str], keywords: Iterable[str] = (), priority_paths: Iterable[str] = ()) -> List[Dict[str, str]]:
+        """
+        Decide how to send files alongside the fixed prompt sections, for callers that can merge partial results.
+
+        Returns a single group when everything fits, or when every relevant file fits and is kept. Otherwise returns
+        chunks of the whole source, most relevant files first, for a map-reduce.
+        """
+        budget_tokens = self.available(sections)
+        total = sum(file_tokens(path, content) for path, content in files.items())
+        if total <= budget_tokens:
+            return [files]
+
+        scores = self.score_files(files, keywords, priority_paths)
+        relevant = {path: content for path, content in files.items() if scores[path] > 0}
+        if sum(file_tokens(path, content) for path, content in relevant.items()) <= budget_tokens:
+            return [self.fit(files, sections, keywords, priority_paths)]
+
+        ranked = {path: files[path] for path in self.rank_files(files, keywords, priority_paths)}
+        chunks = self.chunk_files(ranked, budget_tokens)
+        print(f"Context budget: {total} source tokens over the {budget_tokens} token budget, splitting the source into {len(chunks)} chunks")
+        return chunks
+
+
+def task_sections(task, inputs: Dict[str, str]) -> Dict[str, str]:
+    """Prompt sections of a crewai Task run with inputs, excluding the source being budgeted."""
+    sections = {
+        "agent": f"{task.agent.role}\n{task.agent.goal}\n{task.agent.backstory}",
+        "task": f"{task.description}\n{task.expected_output}",
+    }
+    sections.update({name: value for name, value in inputs.items() if isinstance(value, str)})
+    return sections
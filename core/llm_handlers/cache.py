@@ -0,0 +1,296 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from abc import ABC, abstractmethod
+from typing import Optional, Type
+from pydantic import BaseModel
+
+from .interface import LLMInterface
+
+
+def request_key(provider: str, model_name: str, system_prompt: str, user_prompt: str, json_schema: Optional[Type[BaseModel]] = None, max_tokens: int = -1) -> str:
+    """Content address of an LLM request. Identical prompts against the same provider/model/schema share a key."""
+    schema = json_schema.model_json_schema() if json_schema is not None else None
+    payload = json.dumps(
+        {
+            "provider": provider,
+            "model": model_name,
+            "system": system_prompt,
+            "user": user_prompt,
+            "schema": schema,
+            "max_tokens": max_tokens,
+        },
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class CacheBackend(ABC):
+    def __init__(self, max_bytes: int, ttl_seconds: Optional[float]):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def is_expired(self, created_at: float) -> bool:
+        return self.ttl_seconds is not None and time.time() - created_at > self.ttl_seconds
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[str]:
+        pass
+
+    @abstractmethod
+    def set(self, key: str, value: str) -> None:
+        pass
+
+    @abstractmethod
+    def size(self) -> int:
+        pass
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "size_bytes": self.size(),
+        }
+
+
+class SQLiteCacheBackend(CacheBackend):
+    """Single-file cache. Safe to share between the processes of one container."""
+
+    def __init__(self, path: str, max_bytes: int = 512 * 1024 * 1024, ttl_seconds: Optional[float] = None):
+        super().__init__(max_bytes, ttl_seconds)
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS entries_accessed_at ON entries (accessed_at)")
+        self.conn.commit()
+
+    def get(self, key: str) -> Optional[str]:
+        with self.lock:
+            row = self.conn.execute("SELECT value, created_at FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            value, created_at = row
+            if self.is_expired(created_at):
+                self.conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                self.conn.commit()
+                self.misses += 1
+                return None
+            self.conn.execute("UPDATE entries SET accessed_at = ? WHERE key = ?", (time.time(), key))
+            self.conn.commit()
+            self.hits += 1
+            return value
+
+    def set(self, key: str, value: str) -> None:
+        now = time.time()
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO entries (key, value, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (key, value, len(value.encode("utf-8")), now, now),
+            )
+            self.evict()
+            self.conn.commit()
+
+    def evict(self) -> None:
+        # Drop expired entries first, then the least recently used ones until we fit in the budget
+        if self.ttl_seconds is not None:
+            cursor = self.conn.execute("DELETE FROM entries WHERE created_at < ?", (time.time() - self.ttl_seconds,))
+            self.evictions += cursor.rowcount
+        total = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in self.conn.execute("SELECT key, size FROM entries ORDER BY accessed_at ASC").fetchall():
+            self.conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+            self.evictions += 1
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def size(self) -> int:
+        with self.lock:
+            return self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+
+
+class FileCacheBackend(CacheBackend):
+    """One file per entry, sharded by key prefix. File mtime doubles as the LRU clock."""
+
+    def __init__(self, root: str, max_bytes: int = 512 * 1024 * 1024, ttl_seconds: Optional[float] = None):
+        super().__init__(max_bytes, ttl_seconds)
+        self.root = root
+        self.lock = threading.Lock()
+        os.makedirs(self.root, exist_ok=True)
+        self.total_bytes = sum(size for _, size, _ in self.entries())
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], key[2:4], f"{key}.json")
+
+    def get(self, key: str) -> Optional[str]:
+        path = self.path(key)
+        try:
+            with open(path, "r") as file:
+                entry = json.load(file)
+        except (OSError, ValueError):
+            with self.lock:
+                self.misses += 1
+            return None
+        if self.is_expired(entry["created_at"]):
+            self.remove(path)
+            with self.lock:
+                self.misses += 1
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        with self.lock:
+            self.hits += 1
+        return entry["value"]
+
+    def set(self, key: str, value: str) -> None:
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temp file and rename so concurrent readers never see a partial entry
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, "w") as file:
+            json.dump({"created_at": time.time(), "value": value}, file)
+        # An overwritten entry gives its bytes back, or rewriting the same keys would inflate the total into an evict() per write
+        try:
+            replaced = os.path.getsize(path)
+        except OSError:
+            replaced = 0
+        os.replace(temp_path, path)
+        with self.lock:
+            self.total_bytes += os.path.getsize(path) - replaced
+            if self.total_bytes > self.max_bytes:
+                self.evict()
+
+    def entries(self) -> list:
+        entries = []
+        for directory, _, files in os.walk(self.root):
+            for name in files:
+                if not name.endswith(".json"):
+                    continue
+                path = os.path.join(directory, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def evict(self) -> None:
+        # Rescan instead of trusting the running total, other processes may share the directory
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            self.remove(path)
+            self.evictions += 1
+            total -= size
+        self.total_bytes = total
+
+    def remove(self, path: str) -> None:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def size(self) -> int:
+        return sum(size for _, size, _ in self.entries())
+
+
+def create_cache_backend(backend: str, path: str, max_bytes: int = 512 * 1024 * 1024, ttl_seconds: Optional[float] = None) -> CacheBackend:
+    if backend == "sqlite":
+        return SQLiteCacheBackend(path, max_bytes=max_bytes, ttl_seconds=ttl_seconds)
+    elif backend == "file":
+        return FileCacheBackend(path, max_bytes=max_bytes, ttl_seconds=ttl_seconds)
+    else:
+        raise ValueError(f"Unknown cache backend: {backend}")
+
+
+def cache_backend_from_env() -> Optional[CacheBackend]:
+    """Build the cache configured through LLM_CACHE_* variables. Caching is disabled when LLM_CACHE_BACKEND is unset."""
+    backend = os.getenv("LLM_CACHE_BACKEND")
+    if not backend:
+        return None
+    ttl = os.getenv("LLM_CACHE_TTL_SECONDS")
+    return create_cache_backend(
+        backend,
+        path=os.getenv("LLM_CACHE_PATH", "data/llm_cache.db" if backend == "sqlite" else "data/llm_cache"),
+        max_bytes=int(os.getenv("LLM_CACHE_MAX_BYTES", 512 * 1024 * 1024)),
+        ttl_seconds=float(ttl) if ttl else None,
+    )
+
+
+class CachedLLMHandler(LLMInterface):
+    """Serves repeated requests from a CacheBackend instead of the wrapped handler."""
+
+    def __init__(self, handler: LLMInterface, provider: str, backend: CacheBackend):
+        self.handler = handler
+        self.provider = provider
+        self.backend = backend
+
+    def generate_text(self, system_prompt: str, user_prompt: str, model_name: str, max_tokens: int = -1) -> str:
+        key = request_key(self.provider, model_name, system_prompt, user_prompt, max_tokens=max_tokens)
+        cached = self.backend.get(key)
+        if cached is not None:
+            return cached
+        response = self.handler.generate_text(system_prompt, user_prompt, model_name, max_tokens)
+        if isinstance(response, str):
+            self.backend.set(key, response)
+        return response
+
+    def generate_json(self, system_prompt: str, user_prompt: str, json_schema: BaseModel, model_name: str, max_tokens: int = -1) -> BaseModel:
+        key = request_key(self.provider, model_name, system_prompt, user_prompt, json_schema, max_tokens)
+        cached = self.backend.get(key)
+        if cached is not None:
+            try:
+                return json_schema.model_validate_json(cached)
+            except ValueError:
+                # Schema changed shape under the same name, fall through and regenerate
+                pass
+        response = self.handler.generate_json(system_prompt, user_prompt, json_schema, model_name, max_tokens)
+        if response is not None:
+            self.backend.set(key, response.model_dump_json())
+        return response
+
+    async def agenerate_text(self, system_prompt: str, user_prompt: str, model_name: str, max_tokens: int = -1) -> str:
+        key = request_key(self.provider, model_name, system_prompt, user_prompt, max_tokens=max_tokens)
+        cached = self.backend.get(key)
+        if cached is not None:
+            return cached
+        response = await self.handler.agenerate_text(system_prompt, user_prompt, model_name, max_tokens)
+        if isinstance(response, str):
+            self.backend.set(key, response)
+        return response
+
+    async def agenerate_json(self, system_prompt: str, user_prompt: str, json_schema: BaseModel, model_name: str, max_tokens: int = -1) -> BaseModel:
+        key = request_key(self.provider, model_name, system_prompt, user_prompt, json_schema, max_tokens)
+        cached = self.backend.get(key)
+        if cached is not None:
+            try:
+                return json_schema.model_validate_json(cached)
+            except ValueError:
+                pass
+        response = await self.handler.agenerate_json(system_prompt, user_prompt, json_schema, model_name, max_tokens)
+        if response is not None:
+            self.backend.set(key, response.model_dump_json())
+        return response
+
+    def stats(self) -> dict:
+        return self.backend.stats()
@@ -0,0 +1,235 @@
+import os
+import threading
+from typing import Optional, List, Union, Callable, Dict, Tuple
+from pydantic import BaseModel
+
+from .interface import LLMInterface
+from .context import Stage, current_stage, llm_stage
+from .streaming import StreamDivergenceError
+from .cache import CachedLLMHandler
+from .scheduler import ScheduledLLMHandler
+from .coalesce import CoalescingLLMHandler, kickoff_coalesced
+from .hedge import HedgedLLMHandler
+
+# Errors that mean the model answered but the answer is unusable, worth retrying on a larger model
+VALIDATION_ERRORS = (ValueError, StreamDivergenceError)
+
+
+def field_coverage(result: BaseModel) -> float:
+    """Share of top-level fields the model actually filled in. An answer made of empty values is a low-confidence one."""
+    values = [getattr(result, name) for name in type(result).model_fields]
+    if not values:
+        return 1.0
+    filled = [value for value in values if value not in (None, "", [], {})]
+    return len(filled) / len(values)
+
+
+def cascade_models_from_env() -> List[str]:
+    """Ordered, cheapest first, list of models configured through LLM_CASCADE_MODELS."""
+    return [model.strip() for model in os.getenv("LLM_CASCADE_MODELS", "").split(",") if model.strip()]
+
+
+def describe(attempts: List[Tuple[str, Optional[str]]]) -> str:
+    return " -> ".join(f"{model} ({reason or 'accepted'})" for model, reason in attempts)
+
+
+class CascadeStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls: Dict[str, int] = {}
+        self.escalations: Dict[str, int] = {}
+        self.answered_by: Dict[str, Dict[str, int]] = {}
+        self.reasons: Dict[str, int] = {}
+
+    def record(self, attempts: List[Tuple[str, Optional[str]]]):
+        """attempts holds (model, failure reason) per model tried, the reason is None for the accepted answer."""
+        stage = current_stage()
+        name = stage.value if stage else "unknown"
+        with self.lock:
+            self.calls[name] = self.calls.get(name, 0) + 1
+            if len(attempts) > 1:
+                self.escalations[name] = self.escalations.get(name, 0) + 1
+            model, reason = attempts[-1]
+            if reason is None:
+                answered = self.answered_by.setdefault(name, {})
+                answered[model] = answered.get(model, 0) + 1
+            for _, reason in attempts:
+                if reason is not None:
+                    self.reasons[reason] = self.reasons.get(reason, 0) + 1
+
+    def stats(self) -> dict:
+        with self.lock:
+            calls = sum(self.calls.values())
+            escalations = sum(self.escalations.values())
+            return {
+                "calls": calls,
+                "escalations": escalations,
+                "escalation_rate": escalations / calls if calls else 0.0,
+                "by_stage": {
+                    name: {
+                        "calls": count,
+                        "escalations": self.escalations.get(name, 0),
+                        "escalation_rate": self.escalations.get(name, 0) / count,
+                        "answered_by": dict(self.answered_by.get(name, {})),
+                    }
+                    for name, count in self.calls.items()
+                },
+                "failure_reasons": dict(self.reasons),
+            }
+
+
+_cascade_stats = CascadeStats()
+
+
+def cascade_stats() -> CascadeStats:
+    return _cascade_stats
+
+
+class CascadeLLMHandler(LLMInterface):
+    """
+    Lets generate_json take an ordered list of models, cheapest first.
+
+    Each model's answer is validated against the schema and scored with confidence. The first model whose answer
+    validates and reaches min_confidence wins, otherwise the next model is tried. When every model falls short
+    the last valid answer is returned, or the last validation error raised.
+    A plain model name is passed through unchanged.
+    """
+
+    def __init__(self, handler: LLMInterface, confidence: Callable[[BaseModel], float] = field_coverage, min_confidence: float = 0.5, stats: CascadeStats = None):
+        self.handler = handler
+        self.confidence = confidence
+        self.min_confidence = min_confidence
+        self.cascade_stats = stats or cascade_stats()
+
+    def stats(self) -> dict:
+        """Stats of the cascade and of every layer it wraps, keyed like the gateway's /stats."""
+        stats = {"cascade": self.cascade_stats.stats()}
+        handler = self.handler
+        while handler is not None:
+            if isinstance(handler, CachedLLMHandler):
+                stats["cache"] = handler.stats()
+            elif isinstance(handler, CoalescingLLMHandler):
+                stats["coalescing"] = handler.stats()
+            elif isinstance(handler, ScheduledLLMHandler):
+                stats["scheduler"] = handler.metrics()
+            elif isinstance(handler, HedgedLLMHandler):
+                stats["hedging"] = handler.stats()
+                handler = handler.primary
+                continue
+            handler = getattr(handler, "handler", None)
+        return stats
+
+    def judge(self, result: Optional[BaseModel]) -> Optional[str]:
+        if result is None:
+            return "invalid"
+        if self.confidence(result) < self.min_confidence:
+            return "low_confidence"
+        return None
+
+    def generate_text(self, system_prompt: str, user_prompt: str, model_name: Union[str, List[str]], max_tokens: int = -1) -> str:
+        # Free text has nothing to validate, the cheapest model answers
+        model_name = model_name[0] if isinstance(model_name, list) else model_name
+        return self.handler.generate_text(system_prompt, user_prompt, model_name, max_tokens)
+
+    def generate_json(self, system_prompt: str, user_prompt: str, json_schema: BaseModel, model_name: Union[str, List[str]], max_tokens: int = -1) -> BaseModel:
+        if not isinstance(model_name, list):
+            return self.handler.generate_json(system_prompt, user_prompt, json_schema, model_name, max_tokens)
+
+        attempts: List[Tuple[str, Optional[str]]] = []
+        best: Optional[BaseModel] = None
+        error: Optional[Exception] = None
+        for model in model_name:
+            try:
+                result = self.handler.generate_json(system_prompt, user_prompt, json_schema, model, max_tokens)
+            except VALIDATION_ERRORS as e:
+                result, error = None, e
+            reason = self.judge(result)
+            attempts.append((model, reason))
+            if result is not None:
+                best = result
+            if reason is None:
+                break
+        return self.settle(attempts, best, error)
+
+    async def agenerate_text(self, system_prompt: str, user_prompt: str, model_name: Union[str, List[str]], max_tokens: int = -1) -> str:
+        model_name = model_name[0] if isinstance(model_name, list) else model_name
+        return await self.handler.agenerate_text(system_prompt, user_prompt, model_name, max_tokens)
+
+    async def agenerate_json(self, system_prompt: str, user_prompt: str, json_schema: BaseModel, model_name: Union[str, List[str]], max_tokens: int = -1) -> BaseModel:
+        if not isinstance(model_name, list):
+            return await self.handler.agenerate_json(system_prompt, user_prompt, json_schema, model_name, max_tokens)
+
+        attempts: List[Tuple[str, Optional[str]]] = []
+        best: Optional[BaseModel] = None
+        error: Optional[Exception] = None
+        for model in model_name:
+            try:
+                result = await self.handler.agenerate_json(system_prompt, user_prompt, json_schema, model, max_tokens)
+            except VALIDATION_ERRORS as e:
+                result, error = None, e
+            reason = self.judge(result)
+            attempts.append((model, reason))
+            if result is not None:
+                best = result
+            if reason is None:
+                break
+        return self.settle(attempts, best, error)
+
+    def settle(self, attempts: List[Tuple[str, Optional[str]]], best: Optional[BaseModel], error: Optional[Exception]) -> Optional[BaseModel]:
+        self.cascade_stats.record(attempts)
+        if len(attempts) > 1:
+            print(f"Model cascade: {describe(attempts)}")
+        if best is None and error is not None:
+            raise error
+        return best
+
+
+def kickoff_cascade(crew, inputs: dict, stage: Stage, models: List[str] = None, min_confidence: float = 0.5) -> Optional[str]:
+    """
+    Run a single-task crew on each model in turn, cheapest first, until its output validates against the task's
+    output_json schema with enough confidence. Returns the JSON output like kickoff_coalesced.
+    Without LLM_CASCADE_MODELS the crew runs once on its configured model.
+    """
+    # Imported here so modules using only the handlers do not need crewai installed
+    from crewai import LLM
+
+    models = models if models is not None else cascade_models_from_env()
+    if not models:
+        return kickoff_coalesced(crew, inputs, stage)
+
+    schema = crew.tasks[-1].output_json
+    original_llms = [agent.llm for agent in crew.agents]
+    attempts: List[Tuple[str, Optional[str]]] = []
+    best: Optional[str] = None
+    output: Optional[str] = None
+    try:
+        for model in models:
+            for agent in crew.agents:
+                agent.llm = LLM(model=model)
+            output = kickoff_coalesced(crew, inputs, stage)
+            try:
+                result = schema.model_validate_json(output) if output is not None else None
+            except ValueError:
+                result = None
+            if result is None:
+                reason = "invalid"
+            elif field_coverage(result) < min_confidence:
+                reason = "low_confidence"
+            else:
+                reason = None
+            attempts.append((model, reason))
+            if result is not None:
+                best = output
+            if reason is None:
+                break
+    finally:
+        # Later runs and cache keys see the crew's configured model again
+        for agent, llm in zip(crew.agents, original_llms):
+            agent.llm = llm
+
+    # Recorded under the crew's stage
+    with llm_stage(stage):
+        cascade_stats().record(attempts)
+    if len(attempts) > 1:
+        print(f"Model cascade for {crew.tasks[-1].agent.role}: {describe(attempts)}")
+    return best if best is not None else output
@@ -0,0 +1,268 @@
+import os
+import json
+import time
+import asyncio
+import threading
+from concurrent.futures import Future
+from typing import Optional, Callable, Awaitable, Dict
+from pydantic import BaseModel
+
+from .interface import LLMInterface
+from .cache import request_key
+from .context import Stage
+from .usage import crew_model
+from .hedge import kickoff_hedged
+
+try:
+    import fcntl
+except ImportError:
+    # Cross-process coalescing needs flock, other platforms only coalesce within the process
+    fcntl = None
+
+
+class FileLock:
+    def __init__(self, path: str):
+        self.path = path
+        self.file = None
+
+    def acquire(self):
+        self.file = open(self.path, "a")
+        fcntl.flock(self.file, fcntl.LOCK_EX)
+
+    def release(self):
+        fcntl.flock(self.file, fcntl.LOCK_UN)
+        self.file.close()
+        self.file = None
+
+
+class SingleFlight:
+    """
+    Lets concurrent callers with the same key share one execution of a call.
+
+    Within a process, callers that arrive while a call is in flight wait for it and receive its result or exception.
+    With a lock_dir, the leaders of different processes also serialize on a per-key lock file. The result is left in
+    the directory for result_ttl seconds, and a process that was waiting on the lock picks it up instead of calling again.
+    Results are strings so they can cross the process boundary.
+    """
+
+    def __init__(self, lock_dir: Optional[str] = None, result_ttl: float = 300.0):
+        self.lock_dir = lock_dir if fcntl is not None else None
+        self.result_ttl = result_ttl
+        self.lock = threading.Lock()
+        self.in_flight: Dict[str, Future] = {}
+        self.calls = 0
+        self.shared_in_process = 0
+        self.shared_across_processes = 0
+        if self.lock_dir:
+            os.makedirs(self.lock_dir, exist_ok=True)
+
+    def join(self, key: str):
+        """Returns (future, is_leader). The leader must resolve the future."""
+        with self.lock:
+            future = self.in_flight.get(key)
+            if future is not None:
+                self.shared_in_process += 1
+                return future, False
+            future = Future()
+            self.in_flight[key] = future
+            return future, True
+
+    def resolve(self, key: str, future: Future, value: Optional[str] = None, error: Optional[BaseException] = None):
+        with self.lock:
+            del self.in_flight[key]
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(value)
+
+    def do(self, key: str, call: Callable[[], Optional[str]]) -> Optional[str]:
+        future, is_leader = self.join(key)
+        if not is_leader:
+            return future.result()
+        try:
+            value = self.lead(key, call)
+        except BaseException as e:
+            self.resolve(key, future, error=e)
+            raise
+        self.resolve(key, future, value)
+        return value
+
+    async def ado(self, key: str, call: Callable[[], Awaitable[Optional[str]]]) -> Optional[str]:
+        future, is_leader = self.join(key)
+        if not is_leader:
+            return await asyncio.wrap_future(future)
+        try:
+            value = await self.alead(key, call)
+        except BaseException as e:
+            self.resolve(key, future, error=e)
+            raise
+        self.resolve(key, future, value)
+        return value
+
+    def lead(self, key: str, call: Callable[[], Optional[str]]) -> Optional[str]:
+        if not self.lock_dir:
+            self.calls += 1
+            return call()
+        started_at = time.time()
+        lock = FileLock(self.lock_path(key))
+        lock.acquire()
+        try:
+            shared = self.read_result(key, started_at)
+            if shared is not None:
+                self.shared_across_processes += 1
+                return shared
+            self.calls += 1
+            value = call()
+            self.write_result(key, value)
+            return value
+        finally:
+            lock.release()
+
+    async def alead(self, key: str, call: Callable[[], Awaitable[Optional[str]]]) -> Optional[str]:
+        if not self.lock_dir:
+            self.calls += 1
+            return await call()
+        started_at = time.time()
+        lock = FileLock(self.lock_path(key))
+        # Waiting on another process must not block the event loop
+        await asyncio.to_thread(lock.acquire)
+        try:
+            shared = self.read_result(key, started_at)
+            if shared is not None:
+                self.shared_across_processes += 1
+                return shared
+            self.calls += 1
+            value = await call()
+            self.write_result(key, value)
+            return value
+        finally:
+            lock.release()
+
+    def lock_path(self, key: str) -> str:
+        return os.path.join(self.lock_dir, f"{key}.lock")
+
+    def result_path(self, key: str) -> str:
+        return os.path.join(self.lock_dir, f"{key}.result")
+
+    def read_result(self, key: str, started_at: float) -> Optional[str]:
+        # Only results finished while we were waiting count, older ones are not in-flight sharing
+        try:
+            with open(self.result_path(key), "r") as file:
+                entry = json.load(file)
+        except (OSError, ValueError):
+            return None
+        if entry["finished_at"] < started_at:
+            return None
+        return entry["value"]
+
+    def write_result(self, key: str, value: Optional[str]):
+        if value is None:
+            return
+        path = self.result_path(key)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, "w") as file:
+            json.dump({"finished_at": time.time(), "value": value}, file)
+        os.replace(temp_path, path)
+        self.sweep()
+
+    def sweep(self):
+        # Lock files stay, removing one another process holds would let a third process lead concurrently
+        cutoff = time.time() - self.result_ttl
+        for name in os.listdir(self.lock_dir):
+            if not name.endswith(".result"):
+                continue
+            path = os.path.join(self.lock_dir, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    def stats(self) -> dict:
+        return {
+            "calls": self.calls,
+            "shared_in_process": self.shared_in_process,
+            "shared_across_processes": self.shared_across_processes,
+            "in_flight": len(self.in_flight),
+        }
+
+
+_single_flight: Optional[SingleFlight] = None
+_single_flight_lock = threading.Lock()
+
+
+def default_single_flight() -> SingleFlight:
+    """Process-wide SingleFlight. Set LLM_COALESCE_LOCK_DIR to a directory shared by the processes that should coalesce."""
+    global _single_flight
+    with _single_flight_lock:
+        if _single_flight is None:
+            _single_flight = SingleFlight(lock_dir=os.getenv("LLM_COALESCE_LOCK_DIR") or None)
+        return _single_flight
+
+
+def crew_request_key(crew, inputs: dict) -> str:
+    """
+    request_key of a crewai Crew run: every task's agent, description and expected output, the last task's output
+    schema and the kickoff inputs. Editing a template or task description therefore starts a new cache entry.
+    """
+    tasks = [
+        {
+            "agent": f"{task.agent.role}\n{task.agent.goal}\n{task.agent.backstory}",
+            "description": task.description,
+            "expected_output": task.expected_output,
+        }
+        for task in crew.tasks
+    ]
+    return request_key(
+        provider="crewai",
+        model_name=crew_model(crew),
+        system_prompt=json.dumps(tasks, sort_keys=True),
+        user_prompt=json.dumps(inputs, sort_keys=True),
+        json_schema=crew.tasks[-1].output_json,
+    )
+
+
+def kickoff_coalesced(crew, inputs: dict, stage: Stage) -> Optional[str]:
+    """kickoff_hedged that shares one run between concurrent identical kickoffs."""
+    return default_single_flight().do(crew_request_key(crew, inputs), lambda: kickoff_hedged(crew, inputs, stage))
+
+
+class CoalescingLLMHandler(LLMInterface):
+    """Shares one in-flight call of the wrapped handler between concurrent identical requests."""
+
+    def __init__(self, handler: LLMInterface, provider: str, single_flight: SingleFlight):
+        self.handler = handler
+        self.provider = provider
+        self.single_flight = single_flight
+
+    def dump(self, response: Optional[BaseModel]) -> Optional[str]:
+        return response.model_dump_json() if response is not None else None
+
+    def load(self, value: Optional[str], json_schema: BaseModel) -> Optional[BaseModel]:
+        # Every caller gets its own model instance
+        return json_schema.model_validate_json(value) if value is not None else None
+
+    def generate_text(self, system_prompt: str, user_prompt: str, model_name: str, max_tokens: int = -1) -> str:
+        key = request_key(self.provider, model_name, system_prompt, user_prompt, max_tokens=max_tokens)
+        return self.single_flight.do(key, lambda: self.handler.generate_text(system_prompt, user_prompt, model_name, max_tokens))
+
+    def generate_json(self, system_prompt: str, user_prompt: str, json_schema: BaseModel, model_name: str, max_tokens: int = -1) -> BaseModel:
+        key = request_key(self.provider, model_name, system_prompt, user_prompt, json_schema, max_tokens)
+        value = self.single_flight.do(key, lambda: self.dump(self.handler.generate_json(system_prompt, user_prompt, json_schema, model_name, max_tokens)))
+        return self.load(value, json_schema)
+
+    async def agenerate_text(self, system_prompt: str, user_prompt: str, model_name: str, max_tokens: int = -1) -> str:
+        key = request_key(self.provider, model_name, system_prompt, user_prompt, max_tokens=max_tokens)
+        return await self.single_flight.ado(key, lambda: self.handler.agenerate_text(system_prompt, user_prompt, model_name, max_tokens))
+
+    async def agenerate_json(self, system_prompt: str, user_prompt: str, json_schema: BaseModel, model_name: str, max_tokens: int = -1) -> BaseModel:
+        key = request_key(self.provider, model_name, system_prompt, user_prompt, json_schema, max_tokens)
+
+        async def call() -> Optional[str]:
+            return self.dump(await self.handler.agenerate_json(system_prompt, user_prompt, json_schema, model_name, max_tokens))
+
+        value = await self.single_flight.ado(key, call)
+        return self.load(value, json_schema)
+
+    def stats(self) -> dict:
+        return self.single_flight.stats()
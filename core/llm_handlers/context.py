@@ -0,0 +1,51 @@
+from enum import Enum
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional, Tuple
+
+
+class Stage(Enum):
+    ONBOARDING = "onboarding"
+    SPEC_EXTRACTION = "spec_extraction"
+    PR_DETECTION = "pr_detection"
+    JIRA_ANALYSIS = "jira_analysis"
+    PR_PROPAGATION = "pr_propagation"
+    JIRA_PROPAGATION = "jira_propagation"
+
+
+# Lower value is served first: detection beats propagation, propagation beats onboarding
+STAGE_PRIORITY = {
+    Stage.PR_DETECTION: 0,
+    Stage.JIRA_ANALYSIS: 0,
+    Stage.PR_PROPAGATION: 1,
+    Stage.JIRA_PROPAGATION: 1,
+    Stage.ONBOARDING: 2,
+    Stage.SPEC_EXTRACTION: 2,
+}
+DEFAULT_PRIORITY = 2
+
+_stages: ContextVar[Tuple[Stage, ...]] = ContextVar("llm_stages", default=())
+
+
+@contextmanager
+def llm_stage(stage: Stage):
+    """Tag every LLM call made inside the block with the calling pipeline stage. Blocks may nest."""
+    token = _stages.set(_stages.get() + (stage,))
+    try:
+        yield stage
+    finally:
+        _stages.reset(token)
+
+
+def current_stage() -> Optional[Stage]:
+    stages = _stages.get()
+    return stages[-1] if stages else None
+
+
+def current_priority() -> int:
+    # A nested stage inherits the most urgent enclosing priority, so spec extraction
+    # running inside PR detection is still scheduled as detection work.
+    stages = _stages.get()
+    if not stages:
+        return DEFAULT_PRIORITY
+    return min(STAGE_PRIORITY.get(stage, DEFAULT_PRIORITY) for stage in stages)
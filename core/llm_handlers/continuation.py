@@ -0,0 +1,54 @@
+import os
+
+# Used by the handlers that own their message loop. crewai crews run their own, a crew's truncated task output is
+# not continued and fails output_json validation as before.
+CONTINUE_PROMPT = (
+    "Your previous answer was cut off because it reached the output token limit. "
+    "Continue exactly where it stopped. Do not repeat any text, do not start over and do not add any commentary."
+)
+# Longest repeated tail we look for when the model restates the end of the previous part
+MAX_OVERLAP = 500
+
+
+def max_continuations() -> int:
+    return int(os.getenv("LLM_MAX_CONTINUATIONS", 3))
+
+
+def strip_fence(text: str) -> str:
+    """Remove the ```json fence local models like to wrap JSON answers in, and any sentence they put before it."""
+    text = text.strip()
+    start = text.find("```")
+    if start > 0 and text[0] not in "{[":
+        text = text[start:]
+    if text.startswith("```"):
+        text = text[3:]
+        if text.lower().startswith("json"):
+            text = text[4:]
+    if text.endswith("```"):
+        text = text[:-3]
+    return text.strip()
+
+
+def continuation_messages(system_prompt: str, user_prompt: str, partial: str) -> list:
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_prompt},
+        {"role": "assistant", "content": partial},
+        {"role": "user", "content": CONTINUE_PROMPT},
+    ]
+
+
+def stitch(prefix: str, continuation: str) -> str:
+    """Append a continuation to the truncated text, dropping a fence it reopens and any tail it repeats."""
+    if continuation.lstrip().startswith("```"):
+        continuation = continuation.lstrip()[3:]
+        if continuation.lower().startswith("json"):
+            continuation = continuation[4:]
+        continuation = continuation.lstrip("\n")
+    for size in range(min(len(prefix), len(continuation), MAX_OVERLAP), 0, -1):
+        if prefix.endswith(continuation[:size]):
+            # Short matches are usually coincidence, a single quote or bracket, not a restatement
+            if size >= 8:
+                return prefix + continuation[size:]
+            break
+    return prefix + continuation
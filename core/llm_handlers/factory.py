@@ -1,11 +1,61 @@
+import os
 from .interface import LLMInterface
 from .openai_handler import OpenAIHandler
 from .lmstudio_handler import LMStudioHandler
+from .cache import CacheBackend, CachedLLMHandler
+from .scheduler import LLMScheduler, ScheduledLLMHandler, default_scheduler
+from .coalesce import SingleFlight, CoalescingLLMHandler, default_single_flight
+from .replay_handler import RecordingHandler, ReplayHandler
+from .cascade import CascadeLLMHandler
+from .hedge import Hedger, HedgedLLMHandler
+from .gateway_client import gateway_url
 
-def create_llm_handler(provider: str, api_key: str, api_url: str = None) -> LLMInterface:
+def create_base_handler(provider: str, api_key: str, api_url: str = None) -> LLMInterface:
     if provider == "openai":
-        return OpenAIHandler(api_key)
+        handler = OpenAIHandler(api_key)
+    elif provider == "gateway":
+        # api_url overrides LLM_GATEWAY_URL, e.g. http://llm_gateway:9504/v1
+        handler = OpenAIHandler(api_key or "adapt", base_url=api_url or f"{gateway_url()}/v1", send_stage=True)
     elif provider == "lmstudio":
-        return LMStudioHandler(api_url)
+        handler = LMStudioHandler(
+            api_url,
+            stream=os.getenv("LMSTUDIO_STREAM", "false").lower() == "true",
+            structured=os.getenv("LMSTUDIO_STRUCTURED_OUTPUT", "true").lower() == "true",
+        )
+    elif provider == "replay":
+        # api_url is the cassette to play back
+        handler = ReplayHandler(api_url or os.environ["LLM_REPLAY_CASSETTE"], latency_scale=float(os.getenv("LLM_REPLAY_LATENCY_SCALE", 0)))
     else:
-        raise ValueError(f"Unknown provider: {provider}")
\ No newline at end of file
+        raise ValueError(f"Unknown provider: {provider}")
+    return handler
+
+def create_llm_handler(provider: str, api_key: str, api_url: str = None, cache: CacheBackend = None, scheduler: LLMScheduler = None, single_flight: SingleFlight = None) -> LLMInterface:
+    handler = create_base_handler(provider, api_key, api_url)
+
+    record_path = os.getenv("LLM_RECORD_CASSETTE")
+    if record_path and provider != "replay":
+        handler = RecordingHandler(handler, record_path, provider)
+
+    # Slow calls are raced against a second provider, e.g. a local LM Studio behind OpenAI
+    hedge_provider = os.getenv("LLM_HEDGE_PROVIDER")
+    if hedge_provider and hedge_provider != provider:
+        handler = HedgedLLMHandler(
+            handler,
+            create_base_handler(hedge_provider, api_key, os.getenv("LLM_HEDGE_API_URL")),
+            Hedger.from_env(provider, hedge_provider),
+            secondary_model=os.getenv("LLM_HEDGE_MODEL") or None,
+        )
+
+    # Every call is admitted by the scheduler, cache hits below never reach it.
+    # The gateway runs the shared scheduler itself, a second one here would halve the budget
+    if provider != "gateway":
+        handler = ScheduledLLMHandler(handler, scheduler or default_scheduler())
+
+    # Identical requests already in flight share the leader's call instead of queueing again
+    handler = CoalescingLLMHandler(handler, provider, single_flight or default_single_flight())
+
+    if cache is not None:
+        handler = CachedLLMHandler(handler, provider, cache)
+
+    # Outermost so each model tried by a cascade is cached and coalesced on its own
+    return CascadeLLMHandler(handler)
\ No newline at end of file
@@ -0,0 +1,116 @@
+import os
+import json
+import time
+import requests
+from typing import Optional
+from requests.adapters import HTTPAdapter
+
+from .cache import CacheBackend, request_key, cache_backend_from_env
+from .scheduler import LLMScheduler, DEFAULT_COMPLETION_TOKENS, default_scheduler
+from .coalesce import SingleFlight, default_single_flight
+from .tokens import estimate_tokens
+from .usage import track_call, cached_prompt_tokens
+
+# Fields that change how the answer is delivered, not what it is
+DELIVERY_FIELDS = ("stream", "stream_options", "user")
+
+
+class UpstreamError(Exception):
+    def __init__(self, status_code: int, body: str):
+        super().__init__(f"Upstream returned HTTP {status_code}: {body[:500]}")
+        self.status_code = status_code
+        self.body = body
+
+
+class ChatGateway:
+    """
+    OpenAI-compatible chat completions shared by every ADAPT process.
+
+    Requests go through the same layers create_llm_handler builds inside a process, only once for all of them:
+    the response cache, coalescing of identical in-flight requests and the scheduler's rate limits, over one pooled
+    connection to the upstream. Every upstream call is recorded in the usage tracker under the caller's stage.
+    """
+
+    def __init__(self, upstream_url: str, api_key: str, cache: Optional[CacheBackend], scheduler: LLMScheduler, single_flight: SingleFlight, pool_size: int = 64):
+        self.upstream_url = upstream_url.rstrip("/")
+        self.headers = {"content-type": "application/json", "authorization": f"Bearer {api_key}"}
+        self.cache = cache
+        self.scheduler = scheduler
+        self.single_flight = single_flight
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    @classmethod
+    def from_env(cls) -> "ChatGateway":
+        """Upstream from LLM_GATEWAY_UPSTREAM_URL (default OpenAI), layers from the usual LLM_* variables."""
+        return cls(
+            upstream_url=os.getenv("LLM_GATEWAY_UPSTREAM_URL", "https://api.openai.com/v1"),
+            api_key=os.getenv("OPENAI_API_KEY", ""),
+            cache=cache_backend_from_env(),
+            scheduler=default_scheduler(),
+            single_flight=default_single_flight(),
+        )
+
+    def key(self, body: dict) -> str:
+        request = {name: value for name, value in body.items() if name not in DELIVERY_FIELDS}
+        return request_key("gateway", body.get("model", ""), "", json.dumps(request, sort_keys=True), max_tokens=body.get("max_tokens") or -1)
+
+    def estimate(self, body: dict) -> int:
+        prompt_tokens = sum(estimate_tokens(json.dumps(message.get("content", ""))) for message in body.get("messages", []))
+        max_tokens = body.get("max_tokens") or body.get("max_completion_tokens") or -1
+        return prompt_tokens + (max_tokens if max_tokens > 0 else DEFAULT_COMPLETION_TOKENS)
+
+    def complete(self, body: dict) -> dict:
+        """The chat completion for body, run under the caller's llm_stage."""
+        key = self.key(body)
+        if self.cache is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                return json.loads(cached)
+
+        value = self.single_flight.do(key, lambda: self.forward(body))
+        if self.cache is not None:
+            self.cache.set(key, value)
+        return json.loads(value)
+
+    def forward(self, body: dict) -> str:
+        self.scheduler.acquire(self.estimate(body))
+        # Streaming is answered by the gateway from the full completion
+        request = {name: value for name, value in body.items() if name not in ("stream", "stream_options")}
+        with track_call("gateway", body.get("model", "")) as call:
+            response = self.session.post(f"{self.upstream_url}/chat/completions", headers=self.headers, data=json.dumps(request))
+            if response.status_code >= 400:
+                raise UpstreamError(response.status_code, response.text)
+            completion = response.json()
+            usage = completion.get("usage") or {}
+            call.set_usage(usage.get("prompt_tokens"), usage.get("completion_tokens"), cached_prompt_tokens(usage))
+        return json.dumps(completion)
+
+    def stats(self) -> dict:
+        return {
+            "upstream": self.upstream_url,
+            "cache": self.cache.stats() if self.cache is not None else None,
+            "coalescing": self.single_flight.stats(),
+            "scheduler": self.scheduler.metrics(),
+        }
+
+
+def completion_chunks(completion: dict):
+    """A chat completion as the server-sent events of a stream, for clients that asked for one."""
+    choices = [
+        {"index": choice.get("index", 0), "delta": choice.get("message", {}), "finish_reason": choice.get("finish_reason")}
+        for choice in completion.get("choices", [])
+    ]
+    chunk = {
+        "id": completion.get("id"),
+        "object": "chat.completion.chunk",
+        "created": completion.get("created", int(time.time())),
+        "model": completion.get("model"),
+        "choices": choices,
+        "usage": completion.get("usage"),
+    }
+    yield f"data: {json.dumps(chunk)}\n\n"
+    yield "data: [DONE]\n\n"
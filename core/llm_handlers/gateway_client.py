@@ -0,0 +1,58 @@
+import os
+from contextlib import contextmanager
+from typing import Optional
+
+from .context import Stage, current_stage
+
+# Header the gateway reads the calling stage from, crews pass it in the URL instead
+STAGE_HEADER = "X-ADAPT-Stage"
+
+
+def gateway_url() -> Optional[str]:
+    """Base URL of the shared LLM gateway, e.g. http://llm_gateway:9504. Calls go straight to the provider when unset."""
+    url = os.getenv("LLM_GATEWAY_URL")
+    return url.rstrip("/") if url else None
+
+
+def stage_headers() -> dict:
+    stage = current_stage()
+    return {STAGE_HEADER: stage.value} if stage else {}
+
+
+def stage_base_url(url: str, stage: Stage) -> str:
+    """OpenAI base URL of the gateway that tags every call with stage, for clients that cannot set headers."""
+    return f"{url}/stages/{stage.value}/v1"
+
+
+@contextmanager
+def routed_to_gateway(crew, stage: Stage):
+    """
+    Point the crew's agents at the gateway for the duration of the block and yield whether all of them were.
+    Agents whose LLM already has its own base_url, such as a hedging copy on a local server, keep it.
+    """
+    url = gateway_url()
+    if url is None:
+        yield False
+        return
+
+    # Imported here so modules using only the handlers do not need crewai installed
+    from crewai import LLM
+
+    original_llms = [agent.llm for agent in crew.agents]
+    routed = bool(crew.agents)
+    try:
+        for agent in crew.agents:
+            if getattr(agent.llm, "base_url", None):
+                routed = False
+                continue
+            model = getattr(agent.llm, "model", None) or os.getenv("MODEL", "")
+            # The gateway speaks the OpenAI protocol whatever serves the model behind it
+            agent.llm = LLM(
+                model=f"openai/{model.split('/')[-1]}",
+                base_url=stage_base_url(url, stage),
+                api_key=os.getenv("OPENAI_API_KEY") or "adapt",
+            )
+        yield routed
+    finally:
+        for agent, llm in zip(crew.agents, original_llms):
+            agent.llm = llm
@@ -0,0 +1,389 @@
+import os
+import time
+import asyncio
+import threading
+import contextvars
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
+from typing import Optional, Callable, Awaitable, Dict, Any
+from pydantic import BaseModel
+
+from .interface import LLMInterface
+from .context import Stage
+from .usage import kickoff_with_usage, crew_model
+
+
+class LatencyWindow:
+    """The latest max_samples latencies of successful calls."""
+
+    def __init__(self, max_samples: int = 200):
+        self.samples = deque(maxlen=max_samples)
+        self.lock = threading.Lock()
+
+    def record(self, seconds: float):
+        with self.lock:
+            self.samples.append(seconds)
+
+    def percentile(self, percentile: float) -> Optional[float]:
+        with self.lock:
+            samples = sorted(self.samples)
+        if not samples:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * percentile))]
+
+    def __len__(self) -> int:
+        return len(self.samples)
+
+
+class CircuitBreaker:
+    """
+    Stops sending calls to a provider that keeps failing.
+
+    After failure_threshold consecutive failures the breaker opens and allow() is False for reset_timeout seconds.
+    Then a single trial call is let through, its outcome closes the breaker or opens it again.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.lock = threading.Lock()
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.trial_in_flight = False
+        self.trips = 0
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at < self.reset_timeout:
+            return "open"
+        return "half_open"
+
+    def allow(self) -> bool:
+        with self.lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half_open" and not self.trial_in_flight:
+                self.trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_in_flight = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            # Late failures of calls made before the breaker opened do not extend the open period
+            if self.trial_in_flight or (self.opened_at is None and self.failures >= self.failure_threshold):
+                self.trips += 1
+                self.opened_at = time.monotonic()
+                print(f"Circuit breaker for {self.name} opened after {self.failures} consecutive failures")
+            self.trial_in_flight = False
+
+    def stats(self) -> dict:
+        return {"state": self.state, "consecutive_failures": self.failures, "trips": self.trips}
+
+
+class Outcome:
+    def __init__(self, source: str, value: Any = None, error: Optional[BaseException] = None, valid: bool = False):
+        self.source = source
+        self.value = value
+        self.error = error
+        self.valid = valid
+
+    def unwrap(self) -> Any:
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+
+class Hedger:
+    """
+    Runs a call on the primary provider and, when it has not answered by the deadline, the same call on the secondary.
+    The first valid answer wins and the other call is cancelled.
+
+    The deadline is the given percentile of the primary's recent latencies for the same key, so only the slow tail
+    gets hedged. A primary that fails early hands over to the secondary right away, and a provider whose circuit
+    breaker is open is routed around.
+    """
+
+    def __init__(
+        self,
+        primary_breaker: CircuitBreaker,
+        secondary_breaker: CircuitBreaker,
+        percentile: float = 0.95,
+        initial_deadline: float = 10.0,
+        min_deadline: float = 0.5,
+        min_samples: int = 20,
+        workers: int = 32,
+    ):
+        self.primary_breaker = primary_breaker
+        self.secondary_breaker = secondary_breaker
+        self.percentile = percentile
+        self.initial_deadline = initial_deadline
+        self.min_deadline = min_deadline
+        self.min_samples = min_samples
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="llm-hedge")
+        self.lock = threading.Lock()
+        self.latencies: Dict[str, LatencyWindow] = {}
+        self.counts: Dict[str, int] = {"calls": 0, "hedged": 0, "primary_wins": 0, "secondary_wins": 0, "routed_around": 0}
+
+    @classmethod
+    def from_env(cls, primary: str, secondary: str) -> "Hedger":
+        def breaker(name: str) -> CircuitBreaker:
+            return CircuitBreaker(
+                name,
+                failure_threshold=int(os.getenv("LLM_BREAKER_FAILURES", 5)),
+                reset_timeout=float(os.getenv("LLM_BREAKER_RESET_SECONDS", 30)),
+            )
+
+        return cls(
+            breaker(primary),
+            breaker(secondary),
+            percentile=float(os.getenv("LLM_HEDGE_PERCENTILE", 0.95)),
+            initial_deadline=float(os.getenv("LLM_HEDGE_INITIAL_DEADLINE_SECONDS", 10)),
+        )
+
+    def window(self, key: str) -> LatencyWindow:
+        with self.lock:
+            return self.latencies.setdefault(key, LatencyWindow())
+
+    def deadline(self, key: str) -> float:
+        """Seconds to wait for the primary before hedging. A fixed guess until enough latencies were seen."""
+        window = self.window(key)
+        if len(window) < self.min_samples:
+            return self.initial_deadline
+        return max(window.percentile(self.percentile), self.min_deadline)
+
+    def count(self, name: str):
+        with self.lock:
+            self.counts[name] += 1
+
+    def attempt(self, source: str, call: Callable[[], Any], valid: Callable[[Any], bool], key: str) -> Outcome:
+        breaker = self.primary_breaker if source == "primary" else self.secondary_breaker
+        started_at = time.monotonic()
+        try:
+            value = call()
+        except Exception as e:
+            breaker.record_failure()
+            return Outcome(source, error=e)
+        return self.judge(source, value, valid, key, time.monotonic() - started_at)
+
+    async def aattempt(self, source: str, call: Callable[[], Awaitable[Any]], valid: Callable[[Any], bool], key: str) -> Outcome:
+        breaker = self.primary_breaker if source == "primary" else self.secondary_breaker
+        started_at = time.monotonic()
+        try:
+            value = await call()
+        except Exception as e:
+            breaker.record_failure()
+            return Outcome(source, error=e)
+        return self.judge(source, value, valid, key, time.monotonic() - started_at)
+
+    def judge(self, source: str, value: Any, valid: Callable[[Any], bool], key: str, latency: float) -> Outcome:
+        breaker = self.primary_breaker if source == "primary" else self.secondary_breaker
+        if not valid(value):
+            breaker.record_failure()
+            return Outcome(source, value=value)
+        breaker.record_success()
+        if source == "primary":
+            # Late primary answers count too, otherwise the deadline would only ever learn the fast calls
+            self.window(key).record(latency)
+        return Outcome(source, value=value, valid=True)
+
+    def submit(self, source: str, call: Callable[[], Any], valid: Callable[[Any], bool], key: str) -> Future:
+        # Worker threads see the caller's stage and priority
+        return self.executor.submit(contextvars.copy_context().run, self.attempt, source, call, valid, key)
+
+    def route(self) -> Optional[str]:
+        """The single provider to use when a breaker is open, None when both may be hedged."""
+        if self.primary_breaker.allow():
+            return None
+        if self.secondary_breaker.allow():
+            self.count("routed_around")
+            return "secondary"
+        # Both are failing, the primary's answer or error is as good as any
+        return "primary"
+
+    def win(self, outcome: Outcome) -> Any:
+        self.count(f"{outcome.source}_wins")
+        return outcome.value
+
+    def run(self, key: str, primary: Callable[[], Any], secondary: Callable[[], Any], valid: Callable[[Any], bool]) -> Any:
+        self.count("calls")
+        calls = {"primary": primary, "secondary": secondary}
+        routed = self.route()
+        if routed is not None:
+            return self.attempt(routed, calls[routed], valid, key).unwrap()
+
+        primary_future = self.submit("primary", primary, valid, key)
+        done, _ = wait([primary_future], timeout=self.deadline(key))
+        if done and primary_future.result().valid:
+            return self.win(primary_future.result())
+        if not self.secondary_breaker.allow():
+            return primary_future.result().unwrap()
+
+        self.count("hedged")
+        pending = {primary_future, self.submit("secondary", secondary, valid, key)}
+        last: Optional[Outcome] = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                outcome = future.result()
+                if outcome.valid:
+                    # A call already running on a worker thread cannot be interrupted, its answer is dropped
+                    for other in pending:
+                        other.cancel()
+                    return self.win(outcome)
+                last = outcome
+        return last.unwrap()
+
+    async def arun(self, key: str, primary: Callable[[], Awaitable[Any]], secondary: Callable[[], Awaitable[Any]], valid: Callable[[Any], bool]) -> Any:
+        self.count("calls")
+        calls = {"primary": primary, "secondary": secondary}
+        routed = self.route()
+        if routed is not None:
+            return (await self.aattempt(routed, calls[routed], valid, key)).unwrap()
+
+        primary_task = asyncio.ensure_future(self.aattempt("primary", primary, valid, key))
+        done, _ = await asyncio.wait({primary_task}, timeout=self.deadline(key))
+        if done and primary_task.result().valid:
+            return self.win(primary_task.result())
+        if not self.secondary_breaker.allow():
+            return (await primary_task).unwrap()
+
+        self.count("hedged")
+        pending = {primary_task, asyncio.ensure_future(self.aattempt("secondary", secondary, valid, key))}
+        last: Optional[Outcome] = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                outcome = task.result()
+                if outcome.valid:
+                    # Cancelling the task closes its HTTP request
+                    for other in pending:
+                        other.cancel()
+                    return self.win(outcome)
+                last = outcome
+        return last.unwrap()
+
+    def stats(self) -> dict:
+        with self.lock:
+            stats = dict(self.counts)
+            keys = list(self.latencies)
+        deadlines = {key: self.deadline(key) for key in keys}
+        stats["hedge_rate"] = stats["hedged"] / stats["calls"] if stats["calls"] else 0.0
+        stats["deadlines"] = deadlines
+        stats["breakers"] = {breaker.name: breaker.stats() for breaker in (self.primary_breaker, self.secondary_breaker)}
+        return stats
+
+
+class HedgedLLMHandler(LLMInterface):
+    """Hedges every call of the primary handler with the secondary handler, see Hedger."""
+
+    def __init__(self, primary: LLMInterface, secondary: LLMInterface, hedger: Hedger, secondary_model: Optional[str] = None):
+        self.primary = primary
+        self.secondary = secondary
+        self.hedger = hedger
+        # The secondary usually serves other models, e.g. a local LM Studio model behind OpenAI
+        self.secondary_model = secondary_model
+
+    def secondary_name(self, model_name: str) -> str:
+        return self.secondary_model or model_name
+
+    def generate_text(self, system_prompt: str, user_prompt: str, model_name: str, max_tokens: int = -1) -> str:
+        return self.hedger.run(
+            model_name,
+            lambda: self.primary.generate_text(system_prompt, user_prompt, model_name, max_tokens),
+            lambda: self.secondary.generate_text(system_prompt, user_prompt, self.secondary_name(model_name), max_tokens),
+            valid=lambda text: bool(text),
+        )
+
+    def generate_json(self, system_prompt: str, user_prompt: str, json_schema: BaseModel, model_name: str, max_tokens: int = -1) -> BaseModel:
+        return self.hedger.run(
+            model_name,
+            lambda: self.primary.generate_json(system_prompt, user_prompt, json_schema, model_name, max_tokens),
+            lambda: self.secondary.generate_json(system_prompt, user_prompt, json_schema, self.secondary_name(model_name), max_tokens),
+            valid=lambda result: result is not None,
+        )
+
+    async def agenerate_text(self, system_prompt: str, user_prompt: str, model_name: str, max_tokens: int = -1) -> str:
+        return await self.hedger.arun(
+            model_name,
+            lambda: self.primary.agenerate_text(system_prompt, user_prompt, model_name, max_tokens),
+            lambda: self.secondary.agenerate_text(system_prompt, user_prompt, self.secondary_name(model_name), max_tokens),
+            valid=lambda text: bool(text),
+        )
+
+    async def agenerate_json(self, system_prompt: str, user_prompt: str, json_schema: BaseModel, model_name: str, max_tokens: int = -1) -> BaseModel:
+        return await self.hedger.arun(
+            model_name,
+            lambda: self.primary.agenerate_json(system_prompt, user_prompt, json_schema, model_name, max_tokens),
+            lambda: self.secondary.agenerate_json(system_prompt, user_prompt, json_schema, self.secondary_name(model_name), max_tokens),
+            valid=lambda result: result is not None,
+        )
+
+    def stats(self) -> dict:
+        return self.hedger.stats()
+
+
+_crew_hedger: Optional[Hedger] = None
+_crew_hedger_lock = threading.Lock()
+
+
+def crew_hedger() -> Optional[Hedger]:
+    """Process-wide Hedger for crew runs, configured when LLM_HEDGE_CREW_MODEL names the secondary model."""
+    global _crew_hedger
+    secondary_model = os.getenv("LLM_HEDGE_CREW_MODEL")
+    if not secondary_model:
+        return None
+    with _crew_hedger_lock:
+        if _crew_hedger is None:
+            _crew_hedger = Hedger.from_env(os.getenv("MODEL", "primary"), secondary_model)
+        return _crew_hedger
+
+
+def kickoff_hedged(crew, inputs: dict, stage: Stage, hedger: Optional[Hedger] = None, hedge_crew=None) -> Optional[str]:
+    """
+    kickoff_with_usage returning the JSON output, hedged with a copy of the crew running on LLM_HEDGE_CREW_MODEL
+    (served from LLM_HEDGE_CREW_BASE_URL when set). Without LLM_HEDGE_CREW_MODEL the crew simply runs.
+    """
+    hedger = hedger or crew_hedger()
+    if hedger is None:
+        return kickoff_with_usage(crew, inputs, stage).json
+
+    if hedge_crew is None:
+        # Imported here so modules using only the handlers do not need crewai installed
+        from crewai import LLM
+
+        hedge_crew = crew.copy()
+        for agent in hedge_crew.agents:
+            agent.llm = LLM(model=os.environ["LLM_HEDGE_CREW_MODEL"], base_url=os.getenv("LLM_HEDGE_CREW_BASE_URL") or None)
+    # The losing leg keeps running on its worker thread after the winner returns, so neither leg may run on the
+    # caller's crew: the next kickoff or a cascade swapping its LLMs would share the Crew with it
+    primary_crew = crew.copy()
+    schema = crew.tasks[-1].output_json
+
+    def valid(output: Optional[str]) -> bool:
+        if output is None:
+            return False
+        if schema is None:
+            return True
+        try:
+            schema.model_validate_json(output)
+        except ValueError:
+            return False
+        return True
+
+    return hedger.run(
+        f"{crew.tasks[-1].agent.role}:{crew_model(crew)}",
+        lambda: kickoff_with_usage(primary_crew, inputs, stage).json,
+        lambda: kickoff_with_usage(hedge_crew, inputs, stage).json,
+        valid,
+    )
@@ -1,3 +1,4 @@
+import asyncio
 from abc import ABC, abstractmethod
 from pydantic import BaseModel
 
@@ -10,3 +11,10 @@ class LLMInterface(ABC):
     def generate_json(self, system_prompt: str, user_prompt: str, json_schema: BaseModel, model_name: str, max_tokens: int = -1) -> BaseModel:
         pass
 
+    async def agenerate_text(self, system_prompt: str, user_prompt: str, model_name: str, max_tokens: int = -1) -> str:
+        # Handlers without a native async client fall back to a worker thread
+        return await asyncio.to_thread(self.generate_text, system_prompt, user_prompt, model_name, max_tokens)
+
+    async def agenerate_json(self, system_prompt: str, user_prompt: str, json_schema: BaseModel, model_name: str, max_tokens: int = -1) -> BaseModel:
+        return await asyncio.to_thread(self.generate_json, system_prompt, user_prompt, json_schema, model_name, max_tokens)
+
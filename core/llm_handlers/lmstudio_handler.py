@@ -1,9 +1,22 @@
+import asyncio
+import weakref
 import requests
+import httpx
 import json
-from typing import Optional
+from typing import AsyncIterator, Optional, Tuple
 from pydantic import BaseModel
+from requests.adapters import HTTPAdapter
 
 from .interface import LLMInterface
+from .usage import track_call, cached_prompt_tokens
+from .continuation import continuation_messages, max_continuations, stitch, strip_fence
+from .streaming import IncrementalJSONValidator, StreamDivergenceError, StreamMetrics, StreamTimer, iter_sse_deltas, aiter_sse_deltas
+
+async def hold_client(client: httpx.AsyncClient) -> AsyncIterator[None]:
+    try:
+        yield
+    finally:
+        await client.aclose()
 
 class Message(BaseModel):
     role: str
@@ -13,6 +26,7 @@ class Usage(BaseModel):
     prompt_tokens: int
     completion_tokens: int
     total_tokens: int
+    prompt_tokens_details: Optional[dict] = None
 
 class Choice(BaseModel):
     index: int
@@ -26,6 +40,8 @@ class LMStudioRequest(BaseModel):
     temperature: float
     max_tokens: int
     stream: bool
+    stream_options: Optional[dict] = None
+    response_format: Optional[dict] = None
 
 class LMStudioResponse(BaseModel):
     id: str
@@ -37,37 +53,263 @@ class LMStudioResponse(BaseModel):
     system_fingerprint: str
 
     def content_json(self) -> dict:
-        stripped_content = self.choices[0].message.content.strip('```json')
-        return json.loads(stripped_content)
+        return json.loads(strip_fence(self.choices[0].message.content))
+
+class UnsupportedResponseFormat(Exception):
+    """The server rejected the json_schema response_format of a request."""
+    pass
+
+# Words a server's error names the rejected response_format with. Other 400s, like a prompt over the context length, are plain errors
+RESPONSE_FORMAT_ERRORS = ("response_format", "json_schema")
 
 class LMStudioHandler(LLMInterface):
-    def __init__(self, api_url: str):
+    provider = "lmstudio"
+
+    def __init__(self, api_url: str, pool_size: int = 32, stream: bool = False, structured: bool = True):
         self.api_url = api_url
-    
-    def generate_text(self, system_prompt:str, user_prompt: str, model_name: str, max_tokens: int = -1) -> str:
-        headers = {"content-type":"application/json"}
-        body = LMStudioRequest(model= model_name,
+        self.headers = {"content-type":"application/json"}
+        # When set, generate_json streams the completion and validates it as it arrives
+        self.stream = stream
+        # When set, generate_json constrains sampling to the schema. Cleared the first time the server rejects it
+        self.structured = structured
+
+        # Keep-alive connection pool shared by every sync call on this handler
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self.pool_size = pool_size
+        # httpx clients are bound to the event loop that created them, so each loop gets its own
+        self.async_clients = weakref.WeakKeyDictionary()
+        self.async_client_holders = weakref.WeakKeyDictionary()
+
+    async def get_async_client(self) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        client = self.async_clients.get(loop)
+        if client is None:
+            client = httpx.AsyncClient(
+                timeout=None,
+                limits=httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size),
+            )
+            # asyncio.run finalizes open async generators before it closes the loop, this one takes the client with it
+            holder = hold_client(client)
+            await holder.__anext__()
+            self.async_clients[loop] = client
+            self.async_client_holders[loop] = holder
+        return client
+
+    async def aclose(self):
+        # Close the client of the running loop, the loop is the only one that can still close it
+        loop = asyncio.get_running_loop()
+        holder = self.async_client_holders.pop(loop, None)
+        self.async_clients.pop(loop, None)
+        if holder is not None:
+            await holder.aclose()
+
+    def build_request(self, system_prompt: str, user_prompt: str, model_name: str, max_tokens: int, json_schema: BaseModel = None) -> LMStudioRequest:
+        return LMStudioRequest(model= model_name,
                         stream=False,
                         messages=[Message(role="system", content=system_prompt),Message(role="user", content=user_prompt)],
                         temperature=0.7,
-                        max_tokens=max_tokens)
-        response = requests.post(self.api_url, headers=headers, data=body.json())
-        json_response = response.json()
-        lm_studio_response = LMStudioResponse(**json_response)
-        return lm_studio_response.choices[0].message.content
+                        max_tokens=max_tokens,
+                        response_format=self.response_format(json_schema))
+
+    def response_format(self, json_schema: BaseModel = None) -> Optional[dict]:
+        """json_schema response_format, which OpenAI-compatible local servers enforce with a grammar while sampling."""
+        if json_schema is None or not self.structured:
+            return None
+        return {
+            "type": "json_schema",
+            "json_schema": {"name": json_schema.__name__, "strict": True, "schema": json_schema.model_json_schema()},
+        }
+
+    def check_response_format(self, status_code: int, body: LMStudioRequest, detail: str = ""):
+        if body.response_format is not None and status_code in (400, 422) and any(word in detail for word in RESPONSE_FORMAT_ERRORS):
+            raise UnsupportedResponseFormat(f"HTTP {status_code} {detail}".strip())
+
+    def disable_structured(self, error: UnsupportedResponseFormat):
+        print(f"LM Studio server at {self.api_url} rejected json_schema response_format ({error}), falling back to parsing free text")
+        self.structured = False
+
+    def build_continuation_request(self, system_prompt: str, user_prompt: str, partial: str, model_name: str, max_tokens: int) -> LMStudioRequest:
+        body = self.build_request(system_prompt, user_prompt, model_name, max_tokens)
+        body.messages = [Message(**message) for message in continuation_messages(system_prompt, user_prompt, partial)]
+        return body
+
+    def post(self, body: LMStudioRequest) -> LMStudioResponse:
+        with track_call(self.provider, body.model) as call:
+            response = self.session.post(self.api_url, headers=self.headers, data=body.model_dump_json(exclude_none=True))
+            self.check_response_format(response.status_code, body, response.text)
+            response.raise_for_status()
+            lm_studio_response = LMStudioResponse(**response.json())
+            call.set_usage(lm_studio_response.usage.prompt_tokens, lm_studio_response.usage.completion_tokens, cached_prompt_tokens(lm_studio_response.usage))
+        return lm_studio_response
+
+    async def apost(self, body: LMStudioRequest) -> LMStudioResponse:
+        with track_call(self.provider, body.model) as call:
+            client = await self.get_async_client()
+            response = await client.post(self.api_url, headers=self.headers, content=body.model_dump_json(exclude_none=True))
+            self.check_response_format(response.status_code, body, response.text)
+            response.raise_for_status()
+            lm_studio_response = LMStudioResponse(**response.json())
+            call.set_usage(lm_studio_response.usage.prompt_tokens, lm_studio_response.usage.completion_tokens, cached_prompt_tokens(lm_studio_response.usage))
+        return lm_studio_response
+
+    def stream_json(self, system_prompt: str, user_prompt: str, json_schema: BaseModel, model_name: str, max_tokens: int = -1, strict: bool = False) -> Tuple[BaseModel, StreamMetrics]:
+        body = self.build_stream_request(system_prompt, user_prompt, model_name, max_tokens, json_schema)
+        validator = IncrementalJSONValidator(json_schema, strict=strict)
+        metrics = StreamMetrics()
+        timer = StreamTimer(metrics)
+        with track_call(self.provider, model_name) as call:
+            try:
+                with self.session.post(self.api_url, headers=self.headers, data=body.model_dump_json(exclude_none=True), stream=True) as response:
+                    self.check_response_format(response.status_code, body, response.text if response.status_code >= 400 else "")
+                    response.raise_for_status()
+                    for delta in iter_sse_deltas(response.iter_lines(), metrics):
+                        timer.token()
+                        # Raising here closes the connection, which stops the generation on the server
+                        validator.feed(delta)
+                if metrics.finish_reason == "length":
+                    # The prefix already validated, the continuation is checked as it is fed on
+                    prefix = validator.text
+                    validator.feed(self.continue_text(system_prompt, user_prompt, prefix, "length", model_name, max_tokens)[len(prefix):])
+                content = validator.finish()
+            except StreamDivergenceError as e:
+                metrics.aborted = True
+                e.metrics = metrics
+                raise
+            finally:
+                self.finish_stream(call, timer, model_name)
+        return json_schema.model_validate_json(content), metrics
+
+    async def astream_json(self, system_prompt: str, user_prompt: str, json_schema: BaseModel, model_name: str, max_tokens: int = -1, strict: bool = False) -> Tuple[BaseModel, StreamMetrics]:
+        body = self.build_stream_request(system_prompt, user_prompt, model_name, max_tokens, json_schema)
+        validator = IncrementalJSONValidator(json_schema, strict=strict)
+        metrics = StreamMetrics()
+        timer = StreamTimer(metrics)
+        with track_call(self.provider, model_name) as call:
+            try:
+                client = await self.get_async_client()
+                async with client.stream("POST", self.api_url, headers=self.headers, content=body.model_dump_json(exclude_none=True)) as response:
+                    if response.status_code >= 400:
+                        await response.aread()
+                    self.check_response_format(response.status_code, body, response.text if response.status_code >= 400 else "")
+                    response.raise_for_status()
+                    async for delta in aiter_sse_deltas(response.aiter_lines(), metrics):
+                        timer.token()
+                        validator.feed(delta)
+                if metrics.finish_reason == "length":
+                    prefix = validator.text
+                    validator.feed((await self.acontinue_text(system_prompt, user_prompt, prefix, "length", model_name, max_tokens))[len(prefix):])
+                content = validator.finish()
+            except StreamDivergenceError as e:
+                metrics.aborted = True
+                e.metrics = metrics
+                raise
+            finally:
+                self.finish_stream(call, timer, model_name)
+        return json_schema.model_validate_json(content), metrics
+
+    def build_stream_request(self, system_prompt: str, user_prompt: str, model_name: str, max_tokens: int, json_schema: BaseModel = None) -> LMStudioRequest:
+        body = self.build_request(system_prompt, user_prompt, model_name, max_tokens, json_schema)
+        body.stream = True
+        # Ask for a trailing usage chunk so streamed calls are accounted like blocking ones
+        body.stream_options = {"include_usage": True}
+        return body
+
+    def finish_stream(self, call: track_call, timer: StreamTimer, model_name: str):
+        timer.stop()
+        metrics = timer.metrics
+        call.time_to_first_token = metrics.time_to_first_token
+        call.set_usage(metrics.prompt_tokens, metrics.completion_tokens, metrics.cached_tokens)
+        self.log_stream(model_name, metrics)
+
+    def log_stream(self, model_name: str, metrics: StreamMetrics):
+        ttft = f"{metrics.time_to_first_token:.2f}s" if metrics.time_to_first_token is not None else "n/a"
+        status = "aborted" if metrics.aborted else metrics.finish_reason
+        print(f"LM Studio stream [{model_name}]: time to first token {ttft}, total {metrics.total_time:.2f}s, {metrics.characters} chars, {status}")
+
+    def continue_text(self, system_prompt: str, user_prompt: str, content: str, finish_reason: Optional[str], model_name: str, max_tokens: int) -> str:
+        """Keep asking for the rest of a completion cut off at max_tokens and stitch the parts together."""
+        continuations = 0
+        while finish_reason == "length" and continuations < max_continuations():
+            continuations += 1
+            print(f"LM Studio [{model_name}]: completion hit max_tokens, requesting continuation {continuations}")
+            lm_studio_response = self.post(self.build_continuation_request(system_prompt, user_prompt, content, model_name, max_tokens))
+            content = stitch(content, lm_studio_response.choices[0].message.content)
+            finish_reason = lm_studio_response.choices[0].finish_reason
+        return content
+
+    async def acontinue_text(self, system_prompt: str, user_prompt: str, content: str, finish_reason: Optional[str], model_name: str, max_tokens: int) -> str:
+        continuations = 0
+        while finish_reason == "length" and continuations < max_continuations():
+            continuations += 1
+            print(f"LM Studio [{model_name}]: completion hit max_tokens, requesting continuation {continuations}")
+            lm_studio_response = await self.apost(self.build_continuation_request(system_prompt, user_prompt, content, model_name, max_tokens))
+            content = stitch(content, lm_studio_response.choices[0].message.content)
+            finish_reason = lm_studio_response.choices[0].finish_reason
+        return content
+
+    def complete(self, system_prompt: str, user_prompt: str, model_name: str, max_tokens: int, json_schema: BaseModel = None) -> str:
+        body = self.build_request(system_prompt, user_prompt, model_name, max_tokens, json_schema)
+        try:
+            lm_studio_response = self.post(body)
+        except UnsupportedResponseFormat as e:
+            self.disable_structured(e)
+            body.response_format = None
+            lm_studio_response = self.post(body)
+        choice = lm_studio_response.choices[0]
+        return self.continue_text(system_prompt, user_prompt, choice.message.content, choice.finish_reason, model_name, max_tokens)
+
+    async def acomplete(self, system_prompt: str, user_prompt: str, model_name: str, max_tokens: int, json_schema: BaseModel = None) -> str:
+        body = self.build_request(system_prompt, user_prompt, model_name, max_tokens, json_schema)
+        try:
+            lm_studio_response = await self.apost(body)
+        except UnsupportedResponseFormat as e:
+            self.disable_structured(e)
+            body.response_format = None
+            lm_studio_response = await self.apost(body)
+        choice = lm_studio_response.choices[0]
+        return await self.acontinue_text(system_prompt, user_prompt, choice.message.content, choice.finish_reason, model_name, max_tokens)
+
+    def parse_content(self, content: str, json_schema: BaseModel, retry: bool) -> Optional[BaseModel]:
+        """The completion as json_schema. None asks the caller for one fresh attempt when retry is set."""
+        try:
+            return json_schema.model_validate_json(strip_fence(content))
+        except ValueError as e:
+            if not retry:
+                raise
+            print(f"LM Studio completion is not valid {json_schema.__name__} JSON, retrying the call: {e}")
+            return None
+
+    def generate_text(self, system_prompt:str, user_prompt: str, model_name: str, max_tokens: int = -1) -> str:
+        return self.complete(system_prompt, user_prompt, model_name, max_tokens)
 
     def generate_json(self, system_prompt: str, user_prompt: str, json_schema: BaseModel, model_name: str, max_tokens: int = -1) -> BaseModel:
-        headers = {"content-type":"application/json"}
-        body = LMStudioRequest(model= model_name,
-                        stream=False,
-                        messages=[Message(role="system", content=system_prompt),Message(role="user", content=user_prompt)],
-                        temperature=0.7,
-                        max_tokens=max_tokens)
-        response = requests.post(self.api_url, headers=headers, data=body.json())
-        json_response = response.json()
-        lm_studio_response = LMStudioResponse(**json_response)
-        content = lm_studio_response.content_json()
-        parsed_json_schema_obj = json_schema.model_validate(content)
-        return parsed_json_schema_obj
+        if self.stream:
+            try:
+                return self.stream_json(system_prompt, user_prompt, json_schema, model_name, max_tokens)[0]
+            except UnsupportedResponseFormat as e:
+                self.disable_structured(e)
+                return self.stream_json(system_prompt, user_prompt, json_schema, model_name, max_tokens)[0]
+        # Truncated answers are continued by complete, only an answer that still does not parse is asked for again
+        parsed = self.parse_content(self.complete(system_prompt, user_prompt, model_name, max_tokens, json_schema), json_schema, retry=True)
+        if parsed is None:
+            parsed = self.parse_content(self.complete(system_prompt, user_prompt, model_name, max_tokens, json_schema), json_schema, retry=False)
+        return parsed
 
+    async def agenerate_text(self, system_prompt: str, user_prompt: str, model_name: str, max_tokens: int = -1) -> str:
+        return await self.acomplete(system_prompt, user_prompt, model_name, max_tokens)
 
+    async def agenerate_json(self, system_prompt: str, user_prompt: str, json_schema: BaseModel, model_name: str, max_tokens: int = -1) -> BaseModel:
+        if self.stream:
+            try:
+                return (await self.astream_json(system_prompt, user_prompt, json_schema, model_name, max_tokens))[0]
+            except UnsupportedResponseFormat as e:
+                self.disable_structured(e)
+                return (await self.astream_json(system_prompt, user_prompt, json_schema, model_name, max_tokens))[0]
+        parsed = self.parse_content(await self.acomplete(system_prompt, user_prompt, model_name, max_tokens, json_schema), json_schema, retry=True)
+        if parsed is None:
+            parsed = self.parse_content(await self.acomplete(system_prompt, user_prompt, model_name, max_tokens, json_schema), json_schema, retry=False)
+        return parsed
@@ -1,36 +1,154 @@
-from openai import OpenAI
+from typing import Optional
+from openai import OpenAI, AsyncOpenAI, LengthFinishReasonError
 from pydantic import BaseModel
 from .interface import LLMInterface
+from .usage import track_call, cached_prompt_tokens
+from .gateway_client import stage_headers
+from .continuation import continuation_messages, max_continuations, stitch, strip_fence
 
 class OpenAIHandler(LLMInterface):
-    def __init__(self, api_key: str):
+    provider = "openai"
+
+    def __init__(self, api_key: str, base_url: str = None, send_stage: bool = False):
         self.api_key = api_key
-        self.client = OpenAI(api_key=self.api_key)
-    
-    def generate_text(self, system_prompt: str, user_prompt: str, model_name:str = "gpt-4o-mini", max_tokens: int = -1) -> str:
-        response = self.client.Completion.create(
-            model= model_name,
-            messages=[
-                {"role": "system", "content": system_prompt},
-                { "role": "user","content": user_prompt}
-            ]
-        )
-        return response.choices[0].message
-    
-    def generate_json(self, system_prompt: str, user_prompt: str, json_schema: BaseModel, model_name:str = "gpt-4o-mini", max_tokens: int = -1) -> BaseModel:
-        response = self.client.beta.chat.completions.parse(
-            model= model_name,
-            messages=[
-                {"role": "system", "content": system_prompt},
-                { "role": "user","content": user_prompt}
-            ],
-            response_format = json_schema
-        )
+        self.client = OpenAI(api_key=self.api_key, base_url=base_url)
+        # The async client keeps its own keep-alive pool, so many concurrent calls share connections
+        self.async_client = AsyncOpenAI(api_key=self.api_key, base_url=base_url)
+        # The LLM gateway schedules and accounts calls by the stage sent along with them
+        self.send_stage = send_stage
+
+    def build_messages(self, system_prompt: str, user_prompt: str) -> list:
+        return [
+            {"role": "system", "content": system_prompt},
+            { "role": "user","content": user_prompt}
+        ]
 
+    def build_options(self, max_tokens: int) -> dict:
+        options = {"max_tokens": max_tokens} if max_tokens > 0 else {}
+        if self.send_stage:
+            options["extra_headers"] = stage_headers()
+        return options
+
+    def record_usage(self, call: track_call, response):
+        if response.usage is not None:
+            call.set_usage(response.usage.prompt_tokens, response.usage.completion_tokens, cached_prompt_tokens(response.usage))
+
+    def parse_message(self, response) -> BaseModel:
         response = response.choices[0].message
         if (response.refusal):
             print(response.refusal)
             return None
         else:
             parsed = response.parsed
+        return parsed
+
+    def continue_text(self, system_prompt: str, user_prompt: str, content: str, finish_reason: Optional[str], model_name: str, max_tokens: int) -> str:
+        """Keep asking for the rest of a completion cut off at max_tokens and stitch the parts together."""
+        continuations = 0
+        while finish_reason == "length" and continuations < max_continuations():
+            continuations += 1
+            print(f"OpenAI [{model_name}]: completion hit max_tokens, requesting continuation {continuations}")
+            with track_call(self.provider, model_name) as call:
+                response = self.client.chat.completions.create(
+                    model= model_name,
+                    messages=continuation_messages(system_prompt, user_prompt, content),
+                    **self.build_options(max_tokens),
+                )
+                self.record_usage(call, response)
+            content = stitch(content, response.choices[0].message.content or "")
+            finish_reason = response.choices[0].finish_reason
+        return content
+
+    async def acontinue_text(self, system_prompt: str, user_prompt: str, content: str, finish_reason: Optional[str], model_name: str, max_tokens: int) -> str:
+        continuations = 0
+        while finish_reason == "length" and continuations < max_continuations():
+            continuations += 1
+            print(f"OpenAI [{model_name}]: completion hit max_tokens, requesting continuation {continuations}")
+            with track_call(self.provider, model_name) as call:
+                response = await self.async_client.chat.completions.create(
+                    model= model_name,
+                    messages=continuation_messages(system_prompt, user_prompt, content),
+                    **self.build_options(max_tokens),
+                )
+                self.record_usage(call, response)
+            content = stitch(content, response.choices[0].message.content or "")
+            finish_reason = response.choices[0].finish_reason
+        return content
+
+    def parse_continued(self, content: str, json_schema: BaseModel) -> Optional[BaseModel]:
+        try:
+            return json_schema.model_validate_json(strip_fence(content))
+        except ValueError as e:
+            print(f"Stitched completion is not valid {json_schema.__name__} JSON, retrying the call: {e}")
+            return None
+
+    def generate_text(self, system_prompt: str, user_prompt: str, model_name:str = "gpt-4o-mini", max_tokens: int = -1) -> str:
+        with track_call(self.provider, model_name) as call:
+            response = self.client.chat.completions.create(
+                model= model_name,
+                messages=self.build_messages(system_prompt, user_prompt),
+                **self.build_options(max_tokens),
+            )
+            self.record_usage(call, response)
+        choice = response.choices[0]
+        return self.continue_text(system_prompt, user_prompt, choice.message.content, choice.finish_reason, model_name, max_tokens)
+    
+    def generate_json(self, system_prompt: str, user_prompt: str, json_schema: BaseModel, model_name:str = "gpt-4o-mini", max_tokens: int = -1, retry: bool = True) -> BaseModel:
+        with track_call(self.provider, model_name) as call:
+            try:
+                response = self.client.beta.chat.completions.parse(
+                    model= model_name,
+                    messages=self.build_messages(system_prompt, user_prompt),
+                    response_format = json_schema,
+                    **self.build_options(max_tokens),
+                )
+            except LengthFinishReasonError as e:
+                response = None
+                truncated = e.completion
+            self.record_usage(call, response or truncated)
+        if response is not None:
+            return self.parse_message(response)
+
+        # Continue the truncated answer instead of paying for the prompt and the output prefix again
+        content = self.continue_text(system_prompt, user_prompt, truncated.choices[0].message.content or "", "length", model_name, max_tokens)
+        parsed = self.parse_continued(content, json_schema)
+        if parsed is None and retry:
+            return self.generate_json(system_prompt, user_prompt, json_schema, model_name, max_tokens, retry=False)
+        if parsed is None:
+            raise ValueError(f"Completion for {json_schema.__name__} was truncated and could not be continued into valid JSON")
+        return parsed
+
+    async def agenerate_text(self, system_prompt: str, user_prompt: str, model_name:str = "gpt-4o-mini", max_tokens: int = -1) -> str:
+        with track_call(self.provider, model_name) as call:
+            response = await self.async_client.chat.completions.create(
+                model= model_name,
+                messages=self.build_messages(system_prompt, user_prompt),
+                **self.build_options(max_tokens),
+            )
+            self.record_usage(call, response)
+        choice = response.choices[0]
+        return await self.acontinue_text(system_prompt, user_prompt, choice.message.content, choice.finish_reason, model_name, max_tokens)
+
+    async def agenerate_json(self, system_prompt: str, user_prompt: str, json_schema: BaseModel, model_name:str = "gpt-4o-mini", max_tokens: int = -1, retry: bool = True) -> BaseModel:
+        with track_call(self.provider, model_name) as call:
+            try:
+                response = await self.async_client.beta.chat.completions.parse(
+                    model= model_name,
+                    messages=self.build_messages(system_prompt, user_prompt),
+                    response_format = json_schema,
+                    **self.build_options(max_tokens),
+                )
+            except LengthFinishReasonError as e:
+                response = None
+                truncated = e.completion
+            self.record_usage(call, response or truncated)
+        if response is not None:
+            return self.parse_message(response)
+
+        content = await self.acontinue_text(system_prompt, user_prompt, truncated.choices[0].message.content or "", "length", model_name, max_tokens)
+        parsed = self.parse_continued(content, json_schema)
+        if parsed is None and retry:
+            return await self.agenerate_json(system_prompt, user_prompt, json_schema, model_name, max_tokens, retry=False)
+        if parsed is None:
+            raise ValueError(f"Completion for {json_schema.__name__} was truncated and could not be continued into valid JSON")
         return parsed
\ No newline at end of file
@@ -0,0 +1,15 @@
+from typing import Optional
+
+
+def layered_prompt(instructions: str, snapshot: Optional[str] = None, variable: Optional[str] = None) -> str:
+    """
+    Join prompt parts from the most to the least stable: the static instructions, then the source snapshot a run
+    sends with every call, then the part that changes per call.
+
+    Provider and local-server prefix caches only reuse an identical leading run of tokens, so calls over the same
+    snapshot share everything up to the variable part. Source selected per call is variable, not a snapshot, and
+    anything stable such as an example output belongs in the instructions: crewai sends the expected output after
+    the description, behind the variable part.
+    """
+    return "\n".join(part for part in (instructions, snapshot, variable) if part)
+
@@ -0,0 +1,220 @@
+import os
+import json
+import time
+import asyncio
+import threading
+from typing import Optional, Dict, List, Tuple
+from pydantic import BaseModel
+
+from .interface import LLMInterface
+from .cache import request_key
+from .coalesce import crew_request_key
+from .usage import track_call, crew_model
+
+
+class CassetteEntry(BaseModel):
+    key: str
+    provider: str
+    model: str
+    kind: str
+    response: Optional[str]
+    latency: float
+
+
+class CassetteMissError(LookupError):
+    """Raised on replay when the cassette has no recording for a request."""
+
+
+def cassette_key(model_name: str, system_prompt: str, user_prompt: str, json_schema: Optional[BaseModel] = None, max_tokens: int = -1) -> str:
+    # The provider is left out so a cassette recorded against one backend replays for any configuration
+    return request_key("", model_name, system_prompt, user_prompt, json_schema, max_tokens)
+
+
+class RecordingHandler(LLMInterface):
+    """Passes every call to the wrapped handler and appends the request/response pair to a JSONL cassette."""
+
+    def __init__(self, handler: LLMInterface, cassette_path: str, provider: str):
+        self.handler = handler
+        self.cassette_path = cassette_path
+        self.provider = provider
+        self.lock = threading.Lock()
+        directory = os.path.dirname(cassette_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def write(self, key: str, model_name: str, kind: str, response: Optional[str], latency: float):
+        entry = CassetteEntry(key=key, provider=self.provider, model=model_name, kind=kind, response=response, latency=latency)
+        with self.lock:
+            with open(self.cassette_path, "a") as file:
+                file.write(entry.model_dump_json() + "\n")
+
+    def generate_text(self, system_prompt: str, user_prompt: str, model_name: str, max_tokens: int = -1) -> str:
+        started_at = time.monotonic()
+        response = self.handler.generate_text(system_prompt, user_prompt, model_name, max_tokens)
+        key = cassette_key(model_name, system_prompt, user_prompt, max_tokens=max_tokens)
+        self.write(key, model_name, "text", response if isinstance(response, str) else None, time.monotonic() - started_at)
+        return response
+
+    def generate_json(self, system_prompt: str, user_prompt: str, json_schema: BaseModel, model_name: str, max_tokens: int = -1) -> BaseModel:
+        started_at = time.monotonic()
+        response = self.handler.generate_json(system_prompt, user_prompt, json_schema, model_name, max_tokens)
+        key = cassette_key(model_name, system_prompt, user_prompt, json_schema, max_tokens)
+        self.write(key, model_name, "json", response.model_dump_json() if response is not None else None, time.monotonic() - started_at)
+        return response
+
+    async def agenerate_text(self, system_prompt: str, user_prompt: str, model_name: str, max_tokens: int = -1) -> str:
+        started_at = time.monotonic()
+        response = await self.handler.agenerate_text(system_prompt, user_prompt, model_name, max_tokens)
+        key = cassette_key(model_name, system_prompt, user_prompt, max_tokens=max_tokens)
+        self.write(key, model_name, "text", response if isinstance(response, str) else None, time.monotonic() - started_at)
+        return response
+
+    async def agenerate_json(self, system_prompt: str, user_prompt: str, json_schema: BaseModel, model_name: str, max_tokens: int = -1) -> BaseModel:
+        started_at = time.monotonic()
+        response = await self.handler.agenerate_json(system_prompt, user_prompt, json_schema, model_name, max_tokens)
+        key = cassette_key(model_name, system_prompt, user_prompt, json_schema, max_tokens)
+        self.write(key, model_name, "json", response.model_dump_json() if response is not None else None, time.monotonic() - started_at)
+        return response
+
+
+class ReplayHandler(LLMInterface):
+    """
+    Serves responses from a cassette written by RecordingHandler, without any network access.
+
+    Requests recorded more than once are answered with their recordings in order, the last one repeating.
+    latency_scale sleeps for the recorded latency multiplied by the factor (0 disables the simulation).
+    """
+
+    provider = "replay"
+
+    def __init__(self, cassette_path: str, latency_scale: float = 0.0):
+        self.cassette_path = cassette_path
+        self.latency_scale = latency_scale
+        self.entries: Dict[str, List[CassetteEntry]] = {}
+        self.positions: Dict[str, int] = {}
+        self.lock = threading.Lock()
+        with open(cassette_path, "r") as file:
+            for line in file:
+                line = line.strip()
+                if line:
+                    entry = CassetteEntry.model_validate_json(line)
+                    self.entries.setdefault(entry.key, []).append(entry)
+
+    def lookup(self, key: str) -> CassetteEntry:
+        with self.lock:
+            recordings = self.entries.get(key)
+            if not recordings:
+                raise CassetteMissError(f"No recording for request {key} in {self.cassette_path}")
+            position = self.positions.get(key, 0)
+            self.positions[key] = position + 1
+            return recordings[min(position, len(recordings) - 1)]
+
+    def parse(self, entry: CassetteEntry, json_schema: BaseModel) -> Optional[BaseModel]:
+        if entry.response is None:
+            return None
+        return json_schema.model_validate_json(entry.response)
+
+    def generate_text(self, system_prompt: str, user_prompt: str, model_name: str, max_tokens: int = -1) -> str:
+        with track_call(self.provider, model_name):
+            entry = self.lookup(cassette_key(model_name, system_prompt, user_prompt, max_tokens=max_tokens))
+            if self.latency_scale:
+                time.sleep(entry.latency * self.latency_scale)
+        return entry.response
+
+    def generate_json(self, system_prompt: str, user_prompt: str, json_schema: BaseModel, model_name: str, max_tokens: int = -1) -> BaseModel:
+        with track_call(self.provider, model_name):
+            entry = self.lookup(cassette_key(model_name, system_prompt, user_prompt, json_schema, max_tokens))
+            if self.latency_scale:
+                time.sleep(entry.latency * self.latency_scale)
+        return self.parse(entry, json_schema)
+
+    async def agenerate_text(self, system_prompt: str, user_prompt: str, model_name: str, max_tokens: int = -1) -> str:
+        with track_call(self.provider, model_name):
+            entry = self.lookup(cassette_key(model_name, system_prompt, user_prompt, max_tokens=max_tokens))
+            if self.latency_scale:
+                await asyncio.sleep(entry.latency * self.latency_scale)
+        return entry.response
+
+    async def agenerate_json(self, system_prompt: str, user_prompt: str, json_schema: BaseModel, model_name: str, max_tokens: int = -1) -> BaseModel:
+        with track_call(self.provider, model_name):
+            entry = self.lookup(cassette_key(model_name, system_prompt, user_prompt, json_schema, max_tokens))
+            if self.latency_scale:
+                await asyncio.sleep(entry.latency * self.latency_scale)
+        return self.parse(entry, json_schema)
+
+
+class ReplayedCrewOutput:
+    """The parts of a crewai CrewOutput the crews read, served from a cassette."""
+
+    token_usage = None
+
+    def __init__(self, raw: str, json_dict: Optional[dict]):
+        self.raw = raw
+        self.json_dict = json_dict
+
+    @property
+    def json(self) -> Optional[str]:
+        return json.dumps(self.json_dict) if self.json_dict is not None else None
+
+    def __str__(self) -> str:
+        return str(self.json_dict) if self.json_dict else self.raw
+
+
+class CrewCassette:
+    """
+    Record/replay of crewai Crew kickoffs, which never go through the handlers. Kickoffs are keyed by
+    crew_request_key and written to the same JSONL cassette as handler calls, with kind "crew".
+    When replaying, the recorded output is returned without running the crew.
+    """
+
+    def __init__(self, cassette_path: str, replay: bool = False, latency_scale: float = 0.0):
+        self.cassette_path = cassette_path
+        self.player = ReplayHandler(cassette_path, latency_scale) if replay else None
+        self.lock = threading.Lock()
+        directory = os.path.dirname(cassette_path)
+        if directory and not replay:
+            os.makedirs(directory, exist_ok=True)
+
+    @property
+    def replaying(self) -> bool:
+        return self.player is not None
+
+    def record(self, crew, inputs: dict, output, latency: float):
+        response = json.dumps({"raw": getattr(output, "raw", "") or "", "json_dict": getattr(output, "json_dict", None)})
+        entry = CassetteEntry(key=crew_request_key(crew, inputs), provider="crewai", model=crew_model(crew), kind="crew", response=response, latency=latency)
+        with self.lock:
+            with open(self.cassette_path, "a") as file:
+                file.write(entry.model_dump_json() + "\n")
+
+    def replay(self, crew, inputs: dict) -> ReplayedCrewOutput:
+        with track_call(self.player.provider, crew_model(crew)):
+            entry = self.player.lookup(crew_request_key(crew, inputs))
+            if self.player.latency_scale:
+                time.sleep(entry.latency * self.player.latency_scale)
+        recorded = json.loads(entry.response)
+        return ReplayedCrewOutput(recorded["raw"], recorded["json_dict"])
+
+
+_crew_cassette: Optional[CrewCassette] = None
+_crew_cassette_config: Optional[Tuple] = None
+_crew_cassette_lock = threading.Lock()
+
+
+def default_crew_cassette() -> Optional[CrewCassette]:
+    """
+    Crew cassette configured from the environment: LLM_REPLAY_CREWS=true replays LLM_REPLAY_CASSETTE, otherwise
+    LLM_RECORD_CASSETTE records every kickoff. None when neither is set. Rebuilt when the variables change.
+    """
+    global _crew_cassette, _crew_cassette_config
+    if os.getenv("LLM_REPLAY_CREWS", "false").lower() == "true":
+        config = (True, os.environ["LLM_REPLAY_CASSETTE"], float(os.getenv("LLM_REPLAY_LATENCY_SCALE", 0)))
+    elif os.getenv("LLM_RECORD_CASSETTE"):
+        config = (False, os.environ["LLM_RECORD_CASSETTE"], 0.0)
+    else:
+        return None
+    with _crew_cassette_lock:
+        if config != _crew_cassette_config:
+            replay, path, latency_scale = config
+            _crew_cassette = CrewCassette(path, replay=replay, latency_scale=latency_scale)
+            _crew_cassette_config = config
+        return _crew_cassette
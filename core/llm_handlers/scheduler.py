@@ -0,0 +1,212 @@
+import os
+import time
+import heapq
+import asyncio
+import itertools
+import threading
+from typing import Callable, Optional, Dict, List, Tuple
+from pydantic import BaseModel
+
+from .interface import LLMInterface
+from .context import Stage, current_stage, current_priority
+from .tokens import estimate_tokens
+
+# Completion budget assumed for a call made with max_tokens=-1
+DEFAULT_COMPLETION_TOKENS = 1024
+# Longest a coroutine sleeps before looking at the queue again, it cannot be woken like a waiting thread
+ASYNC_POLL_SECONDS = 0.05
+
+
+class TokenBucket:
+    def __init__(self, per_minute: Optional[int], clock: Callable[[], float] = time.monotonic):
+        self.capacity = per_minute
+        self.available = float(per_minute) if per_minute else 0.0
+        self.updated_at = clock()
+
+    def refill(self, now: float):
+        if self.capacity is None:
+            return
+        elapsed = now - self.updated_at
+        self.available = min(float(self.capacity), self.available + elapsed * self.capacity / 60.0)
+        self.updated_at = now
+
+    def wait_time(self, amount: int) -> float:
+        if self.capacity is None:
+            return 0.0
+        # A single request larger than the whole budget only has to wait for a full bucket
+        amount = min(amount, self.capacity)
+        if self.available >= amount:
+            return 0.0
+        return (amount - self.available) * 60.0 / self.capacity
+
+    def consume(self, amount: int):
+        if self.capacity is not None:
+            self.available -= amount
+
+
+class Ticket:
+    def __init__(self, priority: int, stage: Optional[Stage], tokens: int, enqueued_at: float):
+        self.priority = priority
+        self.stage = stage
+        self.tokens = tokens
+        self.enqueued_at = enqueued_at
+
+
+class LLMScheduler:
+    """
+    Admits LLM calls within requests-per-minute and tokens-per-minute budgets, most urgent stage first.
+    clock is the monotonic time source the buckets refill by, replaceable in tests.
+    """
+
+    def __init__(self, requests_per_minute: Optional[int] = None, tokens_per_minute: Optional[int] = None, max_wait_samples: int = 1000, clock: Callable[[], float] = time.monotonic):
+        self.clock = clock
+        self.request_bucket = TokenBucket(requests_per_minute, clock)
+        self.token_bucket = TokenBucket(tokens_per_minute, clock)
+        self.condition = threading.Condition()
+        self.queue: List[tuple] = []
+        self.sequence = itertools.count()
+        self.max_wait_samples = max_wait_samples
+        self.wait_samples: Dict[str, List[float]] = {}
+        self.admitted: Dict[str, int] = {}
+
+    def enqueue(self, estimated_tokens: int, stage: Optional[Stage], priority: Optional[int]) -> tuple:
+        ticket = Ticket(current_priority() if priority is None else priority, stage or current_stage(), estimated_tokens, self.clock())
+        entry = (ticket.priority, next(self.sequence), ticket)
+        heapq.heappush(self.queue, entry)
+        return entry
+
+    def admit(self, entry: tuple) -> Tuple[bool, Optional[float]]:
+        """
+        Admit entry when it is first in line and the buckets allow it. Returns whether it was admitted with the time
+        it waited, or the time until the buckets allow it (None while other tickets are ahead). Hold self.condition.
+        """
+        ticket = entry[2]
+        now = self.clock()
+        self.request_bucket.refill(now)
+        self.token_bucket.refill(now)
+        if self.queue[0] is not entry:
+            return False, None
+        delay = max(self.request_bucket.wait_time(1), self.token_bucket.wait_time(ticket.tokens))
+        if delay > 0:
+            return False, delay
+        heapq.heappop(self.queue)
+        self.request_bucket.consume(1)
+        self.token_bucket.consume(ticket.tokens)
+        waited = now - ticket.enqueued_at
+        self.record_wait(ticket.stage, waited)
+        # Let the next ticket in line re-evaluate the buckets
+        self.condition.notify_all()
+        return True, waited
+
+    def acquire(self, estimated_tokens: int, stage: Optional[Stage] = None, priority: Optional[int] = None) -> float:
+        """Block until the call may proceed. Returns the time spent waiting in seconds."""
+        with self.condition:
+            entry = self.enqueue(estimated_tokens, stage, priority)
+            while True:
+                admitted, seconds = self.admit(entry)
+                if admitted:
+                    return seconds
+                self.condition.wait(timeout=seconds)
+
+    async def aacquire(self, estimated_tokens: int, stage: Optional[Stage] = None, priority: Optional[int] = None) -> float:
+        """acquire for coroutines: waits on the event loop, so queued calls do not each hold a thread."""
+        with self.condition:
+            entry = self.enqueue(estimated_tokens, stage, priority)
+        try:
+            while True:
+                with self.condition:
+                    admitted, seconds = self.admit(entry)
+                if admitted:
+                    return seconds
+                await asyncio.sleep(ASYNC_POLL_SECONDS if seconds is None else min(seconds, ASYNC_POLL_SECONDS))
+        except asyncio.CancelledError:
+            with self.condition:
+                if entry in self.queue:
+                    self.queue.remove(entry)
+                    heapq.heapify(self.queue)
+                    self.condition.notify_all()
+            raise
+
+    def record_wait(self, stage: Optional[Stage], waited: float):
+        name = stage.value if stage else "unknown"
+        samples = self.wait_samples.setdefault(name, [])
+        samples.append(waited)
+        if len(samples) > self.max_wait_samples:
+            del samples[0]
+        self.admitted[name] = self.admitted.get(name, 0) + 1
+
+    def metrics(self) -> dict:
+        with self.condition:
+            queue_depth: Dict[str, int] = {}
+            for _, _, ticket in self.queue:
+                name = ticket.stage.value if ticket.stage else "unknown"
+                queue_depth[name] = queue_depth.get(name, 0) + 1
+
+            wait_times = {}
+            for name, samples in self.wait_samples.items():
+                ordered = sorted(samples)
+                wait_times[name] = {
+                    "admitted": self.admitted[name],
+                    "avg_seconds": sum(ordered) / len(ordered),
+                    "p95_seconds": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+                    "max_seconds": ordered[-1],
+                }
+            return {
+                "queue_depth": len(self.queue),
+                "queue_depth_by_stage": queue_depth,
+                "wait_time_by_stage": wait_times,
+                "available_requests": self.request_bucket.available if self.request_bucket.capacity else None,
+                "available_tokens": self.token_bucket.available if self.token_bucket.capacity else None,
+            }
+
+
+_default_scheduler: Optional[LLMScheduler] = None
+_default_scheduler_lock = threading.Lock()
+
+
+def default_scheduler() -> LLMScheduler:
+    """Process-wide scheduler configured through LLM_RPM_LIMIT and LLM_TPM_LIMIT. Unset limits are unbounded."""
+    global _default_scheduler
+    with _default_scheduler_lock:
+        if _default_scheduler is None:
+            rpm = os.getenv("LLM_RPM_LIMIT")
+            tpm = os.getenv("LLM_TPM_LIMIT")
+            _default_scheduler = LLMScheduler(
+                requests_per_minute=int(rpm) if rpm else None,
+                tokens_per_minute=int(tpm) if tpm else None,
+            )
+        return _default_scheduler
+
+
+class ScheduledLLMHandler(LLMInterface):
+    """Routes every call of the wrapped handler through an LLMScheduler."""
+
+    def __init__(self, handler: LLMInterface, scheduler: LLMScheduler):
+        self.handler = handler
+        self.scheduler = scheduler
+
+    def estimate(self, system_prompt: str, user_prompt: str, max_tokens: int) -> int:
+        completion_tokens = max_tokens if max_tokens > 0 else DEFAULT_COMPLETION_TOKENS
+        return estimate_tokens(system_prompt) + estimate_tokens(user_prompt) + completion_tokens
+
+    def generate_text(self, system_prompt: str, user_prompt: str, model_name: str, max_tokens: int = -1) -> str:
+        self.scheduler.acquire(self.estimate(system_prompt, user_prompt, max_tokens))
+        return self.handler.generate_text(system_prompt, user_prompt, model_name, max_tokens)
+
+    def generate_json(self, system_prompt: str, user_prompt: str, json_schema: BaseModel, model_name: str, max_tokens: int = -1) -> BaseModel:
+        self.scheduler.acquire(self.estimate(system_prompt, user_prompt, max_tokens))
+        return self.handler.generate_json(system_prompt, user_prompt, json_schema, model_name, max_tokens)
+
+    async def agenerate_text(self, system_prompt: str, user_prompt: str, model_name: str, max_tokens: int = -1) -> str:
+        await self.aacquire(self.estimate(system_prompt, user_prompt, max_tokens))
+        return await self.handler.agenerate_text(system_prompt, user_prompt, model_name, max_tokens)
+
+    async def agenerate_json(self, system_prompt: str, user_prompt: str, json_schema: BaseModel, model_name: str, max_tokens: int = -1) -> BaseModel:
+        await self.aacquire(self.estimate(system_prompt, user_prompt, max_tokens))
+        return await self.handler.agenerate_json(system_prompt, user_prompt, json_schema, model_name, max_tokens)
+
+    async def aacquire(self, estimated_tokens: int):
+        await self.scheduler.aacquire(estimated_tokens)
+
+    def metrics(self) -> dict:
+        return self.scheduler.metrics()
@@ -0,0 +1,382 @@
+import re
+import json
+import time
+from typing import Optional, Type, Iterable, Iterator, AsyncIterable, AsyncIterator, List
+from pydantic import BaseModel
+
+NUMBER_PATTERN = re.compile(r"-?(0|[1-9][0-9]*)(\.[0-9]+)?([eE][+-]?[0-9]+)?")
+LITERALS = ("true", "false", "null")
+FENCE = "```json"
+DONE = object()
+
+
+class StreamDivergenceError(Exception):
+    """Raised as soon as a streamed completion can no longer become valid JSON for the target schema."""
+
+    def __init__(self, message: str, position: int, text: str):
+        super().__init__(f"{message} at character {position}")
+        self.position = position
+        self.text = text
+
+
+class StreamMetrics(BaseModel):
+    time_to_first_token: Optional[float] = None
+    total_time: float = 0.0
+    chunks: int = 0
+    characters: int = 0
+    finish_reason: Optional[str] = None
+    aborted: bool = False
+    prompt_tokens: Optional[int] = None
+    completion_tokens: Optional[int] = None
+    cached_tokens: Optional[int] = None
+
+
+class Frame:
+    def __init__(self, kind: str, schema: dict):
+        self.kind = kind
+        self.schema = schema
+        self.state = "key_or_end" if kind == "object" else "value_or_end"
+        self.keys: set = set()
+        self.key: Optional[str] = None
+
+
+class IncrementalJSONValidator:
+    """
+    Character-level JSON parser that checks a completion against a Pydantic model's JSON Schema while it streams.
+
+    It rejects text that can no longer parse as JSON, values whose JSON type does not match the schema,
+    objects closed without their required properties and (with strict=True) properties the schema does not know.
+    A leading ```json fence and trailing backticks are tolerated since local models like to add them.
+    """
+
+    def __init__(self, json_schema: Type[BaseModel], strict: bool = False):
+        self.root_schema = json_schema.model_json_schema()
+        self.defs = self.root_schema.get("$defs", {})
+        self.strict = strict
+        self.stack: List[Frame] = []
+        self.state = "start"
+        self.prefix = ""
+        self.chunks: List[str] = []
+        self.position = 0
+        self.start_index: Optional[int] = None
+        self.end_index: Optional[int] = None
+        self.in_string = False
+        self.string_is_key = False
+        self.escape = False
+        self.unicode_digits = -1
+        self.string_buffer: List[str] = []
+        self.literal = ""
+
+    @property
+    def text(self) -> str:
+        return "".join(self.chunks)
+
+    @property
+    def complete(self) -> bool:
+        return self.end_index is not None
+
+    def json_text(self) -> str:
+        """The JSON document without any surrounding markdown fence."""
+        text = self.text
+        return text[self.start_index:self.end_index] if self.start_index is not None else text
+
+    def fail(self, message: str):
+        raise StreamDivergenceError(message, self.position, self.text)
+
+    def feed(self, chunk: str):
+        self.chunks.append(chunk)
+        for char in chunk:
+            self.feed_char(char)
+            self.position += 1
+
+    # Schema helpers
+    def resolve(self, schema: dict) -> dict:
+        while "$ref" in schema:
+            schema = self.defs.get(schema["$ref"].split("/")[-1], {})
+        return schema
+
+    def branches(self, schema: dict) -> List[dict]:
+        schema = self.resolve(schema)
+        for keyword in ("anyOf", "oneOf"):
+            if keyword in schema:
+                return [branch for option in schema[keyword] for branch in self.branches(option)]
+        if "allOf" in schema and len(schema["allOf"]) == 1:
+            return self.branches(schema["allOf"][0])
+        return [schema]
+
+    def allows(self, schema: dict, kind: str) -> bool:
+        if "enum" in schema or "const" in schema:
+            values = schema.get("enum", [schema.get("const")])
+            return any(self.kind_of(value) == kind or (kind == "number" and self.kind_of(value) == "integer") for value in values)
+        types = schema.get("type")
+        if types is None:
+            return kind == "object" if "properties" in schema else True
+        types = set(types if isinstance(types, list) else [types])
+        if "integer" in types:
+            types.add("number")
+        return kind in types
+
+    def kind_of(self, value) -> str:
+        if value is None:
+            return "null"
+        if isinstance(value, bool):
+            return "boolean"
+        if isinstance(value, (int, float)):
+            return "number"
+        if isinstance(value, str):
+            return "string"
+        return "array" if isinstance(value, list) else "object"
+
+    def select(self, schema: dict, kind: str) -> dict:
+        for branch in self.branches(schema):
+            if self.allows(branch, kind):
+                return branch
+        expected = [branch.get("type", "any") for branch in self.branches(schema)]
+        self.fail(f"Expected {expected} but the model started a {kind}")
+
+    def value_schema(self) -> dict:
+        if not self.stack:
+            return self.root_schema
+        frame = self.stack[-1]
+        if frame.kind == "array":
+            items = frame.schema.get("items", {})
+            return items if isinstance(items, dict) else {}
+        properties = frame.schema.get("properties", {})
+        if frame.key in properties:
+            return properties[frame.key]
+        additional = frame.schema.get("additionalProperties", {})
+        return additional if isinstance(additional, dict) else {}
+
+    # Parser
+    def feed_char(self, char: str):
+        if self.in_string:
+            self.feed_string(char)
+            return
+        if self.literal:
+            if char in ",}] \t\r\n":
+                self.end_literal()
+            else:
+                self.literal += char
+                self.check_literal_prefix()
+                return
+
+        if self.state == "start":
+            self.feed_prefix(char)
+        elif self.state == "done":
+            if not (char.isspace() or char == "`"):
+                self.fail("Unexpected text after the JSON document")
+        elif char.isspace():
+            return
+        elif not self.stack or self.stack[-1].state in ("value", "value_or_end"):
+            if char == "]" and self.stack and self.stack[-1].state == "value_or_end":
+                self.close("array")
+            else:
+                self.start_value(char)
+        else:
+            self.feed_structure(char)
+
+    def feed_prefix(self, char: str):
+        if char in "{[\"":
+            self.state = "value"
+            self.start_index = self.position
+            self.start_value(char)
+            return
+        self.prefix += char
+        stripped = self.prefix.strip().lower()
+        if not (FENCE.startswith(stripped) or (stripped.startswith(FENCE) and not stripped[len(FENCE):].strip())):
+            self.fail("Completion does not start with a JSON document")
+
+    def feed_structure(self, char: str):
+        frame = self.stack[-1]
+        if frame.kind == "object":
+            if frame.state in ("key_or_end", "key"):
+                if char == "}" and frame.state == "key_or_end":
+                    self.close("object")
+                elif char == '"':
+                    self.begin_string(is_key=True)
+                else:
+                    self.fail("Expected an object key")
+            elif frame.state == "colon":
+                if char != ":":
+                    self.fail("Expected ':' after an object key")
+                frame.state = "value"
+            elif frame.state == "comma_or_end":
+                if char == ",":
+                    frame.state = "key"
+                elif char == "}":
+                    self.close("object")
+                else:
+                    self.fail("Expected ',' or '}'")
+        else:
+            if char == ",":
+                frame.state = "value"
+            elif char == "]":
+                self.close("array")
+            else:
+                self.fail("Expected ',' or ']'")
+
+    def start_value(self, char: str):
+        if char == "{":
+            kind = "object"
+        elif char == "[":
+            kind = "array"
+        elif char == '"':
+            kind = "string"
+        elif char in "-0123456789":
+            kind = "number"
+        elif char in "tf":
+            kind = "boolean"
+        elif char == "n":
+            kind = "null"
+        else:
+            self.fail(f"Unexpected character {char!r} where a value was expected")
+        schema = self.select(self.value_schema(), kind)
+
+        if kind in ("object", "array"):
+            self.stack.append(Frame(kind, schema))
+        elif kind == "string":
+            self.begin_string(is_key=False)
+        else:
+            self.literal = char
+            self.check_literal_prefix()
+
+    def begin_string(self, is_key: bool):
+        self.in_string = True
+        self.string_is_key = is_key
+        self.string_buffer = []
+
+    def feed_string(self, char: str):
+        if self.unicode_digits >= 0:
+            if char not in "0123456789abcdefABCDEF":
+                self.fail("Invalid unicode escape")
+            self.unicode_digits += 1
+            if self.unicode_digits == 4:
+                self.unicode_digits = -1
+            return
+        if self.escape:
+            if char == "u":
+                self.unicode_digits = 0
+            elif char not in '"\\/bfnrt':
+                self.fail("Invalid escape sequence")
+            self.string_buffer.append(char)
+            self.escape = False
+            return
+        if char == "\\":
+            self.escape = True
+        elif char == '"':
+            self.in_string = False
+            if self.string_is_key:
+                self.end_key("".join(self.string_buffer))
+            else:
+                self.end_value()
+        elif char in "\n\r":
+            self.fail("Unescaped newline inside a string")
+        elif self.string_is_key:
+            self.string_buffer.append(char)
+
+    def end_key(self, key: str):
+        frame = self.stack[-1]
+        properties = frame.schema.get("properties", {})
+        if key not in properties and (frame.schema.get("additionalProperties") is False or (self.strict and properties)):
+            self.fail(f"Unknown property {key!r}")
+        frame.key = key
+        frame.keys.add(key)
+        frame.state = "colon"
+
+    def check_literal_prefix(self):
+        if self.literal[0] in "tfn":
+            if not any(literal.startswith(self.literal) for literal in LITERALS):
+                self.fail(f"Invalid literal {self.literal!r}")
+        elif not re.fullmatch(r"-?[0-9.eE+-]*", self.literal):
+            self.fail(f"Invalid number {self.literal!r}")
+
+    def end_literal(self):
+        literal, self.literal = self.literal, ""
+        if literal in LITERALS or NUMBER_PATTERN.fullmatch(literal):
+            self.end_value()
+        else:
+            self.fail(f"Invalid value {literal!r}")
+
+    def close(self, kind: str):
+        frame = self.stack.pop()
+        if frame.kind != kind:
+            self.fail(f"Mismatched closing bracket for {frame.kind}")
+        if kind == "object":
+            missing = set(frame.schema.get("required", [])) - frame.keys
+            if missing:
+                self.fail(f"Object closed without required properties {sorted(missing)}")
+        self.end_value()
+
+    def end_value(self):
+        if self.stack:
+            self.stack[-1].state = "comma_or_end"
+        else:
+            self.state = "done"
+            self.end_index = self.position + 1
+
+    def finish(self) -> str:
+        """Validate the end of the stream and return the JSON document text."""
+        if not self.complete:
+            self.fail("Completion ended before the JSON document was complete")
+        return self.json_text()
+
+
+def iter_sse_deltas(lines: Iterable, metrics: StreamMetrics) -> Iterator[str]:
+    """Yield the content deltas of an OpenAI-compatible server-sent event stream."""
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode("utf-8")
+        event = parse_sse_line(line, metrics)
+        if event is None:
+            continue
+        if event is DONE:
+            return
+        yield event
+
+
+async def aiter_sse_deltas(lines: AsyncIterable, metrics: StreamMetrics) -> AsyncIterator[str]:
+    async for line in lines:
+        event = parse_sse_line(line, metrics)
+        if event is None:
+            continue
+        if event is DONE:
+            return
+        yield event
+
+
+def parse_sse_line(line: str, metrics: StreamMetrics):
+    line = line.strip()
+    if not line.startswith("data:"):
+        return None
+    data = line[len("data:"):].strip()
+    if data == "[DONE]":
+        return DONE
+    event = json.loads(data)
+    if event.get("usage"):
+        metrics.prompt_tokens = event["usage"].get("prompt_tokens")
+        metrics.completion_tokens = event["usage"].get("completion_tokens")
+        metrics.cached_tokens = (event["usage"].get("prompt_tokens_details") or {}).get("cached_tokens")
+    if not event.get("choices"):
+        return None
+    choice = event["choices"][0]
+    if choice.get("finish_reason"):
+        metrics.finish_reason = choice["finish_reason"]
+    content = (choice.get("delta") or {}).get("content")
+    if not content:
+        return None
+    metrics.chunks += 1
+    metrics.characters += len(content)
+    return content
+
+
+class StreamTimer:
+    def __init__(self, metrics: StreamMetrics):
+        self.metrics = metrics
+        self.started_at = time.monotonic()
+
+    def token(self):
+        if self.metrics.time_to_first_token is None:
+            self.metrics.time_to_first_token = time.monotonic() - self.started_at
+
+    def stop(self):
+        self.metrics.total_time = time.monotonic() - self.started_at
@@ -0,0 +1,14 @@
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("cl100k_base")
+except Exception:
+    # tiktoken is optional, fall back to the usual ~4 characters per token estimate
+    _encoding = None
+
+
+def estimate_tokens(text: str) -> int:
+    if not text:
+        return 0
+    if _encoding is not None:
+        return len(_encoding.encode(text, disallowed_special=()))
+    return (len(text) + 3) // 4
@@ -0,0 +1,231 @@
+import os
+import time
+import threading
+from collections import deque
+from typing import Optional, List, Dict
+from pydantic import BaseModel
+
+from .context import Stage, llm_stage, current_stage
+from .gateway_client import routed_to_gateway
+
+
+class UsageRecord(BaseModel):
+    timestamp: float
+    provider: str
+    model: str
+    stage: Optional[str] = None
+    prompt_tokens: Optional[int] = None
+    completion_tokens: Optional[int] = None
+    # Prompt tokens the provider served from its prefix cache
+    cached_tokens: Optional[int] = None
+    requests: int = 1
+    wall_time: float
+    time_to_first_token: Optional[float] = None
+    success: bool = True
+
+
+class UsageSummary(BaseModel):
+    stage: Optional[str]
+    model: str
+    calls: int
+    failures: int
+    prompt_tokens: int
+    completion_tokens: int
+    total_tokens: int
+    cached_tokens: int
+    cache_hit_rate: float
+    wall_time: float
+    avg_wall_time: float
+    p95_wall_time: float
+    avg_time_to_first_token: Optional[float]
+
+
+class UsageTracker:
+    """
+    Collects one UsageRecord per LLM call. Records are kept in memory and, when a log path is set,
+    appended to a JSONL file so that processes sharing the file can report a combined view.
+    The log is tailed: each load() only parses the lines appended since the last one, and like the in-memory
+    view it keeps the latest max_records records.
+    """
+
+    def __init__(self, log_path: Optional[str] = None, max_records: int = 10000):
+        self.log_path = log_path
+        self.records = deque(maxlen=max_records)
+        self.lock = threading.Lock()
+        self.log_records = deque(maxlen=max_records)
+        self.log_offset = 0
+        self.log_inode = None
+
+    def record(self, record: UsageRecord):
+        with self.lock:
+            self.records.append(record)
+            if self.log_path:
+                with open(self.log_path, "a") as file:
+                    file.write(record.model_dump_json() + "\n")
+
+    def load(self) -> List[UsageRecord]:
+        # The log is the superset of this process's records, prefer it when present
+        if not self.log_path or not os.path.exists(self.log_path):
+            with self.lock:
+                return list(self.records)
+        with self.lock:
+            self.tail()
+            return list(self.log_records)
+
+    def tail(self):
+        """Parse the log lines appended since the last call. A log that was replaced or shrank is read from the start."""
+        stat = os.stat(self.log_path)
+        if stat.st_ino != self.log_inode or stat.st_size < self.log_offset:
+            self.log_records.clear()
+            self.log_offset = 0
+            self.log_inode = stat.st_ino
+        with open(self.log_path, "rb") as file:
+            file.seek(self.log_offset)
+            data = file.read()
+        # A line another process is still writing is left for the next call
+        complete = data[:data.rfind(b"\n") + 1]
+        self.log_offset += len(complete)
+        for line in complete.decode("utf-8").splitlines():
+            line = line.strip()
+            if line:
+                self.log_records.append(UsageRecord.model_validate_json(line))
+
+    def query(self, stage: Optional[str] = None, model: Optional[str] = None, since: Optional[float] = None) -> List[UsageRecord]:
+        return [
+            record
+            for record in self.load()
+            if (stage is None or record.stage == stage)
+            and (model is None or record.model == model)
+            and (since is None or record.timestamp >= since)
+        ]
+
+    def summary(self, stage: Optional[str] = None, model: Optional[str] = None, since: Optional[float] = None) -> List[UsageSummary]:
+        groups: Dict[tuple, List[UsageRecord]] = {}
+        for record in self.query(stage, model, since):
+            groups.setdefault((record.stage, record.model), []).append(record)
+
+        summaries = []
+        for (group_stage, group_model), records in sorted(groups.items(), key=lambda item: (item[0][0] or "", item[0][1])):
+            wall_times = sorted(record.wall_time for record in records)
+            ttfts = [record.time_to_first_token for record in records if record.time_to_first_token is not None]
+            prompt_tokens = sum(record.prompt_tokens or 0 for record in records)
+            completion_tokens = sum(record.completion_tokens or 0 for record in records)
+            cached_tokens = sum(record.cached_tokens or 0 for record in records)
+            summaries.append(
+                UsageSummary(
+                    stage=group_stage,
+                    model=group_model,
+                    calls=sum(record.requests for record in records),
+                    failures=sum(1 for record in records if not record.success),
+                    prompt_tokens=prompt_tokens,
+                    completion_tokens=completion_tokens,
+                    total_tokens=prompt_tokens + completion_tokens,
+                    cached_tokens=cached_tokens,
+                    cache_hit_rate=cached_tokens / prompt_tokens if prompt_tokens else 0.0,
+                    wall_time=sum(wall_times),
+                    avg_wall_time=sum(wall_times) / len(wall_times),
+                    p95_wall_time=wall_times[min(len(wall_times) - 1, int(len(wall_times) * 0.95))],
+                    avg_time_to_first_token=sum(ttfts) / len(ttfts) if ttfts else None,
+                )
+            )
+        return summaries
+
+
+_tracker: Optional[UsageTracker] = None
+_tracker_lock = threading.Lock()
+
+
+def usage_tracker() -> UsageTracker:
+    """Process-wide tracker. Set LLM_USAGE_LOG to share records between processes through a JSONL file."""
+    global _tracker
+    with _tracker_lock:
+        if _tracker is None:
+            _tracker = UsageTracker(log_path=os.getenv("LLM_USAGE_LOG"))
+        return _tracker
+
+
+def cached_prompt_tokens(usage) -> Optional[int]:
+    """prompt_tokens_details.cached_tokens of an OpenAI-style usage block, given as an object or a dict."""
+    details = usage.get("prompt_tokens_details") if isinstance(usage, dict) else getattr(usage, "prompt_tokens_details", None)
+    if details is None:
+        return None
+    return details.get("cached_tokens") if isinstance(details, dict) else getattr(details, "cached_tokens", None)
+
+
+class track_call:
+    """Context manager timing one LLM call. Set the token counts on it before leaving the block."""
+
+    def __init__(self, provider: str, model: str, tracker: Optional[UsageTracker] = None):
+        self.provider = provider
+        self.model = model
+        self.tracker = tracker
+        self.prompt_tokens: Optional[int] = None
+        self.completion_tokens: Optional[int] = None
+        self.cached_tokens: Optional[int] = None
+        self.time_to_first_token: Optional[float] = None
+        self.requests = 1
+        # Cleared when another process records the call, such as the gateway a crew was routed to
+        self.enabled = True
+
+    def set_usage(self, prompt_tokens: Optional[int], completion_tokens: Optional[int], cached_tokens: Optional[int] = None):
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+        self.cached_tokens = cached_tokens
+
+    def __enter__(self):
+        self.started_at = time.monotonic()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if not self.enabled:
+            return False
+        stage = current_stage()
+        (self.tracker or usage_tracker()).record(
+            UsageRecord(
+                timestamp=time.time(),
+                provider=self.provider,
+                model=self.model,
+                stage=stage.value if stage else None,
+                prompt_tokens=self.prompt_tokens,
+                completion_tokens=self.completion_tokens,
+                cached_tokens=self.cached_tokens,
+                requests=self.requests,
+                wall_time=time.monotonic() - self.started_at,
+                time_to_first_token=self.time_to_first_token,
+                success=exc_type is None,
+            )
+        )
+        return False
+
+
+def crew_model(crew) -> str:
+    """Model the crew's first agent runs on, falling back to the MODEL crewai reads from the environment."""
+    llm = getattr(crew.agents[0], "llm", None) if crew.agents else None
+    return getattr(llm, "model", None) or os.getenv("MODEL", "")
+
+
+def kickoff_with_usage(crew, inputs: dict, stage: Stage):
+    """
+    Run a crewai Crew tagged with `stage` and record the token usage it reports for the whole run. A crew routed to
+    the gateway is recorded there, per upstream call, and not again here.
+    With a crew cassette configured the kickoff is recorded, or replayed without running the crew.
+    """
+    # Imported here, the cassette records its replays through this module
+    from .replay_handler import default_crew_cassette
+
+    cassette = default_crew_cassette()
+    if cassette is not None and cassette.replaying:
+        with llm_stage(stage):
+            return cassette.replay(crew, inputs)
+
+    started_at = time.monotonic()
+    with llm_stage(stage), track_call("crewai", crew_model(crew)) as call, routed_to_gateway(crew, stage) as routed:
+        call.enabled = not routed
+        output = crew.kickoff(inputs=inputs)
+        usage = getattr(output, "token_usage", None)
+        if usage is not None:
+            call.set_usage(usage.prompt_tokens, usage.completion_tokens, getattr(usage, "cached_prompt_tokens", None))
+            call.requests = max(usage.successful_requests, 1)
+    if cassette is not None:
+        cassette.record(crew, inputs, output, time.monotonic() - started_at)
+    return output
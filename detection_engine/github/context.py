@@ -0,0 +1,142 @@
+import os
+import re
+from typing import Dict, List, Mapping, Set
+
+from core.llm_handlers.budget import file_tokens
+
+HUNK_HEADER = re.compile(r"^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@")
+IDENTIFIER = re.compile(r"[A-Za-z_][A-Za-z0-9_]{2,}")
+
+# Declarations of types, functions and handlers in the languages ADAPT services are written in
+DEFINITIONS = [
+    re.compile(r"^type\s+(\w+)", re.MULTILINE),  # Go types
+    re.compile(r"^func\s+(?:\([^)]*\)\s*)?(\w+)", re.MULTILINE),  # Go functions and methods
+    re.compile(r"^\s*(?:async\s+)?(?:class|def)\s+(\w+)", re.MULTILINE),  # Python
+    re.compile(r"\b(?:class|interface|enum|struct|function)\s+(\w+)"),  # Java, TypeScript, JavaScript, C#
+]
+
+# Lines that wire a handler to a route in the common web frameworks
+ROUTE_REGISTRATION = re.compile(
+    r"HandleFunc\(|\.Handle\(|\.(?:GET|POST|PUT|PATCH|DELETE|Get|Post|Put|Patch|Delete|Group|Route)\(\s*\"/"
+    r"|@\w+\.(?:get|post|put|patch|delete|route|api_route)\("
+    r"|@(?:Get|Post|Put|Patch|Delete|Request)Mapping"
+    r"|\b(?:app|router)\.(?:get|post|put|patch|delete|use)\(\s*['\"]/"
+)
+SPEC_FILE_HINTS = (".project.json", "openapi", "swagger")
+
+# Names declared in more files than this are too generic to pull in, e.g. New, String or Error
+MAX_DEFINING_FILES = 3
+
+
+class Hunk:
+    def __init__(self, old_start: int, old_count: int, new_start: int, new_count: int):
+        self.old_start = old_start
+        self.old_count = old_count
+        self.new_start = new_start
+        self.new_count = new_count
+        self.lines: List[str] = []
+
+    def changed_lines(self) -> List[str]:
+        return [line[1:] for line in self.lines if line[:1] in ("+", "-")]
+
+
+class FileDiff:
+    def __init__(self, path: str, old_path: str):
+        self.path = path
+        self.old_path = old_path
+        self.hunks: List[Hunk] = []
+
+
+def parse_diff(diff: str) -> List[FileDiff]:
+    """The files and hunks of a unified git diff."""
+    files: List[FileDiff] = []
+    hunk = None
+    for line in diff.splitlines():
+        match = re.match(r"^diff --git a/(\S+) b/(\S+)", line)
+        if match:
+            files.append(FileDiff(path=match.group(2), old_path=match.group(1)))
+            hunk = None
+            continue
+        match = HUNK_HEADER.match(line)
+        if match and files:
+            old_start, old_count, new_start, new_count = match.groups()
+            hunk = Hunk(int(old_start), int(old_count or 1), int(new_start), int(new_count or 1))
+            files[-1].hunks.append(hunk)
+            continue
+        if hunk is not None and line[:1] in ("+", "-", " ") and not line.startswith(("+++", "---")):
+            hunk.lines.append(line)
+    return files
+
+
+def definition_index(files: Mapping[str, str]) -> Dict[str, Set[str]]:
+    """Declared name -> paths declaring it."""
+    index: Dict[str, Set[str]] = {}
+    for path, content in files.items():
+        for pattern in DEFINITIONS:
+            for name in pattern.findall(content):
+                index.setdefault(name, set()).add(path)
+    return index
+
+
+def route_files(files: Mapping[str, str]) -> List[str]:
+    """Paths of files that register endpoints or describe them."""
+    return [
+        path for path, content in files.items()
+        if any(hint in path.lower() for hint in SPEC_FILE_HINTS) or ROUTE_REGISTRATION.search(content)
+    ]
+
+
+class DiffContextBuilder:
+    """
+    The part of a base branch a PR reviewer needs: the files the diff touches, the files declaring the types and
+    functions its hunks reference, and the files registering endpoints. The full tree is only returned when the diff
+    cannot be scoped.
+    """
+
+    def __init__(self, depth: int = 1):
+        self.depth = depth
+
+    @classmethod
+    def from_env(cls) -> "DiffContextBuilder":
+        """DETECTION_CONTEXT_DEPTH hops of references from the changed lines (default 1)."""
+        return cls(depth=int(os.getenv("DETECTION_CONTEXT_DEPTH", 1)))
+
+    def referenced_files(self, files: Mapping[str, str], index: Dict[str, Set[str]], names: Set[str]) -> Set[str]:
+        paths = set()
+        for name in names:
+            defining = index.get(name, set())
+            if 0 < len(defining) <= MAX_DEFINING_FILES:
+                paths.update(defining)
+        return paths
+
+    def build(self, files: Mapping[str, str], diff: str) -> Mapping[str, str]:
+        file_diffs = parse_diff(diff)
+        if not file_diffs:
+            print("Diff context: no files in the diff, sending the full base branch")
+            return files
+
+        # Step 1: The touched files, under their base name when the PR renames them
+        selected = {path for file_diff in file_diffs for path in (file_diff.old_path, file_diff.path) if path in files}
+
+        # Step 2: Files declaring what the changed lines use, following references depth times
+        index = definition_index(files)
+        names = {name for file_diff in file_diffs for hunk in file_diff.hunks for line in hunk.changed_lines() for name in IDENTIFIER.findall(line)}
+        for _ in range(self.depth):
+            found = self.referenced_files(files, index, names) - selected
+            if not found:
+                break
+            selected |= found
+            names = {name for path in found for name in IDENTIFIER.findall(files[path])}
+
+        # Step 3: Where endpoints are registered, so the reviewer can tell which routes a handler serves
+        selected |= set(route_files(files))
+
+        if not selected:
+            print("Diff context: nothing in the base branch relates to the diff, sending the full base branch")
+            return files
+
+        scoped = {path: files[path] for path in files if path in selected}
+        total = sum(file_tokens(path, content) for path, content in files.items())
+        kept = sum(file_tokens(path, content) for path, content in scoped.items())
+        print(f"Diff context: kept {len(scoped)} of {len(files)} files, {kept} of {total} source tokens")
+        return scoped
@@ -4,6 +4,13 @@ from crewai import Crew, Agent, Task
 from detection_engine.templates import detection_system_prompt,  extratction_system_prompt
 from detection_engine.model import GitHubPRAnalysisOutput, SpecExtractionOutput, Specification, GitHubPRAnalysisOutputWithSpecification
 from detection_engine.github.engine import GithubDetectionEngine
+from core.llm_handlers.context import Stage
+from core.llm_handlers.usage import usage_tracker
+from core.llm_handlers.cascade import kickoff_cascade, cascade_stats
+from core.llm_handlers.budget import task_sections
+from core.llm_handlers.prompt import layered_prompt
+from adaptutils.githubutils import default_github_http
+from adaptutils.minify import default_minifier
 
 
 class GithubDetectionCrew:
@@ -26,10 +33,11 @@ class GithubDetectionCrew:
 
     def get_pr_review_task(self) -> Task:
         return Task(
-            description="Instructions :\n Steps:\n" + str(
-                detection_system_prompt["system_prompt"]["instructions"]["steps"]
-            )
-            + "\nThe PR DIFF is as follows:\n{pr_diff} and the Base Branch Source Code is as follows:\n{base_source_code} and the PR ID is {pr_id}",
+            description=layered_prompt(
+                "Instructions :\n Steps:\n" + str(detection_system_prompt["system_prompt"]["instructions"]["steps"]),
+                snapshot="The Base Branch Source Code is as follows:\n{base_source_code}",
+                variable="The PR DIFF is as follows:\n{pr_diff} and the PR ID is {pr_id}",
+            ),
             expected_output="Generate the JSON output as per the below JSON output Schema using the extracted information.\njson outout Schema:{output_schema}",
             output_file="output.json",
             output_json=GitHubPRAnalysisOutput,
@@ -54,11 +62,12 @@ class GithubDetectionCrew:
 
     def get_endpoint_specification_extraction_task(self) -> Task:
         return Task(
-            description="Instructions :\n Steps:\n" + str(
-                extratction_system_prompt["system_prompt"]["instructions"]["steps"]
-            )
-            + "\nThe Github Source Code is as follows:\n{source_code}. The list of endpoint specifications to be extracted are {endpoints_list}",
-            expected_output="Generate the JSON output using the extracted information.\nExample json outout :{example_output}",
+            # The source is picked per endpoint, so it goes after the instructions and example every endpoint shares
+            description=layered_prompt(
+                "Instructions :\n Steps:\n" + str(extratction_system_prompt["system_prompt"]["instructions"]["steps"]) + "\nExample json outout :{example_output}",
+                variable="The Github Source Code is as follows:\n{source_code}.\nThe list of endpoint specifications to be extracted are {endpoints_list}",
+            ),
+            expected_output="Generate the JSON output using the extracted information, shaped like the example json output.",
             output_json=SpecExtractionOutput,
             verbose=True,
             agent=self.endpoint_specification_extractor_agent,
@@ -74,47 +83,52 @@ class GithubDetectionCrew:
 
     def detect(self, repo_owner: str, repo_name: str, pr_number: int, pr_url: str) -> str:
         de = GithubDetectionEngine()
+        github_calls = default_github_http().call_counts()
+        output_schema = json.dumps(
+            detection_system_prompt["system_prompt"]["instructions"][
+                "output_schema"
+            ]
+        )
         base_source_code, pr_diff = de.get_pr_diff_and_base_branch_source(
-            repo_owner, repo_name, pr_number
+            repo_owner, repo_name, pr_number, sections=task_sections(self.pr_review_task, {"output_schema": output_schema})
         )
         inputs = {
             "pr_id": str(pr_number),
             "pr_diff": pr_diff,
             "base_source_code": base_source_code,
-            "output_schema": json.dumps(
-                detection_system_prompt["system_prompt"]["instructions"][
-                    "output_schema"
-                ]
-            )
+            "output_schema": output_schema,
         }
 
         print(inputs)
 
         # Step 2.2: Run the Crew and get the Final output
-        detection_results = self.detection_crew.kickoff(inputs=inputs)
+        detection_results = kickoff_cascade(self.detection_crew, inputs, Stage.PR_DETECTION)
 
-        ok, error = de.validate_detection_data(detection_results.json)
+        ok, error = de.validate_detection_data(detection_results)
         if not ok:
             print(error)
             return ok, error
 
-        source_code = de.get_feature_branch_source(repo_owner, repo_name, pr_number)
+        branch_source = de.get_feature_branch_files(repo_owner, repo_name, pr_number)
         extraction_inputs = {
-            "source_code": source_code,
             "example_output": json.dumps(extratction_system_prompt["system_prompt"]["instructions"]["example_output"]),
         }
         specifications: List[Specification] = []
         for change in de.detection_data.analysis_summary.breaking_changes:
             for endpoint in change.affected_endpoint:
                 extraction_inputs["endpoints_list"] = str([{"endpoint":endpoint.endpoint, "method": endpoint.methods.method}])
-                results = self.extraction_crew.kickoff(inputs=extraction_inputs)
-                specifications.extend(SpecExtractionOutput.model_validate_json(results.json).endpoints)
+                sections = task_sections(self.endpoint_specification_extraction_task, {key: value for key, value in extraction_inputs.items() if key != "source_code"})
+                extraction_inputs["source_code"] = de.get_endpoint_source(branch_source, endpoint.endpoint, sections)
+                results = kickoff_cascade(self.extraction_crew, extraction_inputs, Stage.SPEC_EXTRACTION)
+                specifications.extend(SpecExtractionOutput.model_validate_json(results).endpoints)
 
         for change in de.detection_data.analysis_summary.non_breaking_changes:
             for endpoint in change.affected_endpoint:
                 extraction_inputs["endpoints_list"] = str([{"endpoint":endpoint.endpoint, "method": endpoint.methods.method}])
-                results = self.extraction_crew.kickoff(inputs=extraction_inputs)
-                specifications.extend(SpecExtractionOutput.model_validate_json(results.json).endpoints)
+                sections = task_sections(self.endpoint_specification_extraction_task, {key: value for key, value in extraction_inputs.items() if key != "source_code"})
+                extraction_inputs["source_code"] = de.get_endpoint_source(branch_source, endpoint.endpoint, sections)
+                results = kickoff_cascade(self.extraction_crew, extraction_inputs, Stage.SPEC_EXTRACTION)
+                specifications.extend(SpecExtractionOutput.model_validate_json(results).endpoints)
         
 
         data = de.detection_data.add_specifications(str(pr_number), specifications)
@@ -126,4 +140,10 @@ class GithubDetectionCrew:
         print(
             f"Completed Detection Task For: {repo_owner}/{repo_name} PR: {pr_number} successful."
         )
+        for summary in usage_tracker().summary():
+            print(f"LLM Usage: {summary.model_dump_json()}")
+        print(f"Model cascade stats: {cascade_stats().stats()}")
+        print(f"GitHub API calls: {default_github_http().calls_since(github_calls)}")
+        print(f"GitHub API stats: {default_github_http().stats()}")
+        print(f"Source minification: {default_minifier().stats()}")
         return True, "Success"
@@ -1,23 +1,31 @@
 import os
-from typing import Tuple, Union
+from typing import Dict, Tuple, Union, Mapping
 from gql import gql, Client
 from gql.transport.requests import RequestsHTTPTransport
 import json
 
-from adaptutils.githubutils import GitHubApp
+from adaptutils.githubutils import GitHubApp, HandleCache
+from adaptutils.snapshot import SourceSnapshot, render_source
+from core.llm_handlers.budget import ContextBudget, diff_paths, path_keywords
+from detection_engine.github.context import DiffContextBuilder
 from detection_engine.model import GitHubPRAnalysisOutput, AffectedEndpoint, EndpointWithSpec, GitHubPRAnalysisOutputWithSpecification
 
 
 class GithubDetectionEngine:
     def __init__(self):
-        self.github_app = GitHubApp(auth_token=os.getenv("GITHUB_API_TOKEN"))
+        # One engine per detection run, a PR fetched at the start is reused however long the crews in between take
+        self.github_app = GitHubApp(auth_token=os.getenv("GITHUB_API_TOKEN"), handles=HandleCache(float("inf")))
+        self.head_shas: Dict[Tuple[str, str, int], str] = {}
+        self.budget = ContextBudget.from_env()
+        self.context_builder = DiffContextBuilder.from_env()
 
     def get_pr_diff_and_base_branch_source(
-        self, repo_owner: str, repo_name: str, pr_number: int
+        self, repo_owner: str, repo_name: str, pr_number: int, sections: dict = None
     ) -> str:
 
         # Step 1: Get the PR Object
         pr = self.github_app.get_pr(repo_owner, repo_name, pr_number)
+        self.head_shas[(repo_owner, repo_name, pr_number)] = pr.head.sha
 
         # Step 2: Get the Base Branch Source
         base_branch_source = self.github_app.get_repo_branch_source(
@@ -31,13 +39,24 @@ class GithubDetectionEngine:
         # Step 3: Get the pull request diff
         diff = self.github_app.get_pr_diff_from_diff_url(pr.diff_url)
 
+        # Step 3.1: Scope the base branch to the files the diff touches and references
+        base_branch_source = self.context_builder.build(base_branch_source, diff)
+
+        # Step 3.2: Keep the files the PR touches and the most related ones within the context budget
+        changed_paths = diff_paths(diff)
+        base_branch_source = self.budget.fit(
+            base_branch_source,
+            {**(sections or {}), "pr_diff": diff},
+            keywords=[keyword for path in changed_paths for keyword in path_keywords(path)],
+            priority_paths=changed_paths,
+        )
+
         # Step 4: Return the base branch source and diff
         base_branch_source_code = ""
         base_branch_source_code += "=" * 50 + "\n"
         base_branch_source_code += "Base Branch Source\n"
         base_branch_source_code += "=" * 50 + "\n"
-        for path, content in base_branch_source.items():
-            base_branch_source_code += f"--- {path} ---\n{content}\n"
+        base_branch_source_code += render_source(base_branch_source)
         base_branch_source_code += "\n\n"
 
         diff_str = ""
@@ -48,32 +67,41 @@ class GithubDetectionEngine:
         return base_branch_source_code, diff_str
     
 
-    def get_feature_branch_source(
+    def get_feature_branch_files(
         self, repo_owner: str, repo_name: str, pr_number: int
-    ) -> str:
+    ) -> SourceSnapshot:
 
-        # Step 1: Get the PR Object
-        pr = self.github_app.get_pr(repo_owner, repo_name, pr_number)
+        # Step 1: Get the PR Object, the one the diff was read from
+        pr = self.github_app.get_pr(repo_owner, repo_name, pr_number, head_sha=self.head_shas.get((repo_owner, repo_name, pr_number)))
 
         print(pr.head.ref)
-        # Step 2: Get the Base Branch Source
-        branch_source = self.github_app.get_repo_branch_source(
+        # Step 2: Get the Feature Branch Source
+        return self.github_app.get_repo_branch_source(
             repo_owner,
             repo_name,
             pr.head.ref,
             include_extensions=[".go", ".project.json", ".json", ".yaml"],
+            sha=pr.head.sha,
         )
 
-        # Step 4: Return the base branch source and diff
+    def render_branch_source(self, branch_source: Mapping[str, str]) -> str:
         branch_source_code = ""
         branch_source_code += "=" * 50 + "\n"
         branch_source_code += "Branch Source\n"
         branch_source_code += "=" * 50 + "\n"
-        for path, content in branch_source.items():
-            branch_source_code += f"--- {path} ---\n{content}\n"
+        branch_source_code += render_source(branch_source)
         branch_source_code += "\n\n"
         return branch_source_code
 
+    def get_feature_branch_source(
+        self, repo_owner: str, repo_name: str, pr_number: int
+    ) -> str:
+        return self.render_branch_source(self.get_feature_branch_files(repo_owner, repo_name, pr_number))
+
+    def get_endpoint_source(self, branch_source: Mapping[str, str], endpoint: str, sections: dict) -> str:
+        """The branch source trimmed to the files most relevant to endpoint when it exceeds the context budget."""
+        return self.render_branch_source(self.budget.fit(branch_source, sections, keywords=path_keywords(endpoint)))
+
     def validate_data_with_specification(self, data: str) -> Tuple[bool, str]:
         try:
             self.data = GitHubPRAnalysisOutputWithSpecification.model_validate_json(data)
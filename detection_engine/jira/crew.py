@@ -3,6 +3,8 @@ from crewai import Agent, Task, Crew
 from detection_engine.model import JIRATicketExtractionOutput, JIRATicketAnalysisOutput
 from detection_engine.jira.template.template import jira_ticket_api_data_extraction_system_prompt, jira_api_change_analyzer_system_prompt
 from detection_engine.jira.engine import JIRADetectionEngine
+from core.llm_handlers.context import Stage
+from core.llm_handlers.cascade import kickoff_cascade
 
 class JIRADetectionCrew:
     def __init__(self):
@@ -88,19 +90,20 @@ class JIRADetectionCrew:
 
         # print(inputs)
         # Step 2.2: Run the Crew and get the Final output
-        results = self.extraction_crew.kickoff(inputs=inputs)
-        # print(results.json)
-        existing_specification = de.get_endpoint_specifications(results.json)
+        # Duplicate webhook deliveries for the same ticket share one crew run
+        results = kickoff_cascade(self.extraction_crew, inputs, Stage.JIRA_ANALYSIS)
+        # print(results)
+        existing_specification = de.get_endpoint_specifications(results)
 
         inputs["existing_api_specification"] = existing_specification
         inputs["output_schema"] = json.dumps(jira_api_change_analyzer_system_prompt["system_prompt"]["instructions"]["output_schema"])
         # print("\n\n\n ********** INPUT **************")
         # print(inputs)
 
-        results = self.analysis_crew.kickoff(inputs=inputs)
+        results = kickoff_cascade(self.analysis_crew, inputs, Stage.JIRA_ANALYSIS)
         # print("\n\n\n ********** OUTPUT **************")
-        # print(results.json)
-        ok, error = de.notify(results.json, jira_data_dict["ticket"]["url"])
+        # print(results)
+        ok, error = de.notify(results, jira_data_dict["ticket"]["url"])
         if not ok:
             print(error)
             return ok, error
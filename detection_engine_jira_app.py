@@ -1,7 +1,10 @@
 import os
 import uvicorn
-from fastapi import FastAPI, Request
+from fastapi import FastAPI, Body
 from detection_engine.jira.crew import JIRADetectionCrew
+from core.llm_handlers.usage import usage_tracker
+from core.llm_handlers.cascade import cascade_stats
+from core.llm_handlers.hedge import crew_hedger
 from dotenv import load_dotenv
 # from opik.integrations.crewai import track_crewai
 
@@ -11,14 +14,27 @@ load_dotenv("./.env", override=True)
 app = FastAPI()
 
 @app.post("/jira-webhook")
-async def jira_webhook(request: Request):
-    data = await request.json()
+def jira_webhook(data: dict = Body(...)):
+    # Sync handler so FastAPI runs concurrent events on its thread pool instead of blocking the event loop
     print("Received Jira Event:", data)
     # print("Received Jira Event")
     crew = JIRADetectionCrew()
     _, status = crew.detect(data)
     return {"message": status}
 
+@app.get("/metrics/llm-usage")
+async def llm_usage(stage: str = None, model: str = None):
+    return [summary.model_dump() for summary in usage_tracker().summary(stage=stage, model=model)]
+
+@app.get("/metrics/llm-cascade")
+async def llm_cascade():
+    return cascade_stats().stats()
+
+@app.get("/metrics/llm-hedge")
+async def llm_hedge():
+    hedger = crew_hedger()
+    return hedger.stats() if hedger is not None else {"enabled": False}
+
 
 if __name__ == "__main__":
     print(f"Server Process (PID: {os.getpid()}) starting...")
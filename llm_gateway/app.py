@@ -0,0 +1,65 @@
+import os
+import uvicorn
+from typing import Optional
+from fastapi import FastAPI, Body, Header, HTTPException
+from fastapi.responses import StreamingResponse
+from dotenv import load_dotenv
+
+from core.llm_handlers.context import Stage, llm_stage
+from core.llm_handlers.gateway import ChatGateway, UpstreamError, completion_chunks
+from core.llm_handlers.gateway_client import STAGE_HEADER
+from core.llm_handlers.usage import usage_tracker
+
+# Like the other services, configuration comes from the shared data volume
+load_dotenv("/app/data/.env", override=True)
+
+app = FastAPI()
+gateway = ChatGateway.from_env()
+
+
+def parse_stage(value: Optional[str]) -> Optional[Stage]:
+    try:
+        return Stage(value) if value else None
+    except ValueError:
+        print(f"Unknown stage {value}, the call is scheduled with the default priority")
+        return None
+
+
+def chat_completion(body: dict, stage: Optional[Stage]):
+    # Sync so FastAPI runs each request on its thread pool, the scheduler and coalescing block while waiting
+    try:
+        if stage is not None:
+            with llm_stage(stage):
+                completion = gateway.complete(body)
+        else:
+            completion = gateway.complete(body)
+    except UpstreamError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.body)
+    if body.get("stream"):
+        return StreamingResponse(completion_chunks(completion), media_type="text/event-stream")
+    return completion
+
+
+@app.post("/v1/chat/completions")
+def chat_completions(body: dict = Body(...), stage: Optional[str] = Header(None, alias=STAGE_HEADER)):
+    return chat_completion(body, parse_stage(stage))
+
+
+@app.post("/stages/{stage}/v1/chat/completions")
+def stage_chat_completions(stage: str, body: dict = Body(...)):
+    return chat_completion(body, parse_stage(stage))
+
+
+@app.get("/metrics/llm-usage")
+async def llm_usage(stage: str = None, model: str = None):
+    return [summary.model_dump() for summary in usage_tracker().summary(stage=stage, model=model)]
+
+
+@app.get("/metrics/llm-gateway")
+def llm_gateway():
+    return gateway.stats()
+
+
+if __name__ == "__main__":
+    print(f"LLM Gateway Process (PID: {os.getpid()}) starting...")
+    uvicorn.run(app, host="0.0.0.0", port=9504)
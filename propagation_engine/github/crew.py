@@ -4,6 +4,11 @@ from crewai import Crew, Agent, Task
 from propagation_engine.github.templates import propagate_system_prompt
 from propagation_engine.github.engine import GithubPropagationEngine
 from propagation_engine.model import GithubPRCodeGenerationOutput, InputAffectedClient, InputGithubProject
+from core.llm_handlers.context import Stage
+from core.llm_handlers.usage import kickoff_with_usage
+from core.llm_handlers.budget import task_sections
+from core.llm_handlers.prompt import layered_prompt
+from adaptutils.githubutils import default_github_http
 
 
 class GithubPropagationCrew:
@@ -22,11 +27,11 @@ class GithubPropagationCrew:
 
     def get_github_propagation_task(self) -> Task:
         return Task(
-            description=str(
-                propagate_system_prompt["system_prompt"]["instructions"]["steps"]
-            )
-            + "\nThe Below are the Service Side Changes: {server_side_changes}\n."
-            + "\nThe Below are the Client Side Source Code:\n{source_code}\n\n ",
+            description=layered_prompt(
+                str(propagate_system_prompt["system_prompt"]["instructions"]["steps"]),
+                snapshot="\nThe Below are the Client Side Source Code:\n{source_code}\n",
+                variable="\nThe Below are the Service Side Changes: {server_side_changes}\n.",
+            ),
             # expected_output="Generate the JSON output as per the below JSON output Schema using the generated information.\njson outout Schema:{output_schema}\n\n The sample diff string: {sample_diff_string}",
             expected_output="Generate the JSON output as per the below JSON output Schema using the generated information.\njson outout Schema:{output_schema}\n\n",
             output_file="output.json",
@@ -44,6 +49,7 @@ class GithubPropagationCrew:
 
     def propagate(self) -> Tuple[bool, str]:
         pe = GithubPropagationEngine()
+        github_calls = default_github_http().call_counts()
         # Step 1: Get Action Items for Github PR
         self.action_items = pe.get_action_items()
         if not self.action_items:
@@ -54,20 +60,27 @@ class GithubPropagationCrew:
         for action_item in self.action_items:
             # Step 2.1: Prepare the Client Source Code
             repo_owner, repo_name = action_item.affectedClient.githubProject.repository.split("/")
-            client_source_code = pe.get_client_source_code(repo_owner, repo_name, action_item.affectedClient.githubProject.branch)
             service_side_changes = pe.get_service_side_changes(action_item)
+            output_schema = json.dumps(propagate_system_prompt["system_prompt"]["instructions"]["output_schema"])
+            client_source_code = pe.get_client_source_code(
+                repo_owner,
+                repo_name,
+                action_item.affectedClient.githubProject.branch,
+                endpoint=action_item.originatingService.affectedEndpoint.url,
+                sections=task_sections(self.github_propagation_task, {"server_side_changes": service_side_changes, "output_schema": output_schema}),
+            )
             diff_string : str = ""
             with open("./propagation_engine/github/sample_diff.diff", "r") as file:
                 diff_string = file.read()
             inputs = {
                 "server_side_changes": service_side_changes,
                 "source_code": client_source_code,
-                "output_schema": json.dumps(propagate_system_prompt["system_prompt"]["instructions"]["output_schema"]),
+                "output_schema": output_schema,
                 # "sample_diff_string": diff_string
             }
 
         print(inputs)
-        results = self.github_propagation_crew.kickoff(inputs=inputs)
+        results = kickoff_with_usage(self.github_propagation_crew, inputs, Stage.PR_PROPAGATION)
         print(results.json)
 
         ok, pr_number, pr_url = pe.apply_diff_and_raise_pr(owner=repo_owner, repository= repo_name, base_branch= action_item.affectedClient.githubProject.branch, data= results.json)
@@ -79,5 +92,6 @@ class GithubPropagationCrew:
         id = pe.update_action_items(id=action_item.id, comments=None, affected_client=affected_client, propagationStatus='inprogress')
         if id != action_item.id:
             return False, "Failed to update the Action Items with Meta Data"
+        print(f"GitHub API calls: {default_github_http().calls_since(github_calls)}")
         return True, "Success"
         
@@ -4,12 +4,15 @@ from gql import gql, Client
 from gql.transport.requests import RequestsHTTPTransport
 
 from adaptutils.githubutils import GitHubApp
+from adaptutils.snapshot import render_source
+from core.llm_handlers.budget import ContextBudget, path_keywords
 from propagation_engine.model import ActionItemsResponse, ActionItem, GithubPRCodeGenerationOutput, InputAffectedClient
 
 
 class GithubPropagationEngine:
     def __init__(self):
         self.github_app = GitHubApp(auth_token=os.getenv("GITHUB_API_TOKEN"))
+        self.budget = ContextBudget.from_env()
 
     def get_action_items(self) -> List[ActionItem]:
         # Step 1: Setup GraphQL Client Object
@@ -94,22 +97,26 @@ class GithubPropagationEngine:
         }
         return query, variables
 
-    def get_client_source_code(self, repo_owner: str, repo_name: str, branch: str) -> str:
+    def get_client_source_code(self, repo_owner: str, repo_name: str, branch: str, endpoint: str = "", sections: dict = None) -> str:
         # Step 1: Get the Branch Source
         source_code_data = self.github_app.get_repo_branch_source(
             repo_owner,
             repo_name,
             branch= branch,
             include_extensions=[".go", ".project.json", ".json", ".yaml", ".yml"],
+            # The generated diff is applied to these files, they have to stay verbatim
+            minify=False,
         )
+
+        # Step 1.1: Keep the files that most likely call the endpoint within the context budget
+        source_code_data = self.budget.fit(source_code_data, sections or {}, keywords=path_keywords(endpoint))
         
         # Step 2: Return the branch source
         source_code = ""
         source_code += "=" * 50 + "\n"
         source_code += "Client Source Code\n"
         source_code += "=" * 50 + "\n"
-        for path, content in source_code_data.items():
-            source_code += f"--- {path} ---\n{content}\n"
+        source_code += render_source(source_code_data)
         source_code += "=" * 50 + "\n\n"
 
         return source_code
@@ -4,6 +4,8 @@ from crewai import Agent, Task, Crew
 from propagation_engine.jira.template import propagation_system_prompt
 from propagation_engine.jira.engine import JiraPropagationEngine
 from propagation_engine.model import JiraTicketGenerationOutput, InputAffectedClient, InputJiraProject
+from core.llm_handlers.context import Stage
+from core.llm_handlers.usage import kickoff_with_usage
 
 class JiraPropagationCrew:
     def __init__(self):
@@ -58,7 +60,7 @@ class JiraPropagationCrew:
             }
 
             print(inputs)
-            results = self.jira_propagation_crew.kickoff(inputs=inputs)
+            results = kickoff_with_usage(self.jira_propagation_crew, inputs, Stage.JIRA_PROPAGATION)
             # print(results.json)
             jira_output = results.json_dict
             # jira_output = {"title": "Breaking Change: User Management Service - Update GET /users/{id} Response Structure", "summary": "The response structure of the GET /users/{id} endpoint has changed, requiring updates to client implementations.", "description": "The user_name and user_id attributes have been removed from the response object for the /users/{id} endpoint to enhance user privacy and data integrity. This change is necessary to comply with privacy regulations, and impacts all clients using this endpoint. Clients must adapt their response handling logic to align with this update.", "issue_type": "Bug", "priority": "High", "severity": "Critical", "affected_endpoint": "/users/{id}", "impact": "Clients relying on the user_name and user_id fields in the response will need to update their implementations to handle the removal of these attributes. Missing fields may cause errors or unexpected behavior in the client applications.", "required_changes": "Clients must update their code to remove references to user_name and user_id in the response parsing logic from the GET /users/{id} API. Ensure to account for only the non-sensitive fields: email and name available in the updated response.", "definition_of_ready": "Client teams have reviewed the impact of the change and identified necessary updates to client-side code. Required tests are outlined and planned.", "definition_of_done": "Client implementations have been updated to successfully retrieve and process the revised response structure. All related unit and integration tests have been executed and passed.", "references": [{"title": "Service Change Ticket", "url": "http://localhost:8080/rest/api/2/issue/10100"}]}
@@ -0,0 +1,63 @@
+import io
+import zipfile
+
+from adaptutils.archive import iter_zip_files, iter_response_zip_files
+
+
+def make_zip(files: dict, understate: tuple = ()) -> io.BytesIO:
+    """A GitHub-style zipball of files. Members in understate claim 100 bytes in the central directory."""
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, "w", zipfile.ZIP_DEFLATED) as z:
+        for path, content in files.items():
+            z.writestr(f"acme-orders-1a2b3c/{path}", content)
+        for info in z.infolist():
+            if info.filename.split("/", 1)[-1] in understate:
+                info.file_size = 100
+    archive.seek(0)
+    return archive
+
+
+def paths(pairs) -> list:
+    return [path.split("/", 1)[-1] for path, _ in pairs]
+
+
+def test_filters_and_per_file_limit():
+    archive = make_zip({"main.go": "package main\n", "README.md": "# Orders\n", "big.go": "x" * 5000, "vendor/lib.go": "package lib\n"})
+    files = iter_zip_files(archive, [".go"], exclude_paths=["*/vendor/*"], file_limit=1000, total_limit=10**6)
+    assert paths(files) == ["main.go"]
+
+
+def test_total_limit_stops_extraction():
+    archive = make_zip({"a.go": "a" * 400, "b.go": "b" * 400, "c.go": "c" * 100})
+    assert paths(iter_zip_files(archive, [".go"], file_limit=1000, total_limit=850)) == ["a.go", "b.go"]
+
+
+def test_understated_sizes_are_not_trusted():
+    # A header claiming 100 bytes for 50 KB must not get past the limits: the read is capped and fails its CRC
+    archive = make_zip({"bomb.go": "a" * 50000, "main.go": "package main\n"}, understate=("bomb.go",))
+    files = list(iter_zip_files(archive, [".go"], file_limit=1000, total_limit=10**6))
+    assert paths(files) == ["main.go"]
+    assert all(len(content) <= 1000 for _, content in files)
+
+
+class Response:
+    def __init__(self, body: bytes):
+        self.body = body
+
+    def iter_content(self, chunk_size: int):
+        for start in range(0, len(self.body), chunk_size):
+            yield self.body[start:start + chunk_size]
+
+
+def test_streamed_response():
+    body = make_zip({"main.go": "package main\n", "api/routes.go": "package api\n"}).getvalue()
+    files = dict(iter_response_zip_files(Response(body), [".go"]))
+    assert files == {"acme-orders-1a2b3c/main.go": "package main\n", "acme-orders-1a2b3c/api/routes.go": "package api\n"}
+
+
+if __name__ == "__main__":
+    test_filters_and_per_file_limit()
+    test_total_limit_stops_extraction()
+    test_understated_sizes_are_not_trusted()
+    test_streamed_response()
+    print("All archive tests passed")
@@ -0,0 +1,136 @@
+import os
+import time
+import tempfile
+import threading
+from pydantic import BaseModel
+
+from core.llm_handlers.interface import LLMInterface
+from core.llm_handlers.batch import BatchBackend, BatchError, BatchRequest, BatchRunner, LocalBatchBackend, task_request
+from core.llm_handlers.usage import usage_tracker
+
+
+class Answer(BaseModel):
+    value: str
+
+
+class EchoHandler(LLMInterface):
+    """
+    Answers with the user prompt as an Answer, fenced like local models do. Prompts starting with "fail" raise,
+    prompts starting with "prose" get a sentence and a bare fence.
+    """
+
+    def __init__(self, release: threading.Event = None):
+        self.release = release
+
+    def generate_text(self, system_prompt: str, user_prompt: str, model_name: str, max_tokens: int = -1) -> str:
+        if self.release is not None:
+            self.release.wait()
+        if user_prompt.startswith("fail"):
+            raise ConnectionError("model unloaded")
+        if user_prompt.startswith("prose"):
+            return f'Here is the answer:\n```\n{{"value": "{user_prompt}"}}\n```'
+        return f'```json\n{{"value": "{user_prompt}"}}\n```'
+
+    def generate_json(self, system_prompt: str, user_prompt: str, json_schema: BaseModel, model_name: str, max_tokens: int = -1) -> BaseModel:
+        return json_schema.model_validate_json(self.generate_text(system_prompt, user_prompt, model_name, max_tokens).strip("`json\n"))
+
+
+def request(custom_id: str, user_prompt: str, json_schema=Answer) -> BatchRequest:
+    return BatchRequest(custom_id=custom_id, system_prompt="Extract", user_prompt=user_prompt, model_name="qwen", json_schema=json_schema)
+
+
+def test_local_batch_round_trip():
+    with tempfile.TemporaryDirectory() as root:
+        runner = BatchRunner(LocalBatchBackend(f"{root}/local", EchoHandler()), batch_dir=root, poll_interval=0.01, timeout=10)
+        results = runner.run([request("users", "/users"), request("orders", "/orders"), request("broken", "fail"), request("text", "plain", None), request("prose", "prose")])
+        assert results["users"] == Answer(value="/users")
+        assert results["prose"] == Answer(value="prose")
+        assert results["orders"] == Answer(value="/orders")
+        # A failed request is None, the others still come back
+        assert results["broken"] is None
+        assert results["text"].startswith("```json")
+        # The batch is recorded once, timed from submit to results
+        batch_record = [record for record in usage_tracker().query() if record.provider == "local-batch"][-1]
+        assert batch_record.requests == 5 and batch_record.wall_time >= 0.01
+
+
+def test_stuck_batch_times_out():
+    with tempfile.TemporaryDirectory() as root:
+        release = threading.Event()
+        backend = LocalBatchBackend(f"{root}/local", EchoHandler(release))
+        runner = BatchRunner(backend, batch_dir=root, poll_interval=0.01, timeout=0.2)
+        started_at = time.monotonic()
+        try:
+            runner.run([request("users", "/users")])
+            assert False, "the batch is still running"
+        except TimeoutError as e:
+            assert "in_progress" in str(e)
+        assert time.monotonic() - started_at < 1.0
+        # The batch is cancelled, not left running for nobody
+        batch_id = os.listdir(backend.root)[0]
+        assert backend.status(batch_id) == "cancelled"
+        release.set()
+        backend.threads[batch_id].join()
+        assert backend.status(batch_id) == "cancelled"
+        assert backend.results(batch_id) == []
+
+
+class BrokenBackend(BatchBackend):
+    provider = "broken"
+
+    def __init__(self, status: str = None):
+        self.final_status = status
+
+    def submit(self, input_path: str) -> str:
+        if self.final_status is None:
+            raise ConnectionError("HTTP 503 from the batch endpoint")
+        return "batch_1"
+
+    def status(self, batch_id: str) -> str:
+        return self.final_status
+
+    def results(self, batch_id: str):
+        return []
+
+    def cancel(self, batch_id: str):
+        pass
+
+
+def test_failed_batches_raise():
+    with tempfile.TemporaryDirectory() as root:
+        for backend in (BrokenBackend(), BrokenBackend("failed"), BrokenBackend("expired")):
+            try:
+                BatchRunner(backend, batch_dir=root, poll_interval=0.01).run([request("users", "/users")])
+                assert False, "a batch that did not complete is an error"
+            except BatchError:
+                pass
+
+
+class Agent:
+    role = "Spec extractor"
+    goal = "Extract {endpoints_list}"
+    backstory = "You read Go services"
+
+
+class Task:
+    agent = Agent()
+    description = "Source:\n{source_code}\nEndpoints: {endpoints_list}"
+    expected_output = "JSON like {example_output}"
+    output_json = Answer
+
+
+def test_task_request_interpolates_inputs():
+    batch_request = task_request("0-0", Task(), {"source_code": "package main", "endpoints_list": "/users", "example_output": "{}"}, "gpt-4o-mini")
+    assert batch_request.user_prompt.startswith("Source:\npackage main\nEndpoints: /users")
+    assert "JSON like {}" in batch_request.user_prompt
+    line = batch_request.line()
+    assert line["body"]["response_format"]["json_schema"]["name"] == "Answer"
+    assert [message["role"] for message in line["body"]["messages"]] == ["system", "user"]
+
+
+if __name__ == "__main__":
+    test_local_batch_round_trip()
+    test_stuck_batch_times_out()
+    test_failed_batches_raise()
+    test_task_request_interpolates_inputs()
+    print("All batch runner tests passed")
@@ -0,0 +1,161 @@
+import tempfile
+from typing import Optional
+from pydantic import BaseModel
+
+from core.llm_handlers.interface import LLMInterface
+from core.llm_handlers.context import Stage
+from core.llm_handlers.cache import CachedLLMHandler, SQLiteCacheBackend
+from core.llm_handlers.coalesce import CoalescingLLMHandler, SingleFlight
+from core.llm_handlers.scheduler import ScheduledLLMHandler, LLMScheduler
+from core.llm_handlers.hedge import CircuitBreaker, Hedger, HedgedLLMHandler
+from core.llm_handlers.cascade import CascadeLLMHandler, CascadeStats, field_coverage, kickoff_cascade, cascade_stats
+
+
+class Spec(BaseModel):
+    service: str
+    endpoints: list = []
+    consumers: list = []
+    notes: Optional[str] = None
+
+
+FULL = Spec(service="users", endpoints=["/users"], consumers=["orders"], notes="v1")
+HALF = Spec(service="users", endpoints=["/users"])
+SPARSE = Spec(service="users")
+
+
+class ModelHandler(LLMInterface):
+    """Answers per model: a Spec, or an exception to raise."""
+
+    def __init__(self, answers: dict):
+        self.answers = answers
+        self.models = []
+
+    def generate_text(self, system_prompt: str, user_prompt: str, model_name: str, max_tokens: int = -1) -> str:
+        self.models.append(model_name)
+        return model_name
+
+    def generate_json(self, system_prompt: str, user_prompt: str, json_schema: BaseModel, model_name: str, max_tokens: int = -1) -> BaseModel:
+        self.models.append(model_name)
+        answer = self.answers[model_name]
+        if isinstance(answer, Exception):
+            raise answer
+        return answer
+
+
+def test_field_coverage():
+    assert field_coverage(FULL) == 1.0
+    assert field_coverage(HALF) == 0.5
+    assert field_coverage(SPARSE) == 0.25
+
+
+def test_escalates_in_order_until_an_answer_is_confident():
+    handler = ModelHandler({"small": ValueError("not JSON"), "medium": SPARSE, "large": FULL, "xl": FULL})
+    stats = CascadeStats()
+    cascade = CascadeLLMHandler(handler, stats=stats)
+    assert cascade.generate_json("system", "user", Spec, ["small", "medium", "large", "xl"]) == FULL
+    assert handler.models == ["small", "medium", "large"]
+    summary = stats.stats()
+    assert (summary["calls"], summary["escalations"]) == (1, 1)
+    assert summary["failure_reasons"] == {"invalid": 1, "low_confidence": 1}
+    # Free text has nothing to validate and goes to the cheapest model
+    assert cascade.generate_text("system", "user", ["small", "large"]) == "small"
+
+
+def test_low_confidence_threshold():
+    handler = ModelHandler({"small": HALF, "large": FULL})
+    # Exactly at the threshold is confident enough
+    assert CascadeLLMHandler(handler, min_confidence=0.5, stats=CascadeStats()).generate_json("system", "user", Spec, ["small", "large"]) == HALF
+    assert CascadeLLMHandler(handler, min_confidence=0.75, stats=CascadeStats()).generate_json("system", "user", Spec, ["small", "large"]) == FULL
+    assert handler.models == ["small", "small", "large"]
+
+
+def test_falls_back_to_the_last_valid_answer_or_error():
+    handler = ModelHandler({"small": SPARSE, "large": ValueError("truncated")})
+    assert CascadeLLMHandler(handler, stats=CascadeStats()).generate_json("system", "user", Spec, ["small", "large"]) == SPARSE
+    handler = ModelHandler({"small": ValueError("not JSON"), "large": ValueError("truncated")})
+    try:
+        CascadeLLMHandler(handler, stats=CascadeStats()).generate_json("system", "user", Spec, ["small", "large"])
+        assert False, "the last validation error is raised when no model answered"
+    except ValueError as e:
+        assert str(e) == "truncated"
+
+
+def test_stats_walk_every_layer():
+    with tempfile.TemporaryDirectory() as root:
+        hedged = HedgedLLMHandler(ModelHandler({}), ModelHandler({}), Hedger(CircuitBreaker("primary"), CircuitBreaker("secondary")))
+        handler = CachedLLMHandler(
+            CoalescingLLMHandler(ScheduledLLMHandler(hedged, LLMScheduler()), "openai", SingleFlight()),
+            "openai",
+            SQLiteCacheBackend(f"{root}/cache.db"),
+        )
+        stats = CascadeLLMHandler(handler, stats=CascadeStats()).stats()
+        assert sorted(stats) == ["cache", "cascade", "coalescing", "hedging", "scheduler"]
+        assert stats["cascade"]["calls"] == 0
+
+
+class Agent:
+    role = "Spec extractor"
+    goal = "Extract the API specification"
+    backstory = "You read Go services"
+
+    def __init__(self):
+        self.llm = type("LLM", (), {"model": "configured"})()
+
+
+class Task:
+    description = "Extract {repo}"
+    expected_output = "A JSON spec"
+    output_json = Spec
+
+    def __init__(self, agent: Agent):
+        self.agent = agent
+
+
+class Crew:
+    """Just enough of a crewai Crew: kickoff answers with outputs[model], raising it when it is an exception."""
+
+    def __init__(self, outputs: dict):
+        self.agents = [Agent()]
+        self.tasks = [Task(self.agents[0])]
+        self.outputs = outputs
+        self.models = []
+
+    def kickoff(self, inputs: dict):
+        model = self.agents[0].llm.model
+        self.models.append(model)
+        output = self.outputs[model]
+        if isinstance(output, Exception):
+            raise output
+        return type("CrewOutput", (), {"json": output, "token_usage": None})()
+
+
+def test_kickoff_cascade_escalates_and_restores_the_crew():
+    crew = Crew({"gpt-4o-mini": "not json", "gpt-4o": SPARSE.model_dump_json(), "o1": FULL.model_dump_json()})
+    configured = crew.agents[0].llm
+    before = cascade_stats().stats()["escalations"]
+    assert kickoff_cascade(crew, {"repo": "acme/users"}, Stage.SPEC_EXTRACTION, models=["gpt-4o-mini", "gpt-4o", "o1"]) == FULL.model_dump_json()
+    assert crew.models == ["gpt-4o-mini", "gpt-4o", "o1"]
+    assert crew.agents[0].llm is configured
+    assert cascade_stats().stats()["escalations"] == before + 1
+
+
+def test_kickoff_cascade_restores_the_crew_after_an_error():
+    crew = Crew({"gpt-4o-mini": SPARSE.model_dump_json(), "gpt-4o": RuntimeError("provider down")})
+    configured = crew.agents[0].llm
+    try:
+        kickoff_cascade(crew, {"repo": "acme/orders"}, Stage.SPEC_EXTRACTION, models=["gpt-4o-mini", "gpt-4o"])
+        assert False, "errors other than invalid output propagate"
+    except RuntimeError:
+        pass
+    assert crew.agents[0].llm is configured
+
+
+if __name__ == "__main__":
+    test_field_coverage()
+    test_escalates_in_order_until_an_answer_is_confident()
+    test_low_confidence_threshold()
+    test_falls_back_to_the_last_valid_answer_or_error()
+    test_stats_walk_every_layer()
+    test_kickoff_cascade_escalates_and_restores_the_crew()
+    test_kickoff_cascade_restores_the_crew_after_an_error()
+    print("All cascade tests passed")
@@ -0,0 +1,103 @@
+from core.llm_handlers.budget import ContextBudget, file_tokens
+from central_system.onboarding.agent_output_model import (
+    Branch, ConsumedEndpoint, ExposedEndpoint, Method, OnboardingDataModel, SpecExtractionOutput, Specification,
+)
+
+FILES = {
+    "main.go": "package main\n\nfunc main() { routes() }\n",
+    "api/users.go": "package api\n\n// users handlers\nfunc GetUser() {}\n" * 20,
+    "billing/invoice.go": "package billing\n\nfunc Total() int { return 0 }\n" * 20,
+    "setup_test.go": "package main\n\nfunc TestSetup() {}\n" * 20,
+}
+
+
+def budget_for(files: dict, extra: int = 0) -> ContextBudget:
+    """A budget whose window holds exactly the tokens of files plus extra, with nothing reserved and no sections."""
+    return ContextBudget(sum(file_tokens(path, content) for path, content in files.items()) + extra, reserved_tokens=0)
+
+
+def test_everything_fits():
+    assert ContextBudget(100000).plan(FILES, {"task": "Extract the endpoints"}) == [FILES]
+    assert ContextBudget(100000).fit(FILES, {}) is FILES
+
+
+def test_fit_keeps_the_most_relevant_files():
+    budget = budget_for({path: FILES[path] for path in ("main.go", "api/users.go")})
+    kept = budget.fit(FILES, {}, keywords=["users"])
+    assert list(kept) == ["main.go", "api/users.go"]
+
+
+def test_plan_sends_relevant_files_when_they_fit():
+    budget = budget_for({path: FILES[path] for path in ("main.go", "api/users.go")})
+    # Only the entry point and the users handlers score above zero, the rest is dropped rather than chunked
+    assert budget.plan(FILES, {}, keywords=["users"]) == [{"main.go": FILES["main.go"], "api/users.go": FILES["api/users.go"]}]
+
+
+def test_plan_chunks_when_relevant_files_overflow():
+    budget = budget_for({"api/users.go": FILES["api/users.go"]}, extra=5)
+    chunks = budget.plan(FILES, {}, keywords=["users"])
+    assert len(chunks) > 1
+    # Every file is in some chunk, the most relevant first, and every chunk fits
+    assert sorted(path for chunk in chunks for path in chunk) == sorted(FILES)
+    assert list(chunks[0]) == ["api/users.go"]
+    assert all(sum(file_tokens(path, content) for path, content in chunk.items()) <= budget.max_tokens for chunk in chunks)
+
+
+def test_oversized_file_is_split_by_lines():
+    content = "".join(f"line {index}\n" for index in range(400))
+    budget = ContextBudget(file_tokens("big.go", content) // 3, reserved_tokens=0)
+    chunks = budget.chunk_files({"big.go": content}, budget.max_tokens)
+    paths = [path for chunk in chunks for path in chunk]
+    assert len(paths) >= 3 and paths[0] == f"big.go (part 1/{len(paths)})"
+    assert "".join(part for chunk in chunks for part in chunk.values()) == content
+
+
+def test_sections_shrink_the_budget():
+    budget = ContextBudget(1000, reserved_tokens=200)
+    assert budget.available({}) == 800
+    assert budget.available({"task": "word " * 4000}) == 0
+
+
+def onboarding(exposed, consumed, swagger=False, port="", project=""):
+    branch = Branch(project_name=project, guid="", description="", jira_instance_url="", jira_project_key="")
+    return OnboardingDataModel(
+        exposed_endpoints=exposed, consumed_endpoints=consumed, is_swagger_supported=swagger, swagger_endpoint="",
+        repository=branch, branch=branch, port=port, communication_protocol="http", is_tls_supported=False,
+    )
+
+
+def test_onboarding_parts_merge():
+    get, post = Method(method="GET", description="read"), Method(method="POST", description="create")
+    payments = ConsumedEndpoint(endpoint="/payments", methods=[post], port_config="static", port=8082)
+    first = onboarding([ExposedEndpoint(endpoint="/users", methods=[get])], [payments])
+    second = onboarding(
+        [ExposedEndpoint(endpoint="/users", methods=[get, post]), ExposedEndpoint(endpoint="/orders", methods=[get])],
+        [payments.model_copy(update={"methods": [post, get]})],
+        swagger=True, port="8080", project="user-manager",
+    )
+    merged = OnboardingDataModel.merge([first, second])
+    assert [(endpoint.endpoint, [method.method for method in endpoint.methods]) for endpoint in merged.exposed_endpoints] == [
+        ("/users", ["GET", "POST"]), ("/orders", ["GET"]),
+    ]
+    assert [method.method for method in merged.consumed_endpoints[0].methods] == ["POST", "GET"]
+    assert (merged.port, merged.repository.project_name, merged.is_swagger_supported) == ("8080", "user-manager", True)
+
+
+def test_specifications_merge_keeps_the_most_detailed():
+    brief = Specification(path="/users", method="GET")
+    detailed = Specification(path="/users", method="GET", summary="List users", responses={"200": {}})
+    other = Specification(path="/users", method="POST", summary="Create a user")
+    merged = SpecExtractionOutput.merge([SpecExtractionOutput(endpoints=[brief, other]), SpecExtractionOutput(endpoints=[detailed])])
+    assert merged.endpoints == [detailed, other]
+
+
+if __name__ == "__main__":
+    test_everything_fits()
+    test_fit_keeps_the_most_relevant_files()
+    test_plan_sends_relevant_files_when_they_fit()
+    test_plan_chunks_when_relevant_files_overflow()
+    test_oversized_file_is_split_by_lines()
+    test_sections_shrink_the_budget()
+    test_onboarding_parts_merge()
+    test_specifications_merge_keeps_the_most_detailed()
+    print("All context budget tests passed")
@@ -0,0 +1,102 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from pydantic import BaseModel
+
+from core.llm_handlers.continuation import stitch, strip_fence, CONTINUE_PROMPT
+from core.llm_handlers.openai_handler import OpenAIHandler
+
+
+class Answer(BaseModel):
+    value: str
+
+
+def test_strip_fence():
+    assert strip_fence('```json\n{"value": "ok"}\n```') == '{"value": "ok"}'
+    assert strip_fence('```\n{"value": "ok"}```') == '{"value": "ok"}'
+    assert strip_fence('  {"value": "ok"}\n') == '{"value": "ok"}'
+    assert strip_fence('Here is the JSON:\n```json\n{"value": "ok"}\n```') == '{"value": "ok"}'
+    assert strip_fence('{"value": "```"}') == '{"value": "```"}'
+
+
+def test_stitch_appends_continuation():
+    assert stitch('{"value": "o', 'k"}') == '{"value": "ok"}'
+
+
+def test_stitch_drops_reopened_fence_and_repeated_tail():
+    assert stitch('```json\n{"value": "a long', '```json\n{"value": "a long answer"}') == '```json\n{"value": "a long answer"}'
+    assert stitch('{"value": "a long answer', 'a long answer that goes on"}') == '{"value": "a long answer that goes on"}'
+    # Overlaps shorter than 8 characters are taken as coincidence
+    assert stitch('{"value": "', '"}') == '{"value": ""}'
+
+
+class OpenAI(BaseHTTPRequestHandler):
+    """Chat completions cut off at max_tokens until `parts` is used up, each request answered with the next part."""
+
+    parts = []
+    bodies = []
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["content-length"])))
+        OpenAI.bodies.append(body)
+        content, finish_reason = OpenAI.parts[min(len(OpenAI.bodies), len(OpenAI.parts)) - 1]
+        completion = {
+            "id": "chatcmpl-1", "object": "chat.completion", "created": 0, "model": body["model"],
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": finish_reason, "logprobs": None}],
+            "usage": {"prompt_tokens": 10, "completion_tokens": 5, "total_tokens": 15},
+        }
+        payload = json.dumps(completion).encode()
+        self.send_response(200)
+        self.send_header("content-type", "application/json")
+        self.send_header("content-length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+def serve(parts: list):
+    OpenAI.parts = parts
+    OpenAI.bodies = []
+    server = ThreadingHTTPServer(("127.0.0.1", 0), OpenAI)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, OpenAIHandler("sk-test", base_url=f"http://127.0.0.1:{server.server_port}/v1")
+
+
+def test_truncated_structured_answer_is_continued():
+    server, handler = serve([('{"value": "o', "length"), ('k"}', "stop")])
+    try:
+        assert handler.generate_json("system", "user", Answer, "gpt-4o-mini", max_tokens=5) == Answer(value="ok")
+        assert len(OpenAI.bodies) == 2
+        # The partial answer goes back as the assistant turn, the prompt is not re-run
+        messages = OpenAI.bodies[1]["messages"]
+        assert messages[2] == {"role": "assistant", "content": '{"value": "o'}
+        assert messages[3] == {"role": "user", "content": CONTINUE_PROMPT}
+        assert "response_format" not in OpenAI.bodies[1]
+    finally:
+        server.shutdown()
+
+
+def test_continuations_are_bounded_then_retried_once():
+    server, handler = serve([('{"value": "o', "length")])
+    try:
+        try:
+            handler.generate_json("system", "user", Answer, "gpt-4o-mini", max_tokens=5)
+            assert False, "an answer that never finishes is an error"
+        except ValueError:
+            pass
+        # Two rounds of the first call and LLM_MAX_CONTINUATIONS (3) continuations each
+        assert len(OpenAI.bodies) == 8
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    test_strip_fence()
+    test_stitch_appends_continuation()
+    test_stitch_drops_reopened_fence_and_repeated_tail()
+    test_truncated_structured_answer_is_continued()
+    test_continuations_are_bounded_then_retried_once()
+    print("All continuation tests passed")
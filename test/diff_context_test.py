@@ -0,0 +1,51 @@
+from detection_engine.github.context import DiffContextBuilder, parse_diff
+
+FILES = {
+    "main.go": 'package main\n\nfunc main() {\n\tapp := fiber.New()\n\tapp.Get("/users/:id", handlers.GetUser)\n}\n',
+    "handlers/user.go": "package handlers\n\nfunc GetUser(c *fiber.Ctx) error {\n\treturn c.JSON(model.UserResponse{})\n}\n",
+    "model/userapi.go": "package model\n\ntype UserResponse struct {\n\tID uint `json:\"user_id\"`\n\tAddress Address\n}\n",
+    "model/address.go": "package model\n\ntype Address struct {\n\tCity string\n}\n",
+    "billing/invoice.go": "package billing\n\ntype Invoice struct {\n\tTotal int\n}\n",
+}
+
+DIFF = """diff --git a/handlers/user.go b/handlers/user.go
+index 70782a5..d4d172c 100644
+--- a/handlers/user.go
++++ b/handlers/user.go
+@@ -3,3 +3,3 @@ package handlers
+ func GetUser(c *fiber.Ctx) error {
+-\treturn c.JSON(model.UserResponse{})
++\treturn c.Status(200).JSON(model.UserResponse{})
+ }
+"""
+
+
+def test_parse_diff():
+    files = parse_diff(DIFF)
+    assert [file.path for file in files] == ["handlers/user.go"]
+    hunk = files[0].hunks[0]
+    assert (hunk.old_start, hunk.old_count, hunk.new_start, hunk.new_count) == (3, 3, 3, 3)
+    assert len(hunk.changed_lines()) == 2
+
+
+def test_scoped_to_touched_referenced_and_route_files():
+    scoped = DiffContextBuilder(depth=1).build(FILES, DIFF)
+    assert set(scoped) == {"handlers/user.go", "model/userapi.go", "main.go"}
+
+
+def test_references_followed_to_depth():
+    scoped = DiffContextBuilder(depth=2).build(FILES, DIFF)
+    assert "model/address.go" in scoped
+    assert "billing/invoice.go" not in scoped
+
+
+def test_full_tree_without_diff():
+    assert DiffContextBuilder().build(FILES, "") is FILES
+
+
+if __name__ == "__main__":
+    test_parse_diff()
+    test_scoped_to_touched_referenced_and_route_files()
+    test_references_followed_to_depth()
+    test_full_tree_without_diff()
+    print("All diff context tests passed")
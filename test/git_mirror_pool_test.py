@@ -0,0 +1,89 @@
+import os
+import tempfile
+
+import git
+
+from adaptutils.mirrors import GitMirrorPool
+from adaptutils.githubutils import GitHubApp
+
+os.environ.setdefault("GIT_AUTHOR_NAME", "ADAPT")
+os.environ.setdefault("GIT_AUTHOR_EMAIL", "adapt@example.com")
+os.environ.setdefault("GIT_COMMITTER_NAME", "ADAPT")
+os.environ.setdefault("GIT_COMMITTER_EMAIL", "adapt@example.com")
+
+
+def make_origin(root: str, owner: str, repo: str) -> git.Repo:
+    """A bare repository at root/owner/repo.git with one commit on master."""
+    origin = git.Repo.init(os.path.join(root, owner, f"{repo}.git"), bare=True)
+    seed = git.Repo.init(os.path.join(root, "seed", repo))
+    with open(os.path.join(seed.working_tree_dir, "main.go"), "w") as file:
+        file.write("package main\n")
+    seed.index.add(["main.go"])
+    seed.index.commit("Initial commit")
+    seed.git.push(origin.git_dir, "HEAD:refs/heads/master")
+    return seed
+
+
+def pool(root: str, max_bytes: int = 0) -> GitMirrorPool:
+    return GitMirrorPool(os.path.join(root, "pool"), max_bytes, url_template="file://" + os.path.join(root, "{owner}", "{repo}.git"))
+
+
+def test_worktree_follows_base_branch():
+    with tempfile.TemporaryDirectory() as root:
+        seed = make_origin(root, "acme", "orders")
+        mirrors = pool(root)
+        with mirrors.worktree("acme", "orders", "master", "feature/a") as repo:
+            assert repo.active_branch.name == "feature/a"
+            assert os.path.exists(os.path.join(repo.working_tree_dir, "main.go"))
+            worktree_dir = repo.working_tree_dir
+        assert not os.path.exists(worktree_dir)
+
+        # A new commit on the remote is fetched into the existing mirror, not cloned again
+        with open(os.path.join(seed.working_tree_dir, "client.go"), "w") as file:
+            file.write("package main\n")
+        seed.index.add(["client.go"])
+        seed.index.commit("Add client")
+        seed.git.push(os.path.join(root, "acme", "orders.git"), "HEAD:refs/heads/master")
+        with mirrors.worktree("acme", "orders", "master", "feature/b") as repo:
+            assert os.path.exists(os.path.join(repo.working_tree_dir, "client.go"))
+        assert mirrors.stats()["clones"] == 1
+        assert mirrors.stats()["fetches"] == 1
+
+
+def test_diff_is_committed_and_pushed():
+    with tempfile.TemporaryDirectory() as root:
+        make_origin(root, "acme", "orders")
+        app = GitHubApp(auth_token=None, mirrors=pool(root))
+        diff = "diff --git a/main.go b/main.go\n--- a/main.go\n+++ b/main.go\n@@ -1 +1,2 @@\n package main\n+// updated\n"
+        with tempfile.TemporaryDirectory() as temp_dir, app.mirrors.worktree("acme", "orders", "master", "feature/update") as repo:
+            diff_file = os.path.join(temp_dir, "pr.diff")
+            with open(diff_file, "w") as file:
+                file.write(diff)
+            app.apply_diff(repo, diff_file)
+            app.commit(repo, "Update main")
+            app.push(repo, "feature/update")
+
+        origin = git.Repo(os.path.join(root, "acme", "orders.git"))
+        assert "// updated" in origin.git.show("feature/update:main.go")
+
+
+def test_idle_mirrors_are_evicted():
+    with tempfile.TemporaryDirectory() as root:
+        make_origin(root, "acme", "orders")
+        make_origin(root, "acme", "users")
+        mirrors = pool(root, max_bytes=1)
+        with mirrors.worktree("acme", "users", "master", "feature/a"):
+            with mirrors.worktree("acme", "orders", "master", "feature/a"):
+                pass
+            # Over the limit the idle mirror goes, the one in use stays
+            assert not os.path.isdir(mirrors.mirror_path("acme", "orders"))
+            assert os.path.isdir(mirrors.mirror_path("acme", "users"))
+        assert mirrors.stats()["evictions"] == 2
+        assert mirrors.stats()["mirrors"] == 0
+
+
+if __name__ == "__main__":
+    test_worktree_follows_base_branch()
+    test_diff_is_committed_and_pushed()
+    test_idle_mirrors_are_evicted()
+    print("All git mirror pool tests passed")
@@ -0,0 +1,75 @@
+import json
+import time
+import tempfile
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from core.llm_handlers.cache import FileCacheBackend
+from adaptutils.githubutils import GitHubApp, GitHubHTTP, HandleCache
+
+PULL = "https://api.github.com/repos/acme/orders/pulls/7"
+
+
+def pull(head_sha: str) -> dict:
+    return {
+        "number": 7,
+        "url": PULL,
+        "diff_url": "https://github.com/acme/orders/pull/7.diff",
+        "head": {"ref": "feature/a", "sha": head_sha},
+        "base": {"ref": "master", "sha": "0" * 40},
+    }
+
+
+class GitHub:
+    """Answers GETs from canned JSON bodies and counts the calls."""
+
+    def __init__(self, routes: dict):
+        self.routes = routes
+        self.calls = []
+
+    def get(self, url: str, headers: dict = None) -> requests.Response:
+        self.calls.append(url)
+        response = requests.Response()
+        response.url = url
+        response.status_code = 200 if url in self.routes else 404
+        response.headers = CaseInsensitiveDict()
+        response._content = json.dumps(self.routes.get(url, {})).encode()
+        return response
+
+
+def app(root: str, handles: HandleCache) -> GitHubApp:
+    http = GitHubHTTP()
+    http.session = GitHub({PULL: pull("1" * 40)})
+    return GitHubApp(auth_token=None, snapshot_cache=FileCacheBackend(root), http=http, handles=handles)
+
+
+def test_handles_expire_after_ttl():
+    handles = HandleCache(0.05)
+    loads = []
+    load = lambda: loads.append(1) or len(loads)
+    assert handles.get(("pr", 1), load) == 1
+    assert handles.get(("pr", 1), load) == 1
+    time.sleep(0.1)
+    assert handles.get(("pr", 1), load) == 2
+    assert handles.stats() == {"entries": 1, "hits": 1, "misses": 2}
+
+
+def test_pr_is_fetched_again_when_its_head_moved():
+    with tempfile.TemporaryDirectory() as root:
+        github = app(root, HandleCache(float("inf")))
+        pr = github.get_pr("acme", "orders", 7)
+        assert pr.head.sha == "1" * 40
+        # The head the run started from, still cached
+        assert github.get_pr("acme", "orders", 7, head_sha="1" * 40) is pr
+        assert len(github.http.session.calls) == 1
+        # A caller that knows of a newer head does not get the stale handle
+        github.http.session.routes[PULL] = pull("2" * 40)
+        assert github.get_pr("acme", "orders", 7, head_sha="2" * 40).head.sha == "2" * 40
+        assert len(github.http.session.calls) == 2
+
+
+if __name__ == "__main__":
+    test_handles_expire_after_ttl()
+    test_pr_is_fetched_again_when_its_head_moved()
+    print("All GitHub handle cache tests passed")
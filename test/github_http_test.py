@@ -0,0 +1,110 @@
+import json
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from core.llm_handlers.cache import FileCacheBackend
+from adaptutils.githubutils import GitHubHTTP
+
+ETAG = '"abc123"'
+LAST_MODIFIED = "Wed, 01 Jan 2025 00:00:00 GMT"
+
+
+class GitHub(BaseHTTPRequestHandler):
+    """Serves one PR document with validators and answers matching conditional requests with 304."""
+
+    requests = []
+
+    def do_GET(self):
+        GitHub.requests.append(dict(self.headers))
+        if self.path == "/plain":
+            self.reply(200, b"no validators", {})
+        elif self.headers.get("If-None-Match") == ETAG:
+            self.reply(304, b"", {"ETag": ETAG})
+        else:
+            self.reply(200, json.dumps({"number": 7}).encode(), {"ETag": ETAG, "Last-Modified": LAST_MODIFIED})
+
+    def reply(self, status: int, payload: bytes, headers: dict):
+        self.send_response(status)
+        headers = {
+            "X-RateLimit-Limit": "5000",
+            "X-RateLimit-Remaining": str(5000 - len(GitHub.requests)),
+            "X-RateLimit-Used": str(len(GitHub.requests)),
+            "X-RateLimit-Reset": "1700000000",
+            "X-RateLimit-Resource": "core",
+            **headers,
+        }
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("content-length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_github() -> HTTPServer:
+    GitHub.requests = []
+    server = HTTPServer(("127.0.0.1", 0), GitHub)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def test_unchanged_document_is_served_from_cache():
+    server = start_github()
+    try:
+        with tempfile.TemporaryDirectory() as root:
+            http = GitHubHTTP(FileCacheBackend(root))
+            url = f"http://127.0.0.1:{server.server_port}/repos/acme/orders/pulls/7"
+            first = http.get(url, headers={"Accept": "application/vnd.github+json"}, kind="pulls.get")
+            assert first.json() == {"number": 7} and not first.from_cache
+            assert "If-None-Match" not in GitHub.requests[0]
+
+            second = http.get(url, headers={"Accept": "application/vnd.github+json"}, kind="pulls.get")
+            assert GitHub.requests[1]["If-None-Match"] == ETAG
+            assert GitHub.requests[1]["If-Modified-Since"] == LAST_MODIFIED
+            assert (second.status_code, second.from_cache, second.json()) == (200, True, {"number": 7})
+
+            # Another media type of the same URL is another document
+            http.get(url, headers={"Accept": "application/vnd.github.v3.diff"}, kind="pulls.diff")
+            assert "If-None-Match" not in GitHub.requests[2]
+
+            stats = http.stats()
+            assert (stats["requests"], stats["not_modified"]) == (3, 1)
+            assert stats["calls"] == {"pulls.get": 2, "pulls.diff": 1}
+    finally:
+        server.shutdown()
+
+
+def test_responses_without_validators_are_not_stored():
+    server = start_github()
+    try:
+        with tempfile.TemporaryDirectory() as root:
+            http = GitHubHTTP(FileCacheBackend(root))
+            url = f"http://127.0.0.1:{server.server_port}/plain"
+            http.get(url)
+            http.get(url)
+            assert "If-None-Match" not in GitHub.requests[1]
+            assert http.stats()["not_modified"] == 0
+    finally:
+        server.shutdown()
+
+
+def test_rate_limit_headers_are_kept():
+    server = start_github()
+    try:
+        http = GitHubHTTP()
+        assert http.rate_limit() is None
+        http.get(f"http://127.0.0.1:{server.server_port}/repos/acme/orders/pulls/7")
+        assert http.rate_limit() == {"limit": 5000, "remaining": 4999, "used": 1, "reset": 1700000000}
+        assert http.rate_limit("search") is None
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    test_unchanged_document_is_served_from_cache()
+    test_responses_without_validators_are_not_stored()
+    test_rate_limit_headers_are_kept()
+    print("All GitHub HTTP tests passed")
@@ -0,0 +1,203 @@
+import io
+import os
+import json
+import tempfile
+import zipfile
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from core.llm_handlers.cache import FileCacheBackend
+from adaptutils.githubutils import GitHubApp, GitHubHTTP, snapshot_key, blob_key
+
+BASE = "1" * 40
+HEAD = "2" * 40
+
+
+def zipball(files: dict) -> bytes:
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, "w") as z:
+        for path, content in files.items():
+            z.writestr(f"acme-orders-{BASE[:7]}/{path}", content)
+    return archive.getvalue()
+
+
+def response(url: str, status_code: int = 200, body: bytes = b"") -> requests.Response:
+    result = requests.Response()
+    result.url = url
+    result.status_code = status_code
+    result.headers = CaseInsensitiveDict()
+    result._content = body
+    result._content_consumed = True
+    return result
+
+
+class GitHub:
+    """Answers the few REST endpoints snapshots use from canned bodies and counts the calls."""
+
+    def __init__(self, routes: dict):
+        self.routes = routes
+        self.calls = []
+
+    def get(self, url: str, headers: dict = None, stream: bool = False) -> requests.Response:
+        self.calls.append(url)
+        for prefix, body in self.routes.items():
+            if url.startswith(prefix):
+                return response(url, body=body if isinstance(body, bytes) else json.dumps(body).encode())
+        return response(url, status_code=404)
+
+
+def app(root: str, routes: dict) -> GitHubApp:
+    http = GitHubHTTP()
+    http.session = GitHub(routes)
+    return GitHubApp(auth_token=None, snapshot_cache=FileCacheBackend(root), http=http)
+
+
+def files(github: GitHubApp, sha: str = BASE) -> dict:
+    return dict(github.iter_branch_files("acme", "orders", "master", [".go"], sha=sha))
+
+
+SOURCE = {"main.go": "package main\n", "api/routes.go": "package api\n", "README.md": "# Orders\n"}
+ZIPBALL = "https://api.github.com/repos/acme/orders/zipball/"
+
+
+def test_snapshot_is_cached_per_file():
+    with tempfile.TemporaryDirectory() as root:
+        github = app(root, {ZIPBALL: zipball(SOURCE)})
+        assert files(github) == {"main.go": "package main\n", "api/routes.go": "package api\n"}
+        assert files(github) == {"main.go": "package main\n", "api/routes.go": "package api\n"}
+        assert len(github.http.session.calls) == 1
+        # One entry per file, the manifest only names them
+        manifest = json.loads(github.snapshot_cache.get(snapshot_key("acme", "orders", BASE, [".go"])))
+        assert manifest["main.go"] == [blob_key("package main\n"), len("package main\n")]
+        assert github.snapshot_cache.get(blob_key("package api\n")) == "package api\n"
+
+
+def test_evicted_file_downloads_again():
+    with tempfile.TemporaryDirectory() as root:
+        github = app(root, {ZIPBALL: zipball(SOURCE)})
+        files(github)
+        os.remove(github.snapshot_cache.path(blob_key("package api\n")))
+        assert files(github) == {"main.go": "package main\n", "api/routes.go": "package api\n"}
+        assert len(github.http.session.calls) == 2
+
+
+def test_provider_snapshot_reads_files_on_access():
+    with tempfile.TemporaryDirectory() as root:
+        github = app(root, {ZIPBALL: zipball(SOURCE)})
+        # A miss downloads once and fills the cache without keeping the contents
+        snapshot = github.branch_snapshot("acme", "orders", "master", [".go"], sha=BASE)
+        assert sorted(snapshot) == ["api/routes.go", "main.go"] and snapshot.contents == {}
+        assert snapshot["main.go"] == "package main\n"
+        assert list(snapshot.contents) == ["main.go"]
+
+        # A hit only reads the manifest
+        snapshot = github.branch_snapshot("acme", "orders", "master", [".go"], sha=BASE)
+        assert snapshot.contents == {}
+        assert snapshot.as_dict() == {"main.go": "package main\n", "api/routes.go": "package api\n"}
+        assert len(github.http.session.calls) == 1
+
+
+def test_provider_snapshot_fetches_evicted_file_alone():
+    with tempfile.TemporaryDirectory() as root:
+        contents = "https://api.github.com/repos/acme/orders/contents/api/routes.go"
+        github = app(root, {ZIPBALL: zipball(SOURCE), contents: b"package api\n"})
+        files(github)
+        os.remove(github.snapshot_cache.path(blob_key("package api\n")))
+        snapshot = github.branch_snapshot("acme", "orders", "master", [".go"], sha=BASE)
+        assert snapshot["api/routes.go"] == "package api\n"
+        assert github.http.session.calls[1:] == [f"{contents}?ref={BASE}"]
+        # Stored again for the next reader
+        assert github.snapshot_cache.get(blob_key("package api\n")) == "package api\n"
+
+
+COMPARE = f"https://api.github.com/repos/acme/orders/compare/{BASE}...{HEAD}"
+CONTENTS = "https://api.github.com/repos/acme/orders/contents/"
+
+
+def updated(root: str, changed: list, contents: dict = None, status: str = "ahead") -> GitHubApp:
+    """An app that cached the snapshot at BASE and then read HEAD, with the compare API reporting changed."""
+    routes = {COMPARE: {"status": status, "files": changed}, ZIPBALL: zipball(SOURCE)}
+    routes.update({f"{CONTENTS}{path}?ref={HEAD}": content for path, content in (contents or {}).items()})
+    github = app(root, routes)
+    files(github, BASE)
+    github.head = files(github, HEAD)
+    return github
+
+
+def zipballs(github: GitHubApp) -> int:
+    return sum(1 for url in github.http.session.calls if url.startswith(ZIPBALL))
+
+
+def test_update_applies_renames_and_removals():
+    with tempfile.TemporaryDirectory() as root:
+        changed = [
+            {"filename": "api/handlers.go", "previous_filename": "api/routes.go", "status": "renamed"},
+            {"filename": "main.go", "status": "removed"},
+            {"filename": "cmd/server.go", "status": "added"},
+            {"filename": "CHANGELOG.md", "status": "added"},
+        ]
+        github = updated(root, changed, {"api/handlers.go": b"package api\n", "cmd/server.go": b"package cmd\n"})
+        assert github.head == {"api/handlers.go": "package api\n", "cmd/server.go": "package cmd\n"}
+        assert zipballs(github) == 1
+        # Files the extension filter drops are not fetched
+        assert not any("CHANGELOG" in url for url in github.http.session.calls)
+        # The patched snapshot is cached under the new commit
+        assert files(github, HEAD) == github.head
+        assert zipballs(github) == 1
+
+
+def test_update_drops_changed_files_over_the_size_limit():
+    os.environ["GITHUB_ZIP_MAX_FILE_BYTES"] = "64"
+    try:
+        with tempfile.TemporaryDirectory() as root:
+            github = updated(root, [{"filename": "main.go", "status": "modified"}], {"main.go": b"package main\n" + b"// long\n" * 10})
+            assert github.head == {"api/routes.go": "package api\n"}
+            assert zipballs(github) == 1
+    finally:
+        del os.environ["GITHUB_ZIP_MAX_FILE_BYTES"]
+
+
+def test_update_falls_back_to_the_zipball():
+    one_change = [{"filename": "main.go", "status": "modified"}]
+    cases = [
+        # Force pushed, the compare is against the merge base
+        (one_change, "diverged", {}, 0),
+        (one_change, "behind", {}, 0),
+        # The compare API lists at most 300 files
+        ([{"filename": f"gen/{index}.go", "status": "added"} for index in range(300)], "ahead", {}, 0),
+        (one_change + [{"filename": "api/routes.go", "status": "modified"}], "ahead", {"GITHUB_INCREMENTAL_MAX_FILES": "1"}, 0),
+        # Only known once the added file was fetched
+        ([{"filename": "big.go", "status": "added"}], "ahead", {"GITHUB_ZIP_MAX_TOTAL_BYTES": "40"}, 1),
+    ]
+    for changed, status, env, fetched in cases:
+        os.environ.update(env)
+        try:
+            with tempfile.TemporaryDirectory() as root:
+                github = updated(root, changed, {"main.go": b"package main\n", "api/routes.go": b"package api\n", "big.go": b"package big\n" * 2}, status)
+                assert zipballs(github) == 2, (status, env)
+                assert sum(1 for url in github.http.session.calls if url.startswith(CONTENTS)) == fetched
+        finally:
+            for name in env:
+                del os.environ[name]
+
+
+def test_limits_are_part_of_the_key():
+    key = snapshot_key("acme", "orders", BASE, [".go"])
+    os.environ["GITHUB_ZIP_MAX_TOTAL_BYTES"] = "1024"
+    try:
+        assert snapshot_key("acme", "orders", BASE, [".go"]) != key
+    finally:
+        del os.environ["GITHUB_ZIP_MAX_TOTAL_BYTES"]
+
+
+if __name__ == "__main__":
+    test_snapshot_is_cached_per_file()
+    test_evicted_file_downloads_again()
+    test_provider_snapshot_reads_files_on_access()
+    test_provider_snapshot_fetches_evicted_file_alone()
+    test_update_applies_renames_and_removals()
+    test_update_drops_changed_files_over_the_size_limit()
+    test_update_falls_back_to_the_zipball()
+    test_limits_are_part_of_the_key()
+    print("All GitHub snapshot tests passed")
@@ -0,0 +1,139 @@
+import time
+import asyncio
+from pydantic import BaseModel
+
+from core.llm_handlers.interface import LLMInterface
+from core.llm_handlers.context import Stage
+from core.llm_handlers.hedge import CircuitBreaker, Hedger, HedgedLLMHandler, kickoff_hedged
+
+
+class Answer(BaseModel):
+    value: str
+
+
+class SlowHandler(LLMInterface):
+    def __init__(self, name: str, delay: float, fail: bool = False):
+        self.name = name
+        self.delay = delay
+        self.fail = fail
+        self.calls = 0
+
+    def answer(self, json_schema: BaseModel) -> BaseModel:
+        self.calls += 1
+        if self.fail:
+            raise ConnectionError(f"{self.name} is down")
+        return json_schema(value=self.name)
+
+    def generate_text(self, system_prompt: str, user_prompt: str, model_name: str, max_tokens: int = -1) -> str:
+        time.sleep(self.delay)
+        return self.answer(Answer).value
+
+    def generate_json(self, system_prompt: str, user_prompt: str, json_schema: BaseModel, model_name: str, max_tokens: int = -1) -> BaseModel:
+        time.sleep(self.delay)
+        return self.answer(json_schema)
+
+    async def agenerate_json(self, system_prompt: str, user_prompt: str, json_schema: BaseModel, model_name: str, max_tokens: int = -1) -> BaseModel:
+        await asyncio.sleep(self.delay)
+        return self.answer(json_schema)
+
+
+class Agent:
+    def __init__(self, model: str):
+        self.role = "Extractor"
+        self.llm = type("LLM", (), {"model": model})()
+
+
+class Task:
+    def __init__(self, agent: Agent):
+        self.agent = agent
+        self.output_json = Answer
+
+
+class Crew:
+    """Just enough of a crewai Crew: kickoff answers with its model's name after delay seconds."""
+
+    def __init__(self, model: str, delay: float):
+        self.agents = [Agent(model)]
+        self.tasks = [Task(self.agents[0])]
+        self.delay = delay
+        self.kickoffs = 0
+        self.copies = []
+
+    def copy(self) -> "Crew":
+        crew = Crew(self.agents[0].llm.model, self.delay)
+        self.copies.append(crew)
+        return crew
+
+    def kickoff(self, inputs: dict):
+        self.kickoffs += 1
+        model = self.agents[0].llm.model
+        time.sleep(self.delay)
+        return type("CrewOutput", (), {"json": Answer(value=model).model_dump_json(), "token_usage": None})()
+
+
+def hedged(primary: LLMInterface, secondary: LLMInterface, initial_deadline: float = 0.1) -> HedgedLLMHandler:
+    hedger = Hedger(CircuitBreaker("primary", failure_threshold=2, reset_timeout=60), CircuitBreaker("secondary"), initial_deadline=initial_deadline)
+    return HedgedLLMHandler(primary, secondary, hedger)
+
+
+def test_fast_primary_is_not_hedged():
+    secondary = SlowHandler("secondary", 0.0)
+    handler = hedged(SlowHandler("primary", 0.0), secondary)
+    assert handler.generate_json("system", "user", Answer, "model").value == "primary"
+    assert secondary.calls == 0
+
+
+def test_slow_primary_is_hedged():
+    handler = hedged(SlowHandler("primary", 1.0), SlowHandler("secondary", 0.0))
+    started_at = time.monotonic()
+    assert handler.generate_json("system", "user", Answer, "model").value == "secondary"
+    assert time.monotonic() - started_at < 0.5
+    assert handler.stats()["secondary_wins"] == 1
+
+
+def test_async_hedge_cancels_loser():
+    handler = hedged(SlowHandler("primary", 1.0), SlowHandler("secondary", 0.0))
+
+    async def run():
+        started_at = time.monotonic()
+        result = await handler.agenerate_json("system", "user", Answer, "model")
+        return result, time.monotonic() - started_at
+
+    result, elapsed = asyncio.run(run())
+    assert result.value == "secondary"
+    assert elapsed < 0.5
+
+
+def test_breaker_routes_around_failing_primary():
+    primary = SlowHandler("primary", 0.0, fail=True)
+    handler = hedged(primary, SlowHandler("secondary", 0.0))
+    for _ in range(3):
+        assert handler.generate_json("system", "user", Answer, "model").value == "secondary"
+    # Two failures open the breaker, the third call goes straight to the secondary
+    assert primary.calls == 2
+    assert handler.stats()["breakers"]["primary"]["state"] == "open"
+    assert handler.stats()["routed_around"] == 1
+
+
+def test_hedged_kickoff_leaves_the_callers_crew_alone():
+    crew = Crew("gpt-4o", 1.0)
+    hedge_crew = Crew("local-model", 0.0)
+    hedger = hedged(None, None).hedger
+    output = kickoff_hedged(crew, {}, Stage.SPEC_EXTRACTION, hedger=hedger, hedge_crew=hedge_crew)
+    assert Answer.model_validate_json(output).value == "local-model"
+    # The primary leg still runs on a copy, a cascade may swap the crew's LLMs and kick it off again right away
+    crew.agents[0].llm = Agent("gpt-4o-mini").llm
+    time.sleep(1.2)
+    assert crew.kickoffs == 0
+    assert len(crew.copies) == 1 and crew.copies[0].kickoffs == 1
+    assert crew.copies[0].agents[0].llm.model == "gpt-4o"
+    assert hedger.stats()["secondary_wins"] == 1
+
+
+if __name__ == "__main__":
+    test_fast_primary_is_not_hedged()
+    test_slow_primary_is_hedged()
+    test_async_hedge_cancels_loser()
+    test_breaker_routes_around_failing_primary()
+    test_hedged_kickoff_leaves_the_callers_crew_alone()
+    print("All hedge handler tests passed")
@@ -0,0 +1,121 @@
+import os
+import time
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from pydantic import BaseModel
+
+from core.llm_handlers.cache import SQLiteCacheBackend, FileCacheBackend
+from core.llm_handlers.coalesce import crew_request_key
+
+
+class Answer(BaseModel):
+    value: str
+
+
+def backends(root: str, max_bytes: int, ttl_seconds: float = None):
+    # A file entry carries its created_at next to the value, so it takes a little more room than a row
+    yield SQLiteCacheBackend(os.path.join(root, "cache.db"), max_bytes=max_bytes, ttl_seconds=ttl_seconds)
+    yield FileCacheBackend(os.path.join(root, "entries"), max_bytes=int(max_bytes * 1.4), ttl_seconds=ttl_seconds)
+
+
+def test_hits_and_misses_are_counted():
+    with tempfile.TemporaryDirectory() as root:
+        for cache in backends(root, 1024 * 1024):
+            assert cache.get("a") is None
+            cache.set("a", "answer")
+            assert cache.get("a") == "answer"
+            assert cache.get("a") == "answer"
+            stats = cache.stats()
+            assert (stats["hits"], stats["misses"], stats["evictions"]) == (2, 1, 0)
+            assert stats["hit_rate"] == 2 / 3
+            assert stats["size_bytes"] > 0
+
+
+def test_concurrent_lookups_are_all_counted():
+    with tempfile.TemporaryDirectory() as root:
+        for cache in backends(root, 1024 * 1024):
+            cache.set("a", "answer")
+            with ThreadPoolExecutor(max_workers=8) as executor:
+                list(executor.map(lambda index: cache.get("a" if index % 2 else "b"), range(2000)))
+            stats = cache.stats()
+            assert (stats["hits"], stats["misses"]) == (1000, 1000)
+
+
+def test_least_recently_used_entry_is_evicted():
+    with tempfile.TemporaryDirectory() as root:
+        for cache in backends(root, 250):
+            cache.set("a", "a" * 100)
+            time.sleep(0.01)
+            cache.set("b", "b" * 100)
+            time.sleep(0.01)
+            # Reading a makes b the least recently used entry
+            assert cache.get("a") is not None
+            time.sleep(0.01)
+            cache.set("c", "c" * 100)
+            assert cache.get("b") is None
+            assert cache.get("a") == "a" * 100
+            assert cache.get("c") == "c" * 100
+            assert cache.stats()["evictions"] == 1
+
+
+def test_expired_entries_are_misses():
+    with tempfile.TemporaryDirectory() as root:
+        for cache in backends(root, 1024 * 1024, ttl_seconds=0.05):
+            cache.set("a", "answer")
+            assert cache.get("a") == "answer"
+            time.sleep(0.1)
+            assert cache.get("a") is None
+            assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_overwrites_do_not_grow_the_file_total():
+    with tempfile.TemporaryDirectory() as root:
+        cache = FileCacheBackend(root, max_bytes=1024 * 1024)
+        for _ in range(10):
+            cache.set("a", "a" * 100)
+        # The running total matches what is on disk, one entry's worth
+        assert cache.total_bytes == cache.size() < 200
+        cache.set("a", "a" * 10)
+        assert cache.total_bytes == cache.size()
+        assert cache.evictions == 0
+
+
+class Agent:
+    role = "Spec extractor"
+    goal = "Extract the API specification"
+    backstory = "You read Go services"
+
+
+class Task:
+    def __init__(self, description: str, expected_output: str):
+        self.agent = Agent()
+        self.description = description
+        self.expected_output = expected_output
+        self.output_json = Answer
+
+
+class Crew:
+    def __init__(self, *tasks: Task):
+        self.agents = [Agent()]
+        self.tasks = list(tasks)
+
+
+def test_crew_key_follows_task_prompts():
+    inputs = {"repo": "acme/users"}
+    key = crew_request_key(Crew(Task("Extract {repo}", "A JSON spec")), inputs)
+    assert key == crew_request_key(Crew(Task("Extract {repo}", "A JSON spec")), inputs)
+    # Edited descriptions and expected outputs must not be answered from entries cached for the old prompt
+    assert key != crew_request_key(Crew(Task("Extract the endpoints of {repo}", "A JSON spec")), inputs)
+    assert key != crew_request_key(Crew(Task("Extract {repo}", "A JSON spec of every endpoint")), inputs)
+    assert key != crew_request_key(Crew(Task("Read {repo}", "Notes"), Task("Extract {repo}", "A JSON spec")), inputs)
+    assert key != crew_request_key(Crew(Task("Extract {repo}", "A JSON spec")), {"repo": "acme/orders"})
+
+
+if __name__ == "__main__":
+    test_hits_and_misses_are_counted()
+    test_concurrent_lookups_are_all_counted()
+    test_least_recently_used_entry_is_evicted()
+    test_expired_entries_are_misses()
+    test_overwrites_do_not_grow_the_file_total()
+    test_crew_key_follows_task_prompts()
+    print("All LLM cache tests passed")
@@ -0,0 +1,169 @@
+import os
+import json
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from core.llm_handlers.cache import SQLiteCacheBackend
+from core.llm_handlers.coalesce import SingleFlight
+from core.llm_handlers.context import Stage, llm_stage
+from core.llm_handlers.gateway import ChatGateway, UpstreamError, completion_chunks
+from core.llm_handlers.gateway_client import STAGE_HEADER, stage_base_url, stage_headers
+from core.llm_handlers.scheduler import LLMScheduler
+from core.llm_handlers.usage import usage_tracker, kickoff_with_usage
+
+COMPLETION = {
+    "id": "chatcmpl-1",
+    "created": 1700000000,
+    "model": "gpt-4o-mini",
+    "choices": [{"index": 0, "message": {"role": "assistant", "content": "{\"value\": \"ok\"}"}, "finish_reason": "stop"}],
+    "usage": {"prompt_tokens": 12, "completion_tokens": 3, "prompt_tokens_details": {"cached_tokens": 8}},
+}
+
+
+class Upstream(BaseHTTPRequestHandler):
+    requests = []
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["content-length"])))
+        Upstream.requests.append((self.path, self.headers["authorization"], body))
+        if self.headers["authorization"] != "Bearer sk-test":
+            payload, status = b'{"error": "invalid api key"}', 401
+        else:
+            payload, status = json.dumps(COMPLETION).encode(), 200
+        self.send_response(status)
+        self.send_header("content-type", "application/json")
+        self.send_header("content-length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_upstream() -> HTTPServer:
+    server = HTTPServer(("127.0.0.1", 0), Upstream)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def gateway(server: HTTPServer, api_key: str, cache=None) -> ChatGateway:
+    return ChatGateway(f"http://127.0.0.1:{server.server_port}/v1/", api_key, cache, LLMScheduler(), SingleFlight())
+
+
+def body(**fields) -> dict:
+    return {"model": "gpt-4o-mini", "messages": [{"role": "user", "content": "Extract the spec"}], **fields}
+
+
+def test_key_ignores_delivery_fields():
+    chat = ChatGateway("http://upstream/v1", "sk-test", None, LLMScheduler(), SingleFlight())
+    assert chat.key(body()) == chat.key(body(stream=True, stream_options={"include_usage": True}, user="onboarding"))
+    assert chat.key(body()) != chat.key(body(temperature=0))
+
+
+def test_forwards_with_key_and_records_stage():
+    server = start_upstream()
+    try:
+        Upstream.requests.clear()
+        with tempfile.TemporaryDirectory() as root:
+            chat = gateway(server, "sk-test", SQLiteCacheBackend(f"{root}/cache.db"))
+            with llm_stage(Stage.PR_DETECTION):
+                assert chat.complete(body(stream=True)) == COMPLETION
+                assert chat.complete(body()) == COMPLETION
+            # The upstream sees one non-streaming call with the key, the repeat is a cache hit
+            assert len(Upstream.requests) == 1
+            path, authorization, forwarded = Upstream.requests[0]
+            assert (path, authorization) == ("/v1/chat/completions", "Bearer sk-test")
+            assert "stream" not in forwarded
+            record = usage_tracker().records[-1]
+            assert (record.provider, record.stage, record.prompt_tokens, record.cached_tokens) == ("gateway", "pr_detection", 12, 8)
+            assert chat.stats()["cache"]["hits"] == 1
+    finally:
+        server.shutdown()
+
+
+class LocalLLM:
+    model = "gpt-4o-mini"
+    base_url = None
+
+
+class Agent:
+    def __init__(self, llm):
+        self.llm = llm
+
+
+class Usage:
+    prompt_tokens = 12
+    completion_tokens = 3
+    successful_requests = 1
+
+
+class Output:
+    token_usage = Usage()
+
+
+class GatewayCrew:
+    """Stands in for a crewai Crew whose agents post their calls to the gateway."""
+
+    def __init__(self, chat: ChatGateway):
+        self.chat = chat
+        self.agents = [Agent(LocalLLM())]
+
+    def kickoff(self, inputs: dict):
+        assert self.agents[0].llm.base_url == stage_base_url("http://llm_gateway:9504", Stage.SPEC_EXTRACTION)
+        self.chat.complete(body())
+        return Output()
+
+
+def test_routed_kickoff_is_recorded_once():
+    server = start_upstream()
+    os.environ["LLM_GATEWAY_URL"] = "http://llm_gateway:9504"
+    try:
+        crew = GatewayCrew(gateway(server, "sk-test"))
+        before = len(usage_tracker().records)
+        kickoff_with_usage(crew, {}, Stage.SPEC_EXTRACTION)
+        records = list(usage_tracker().records)[before:]
+        assert [(record.provider, record.stage) for record in records] == [("gateway", "spec_extraction")]
+        assert isinstance(crew.agents[0].llm, LocalLLM)
+    finally:
+        del os.environ["LLM_GATEWAY_URL"]
+        server.shutdown()
+
+
+def test_upstream_errors_keep_their_status():
+    server = start_upstream()
+    try:
+        try:
+            gateway(server, "").complete(body())
+            assert False, "an empty key must not be answered"
+        except UpstreamError as e:
+            assert e.status_code == 401
+    finally:
+        server.shutdown()
+
+
+def test_stage_routing():
+    assert stage_headers() == {}
+    with llm_stage(Stage.SPEC_EXTRACTION):
+        assert stage_headers() == {STAGE_HEADER: "spec_extraction"}
+    assert stage_base_url("http://llm_gateway:9504", Stage.PR_PROPAGATION) == "http://llm_gateway:9504/stages/pr_propagation/v1"
+
+
+def test_completion_as_server_sent_events():
+    events = list(completion_chunks(COMPLETION))
+    assert events[-1] == "data: [DONE]\n\n"
+    assert all(event.startswith("data: ") and event.endswith("\n\n") for event in events)
+    chunk = json.loads(events[0][len("data: "):])
+    assert chunk["object"] == "chat.completion.chunk"
+    assert chunk["choices"][0]["delta"]["content"] == "{\"value\": \"ok\"}"
+    assert chunk["choices"][0]["finish_reason"] == "stop"
+
+
+if __name__ == "__main__":
+    test_key_ignores_delivery_fields()
+    test_forwards_with_key_and_records_stage()
+    test_routed_kickoff_is_recorded_once()
+    test_upstream_errors_keep_their_status()
+    test_stage_routing()
+    test_completion_as_server_sent_events()
+    print("All LLM gateway tests passed")
@@ -0,0 +1,137 @@
+import json
+import asyncio
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+from pydantic import BaseModel
+
+from core.llm_handlers.lmstudio_handler import LMStudioHandler
+
+
+class Answer(BaseModel):
+    value: str
+
+
+class LMStudio(BaseHTTPRequestHandler):
+    """A local server answering {"value": "ok"}. rejection is the 400 body it sends for requests with a response_format."""
+
+    rejection = None
+    bodies = []
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["content-length"])))
+        LMStudio.bodies.append(body)
+        if body.get("response_format") and LMStudio.rejection:
+            self.reply(400, "application/json", json.dumps({"error": LMStudio.rejection}).encode())
+        elif body.get("stream"):
+            events = [
+                {"choices": [{"index": 0, "delta": {"content": '{"value": "ok"}'}, "finish_reason": "stop"}]},
+                {"choices": [], "usage": {"prompt_tokens": 10, "completion_tokens": 5}},
+            ]
+            payload = "".join(f"data: {json.dumps(event)}\n\n" for event in events) + "data: [DONE]\n\n"
+            self.reply(200, "text/event-stream", payload.encode())
+        else:
+            completion = {
+                "id": "chatcmpl-1", "object": "chat.completion", "created": 0, "model": body["model"], "system_fingerprint": "local",
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": '{"value": "ok"}'}, "finish_reason": "stop", "logprobs": None}],
+                "usage": {"prompt_tokens": 10, "completion_tokens": 5, "total_tokens": 15},
+            }
+            self.reply(200, "application/json", json.dumps(completion).encode())
+
+    def reply(self, status: int, content_type: str, payload: bytes):
+        self.send_response(status)
+        self.send_header("content-type", content_type)
+        self.send_header("content-length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+def serve(rejection: str):
+    LMStudio.rejection = rejection
+    LMStudio.bodies = []
+    server = ThreadingHTTPServer(("127.0.0.1", 0), LMStudio)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}/v1/chat/completions"
+
+
+def test_rejected_schema_falls_back_to_free_text():
+    server, url = serve("'response_format.type' must be 'json_schema' or 'text'")
+    try:
+        handler = LMStudioHandler(url)
+        assert handler.generate_json("system", "user", Answer, "qwen").value == "ok"
+        assert not handler.structured
+        assert [bool(body.get("response_format")) for body in LMStudio.bodies] == [True, False]
+        # Later calls no longer ask for the schema
+        handler.generate_json("system", "user", Answer, "qwen")
+        assert len(LMStudio.bodies) == 3
+    finally:
+        server.shutdown()
+
+
+def test_other_bad_requests_keep_structured_output():
+    server, url = serve("Trying to keep the first 40000 tokens when context the overflows. However, the model is loaded with context length of only 32768 tokens")
+    try:
+        handler = LMStudioHandler(url)
+        try:
+            handler.generate_json("system", "user", Answer, "qwen")
+            assert False, "a context overflow is an error"
+        except requests.HTTPError as e:
+            assert e.response.status_code == 400
+        assert handler.structured
+        assert len(LMStudio.bodies) == 1
+    finally:
+        server.shutdown()
+
+
+def test_async_and_streamed_fallback():
+    server, url = serve("json_schema response_format is not supported by this model")
+    try:
+        handler = LMStudioHandler(url)
+        assert asyncio.run(handler.agenerate_json("system", "user", Answer, "qwen")).value == "ok"
+        assert not handler.structured
+
+        streaming = LMStudioHandler(url, stream=True)
+        assert streaming.generate_json("system", "user", Answer, "qwen").value == "ok"
+        assert not streaming.structured
+        assert asyncio.run(LMStudioHandler(url, stream=True).agenerate_json("system", "user", Answer, "qwen")).value == "ok"
+    finally:
+        server.shutdown()
+
+
+def test_async_clients_close_with_their_loop():
+    server, url = serve("json_schema response_format is not supported by this model")
+    try:
+        handler = LMStudioHandler(url)
+        clients = []
+
+        async def call():
+            result = await handler.agenerate_json("system", "user", Answer, "qwen")
+            clients.append(await handler.get_async_client())
+            return result
+
+        # Each asyncio.run gets a fresh client and the one of the finished loop is closed with it
+        assert asyncio.run(call()).value == "ok"
+        assert asyncio.run(call()).value == "ok"
+        assert clients[0] is not clients[1]
+        assert clients[0].is_closed and clients[1].is_closed
+
+        async def close():
+            client = await handler.get_async_client()
+            await handler.aclose()
+            return client
+
+        assert asyncio.run(close()).is_closed
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    test_rejected_schema_falls_back_to_free_text()
+    test_other_bad_requests_keep_structured_output()
+    test_async_and_streamed_fallback()
+    test_async_clients_close_with_their_loop()
+    print("All LM Studio structured output tests passed")
@@ -0,0 +1,101 @@
+import os
+import tempfile
+
+import git
+
+from adaptutils.providers import LocalGitSourceProvider, SourceProvider
+from adaptutils.mirrors import GitMirrorPool
+from adaptutils.githubutils import GitHubApp
+
+os.environ.setdefault("GIT_AUTHOR_NAME", "ADAPT")
+os.environ.setdefault("GIT_AUTHOR_EMAIL", "adapt@example.com")
+os.environ.setdefault("GIT_COMMITTER_NAME", "ADAPT")
+os.environ.setdefault("GIT_COMMITTER_EMAIL", "adapt@example.com")
+
+
+def make_fixture(root: str) -> git.Repo:
+    """acme/orders with two commits on master."""
+    repo = git.Repo.init(os.path.join(root, "acme", "orders"), initial_branch="master")
+    for path, content in {"main.go": "package main\n", "api/routes.go": "package api\n", "README.md": "# Orders\n"}.items():
+        os.makedirs(os.path.dirname(os.path.join(repo.working_tree_dir, path)), exist_ok=True)
+        with open(os.path.join(repo.working_tree_dir, path), "w") as file:
+            file.write(content)
+        repo.index.add([path])
+    repo.index.commit("Initial commit")
+    with open(os.path.join(repo.working_tree_dir, "main.go"), "w") as file:
+        file.write("package main\n\nfunc main() {}\n")
+    repo.index.add(["main.go"])
+    repo.index.commit("Add main")
+    return repo
+
+
+def test_branch_snapshot_from_disk():
+    with tempfile.TemporaryDirectory() as root:
+        fixture = make_fixture(root)
+        provider = LocalGitSourceProvider(os.path.join(root, "{owner}", "{repo}"))
+        snapshot = provider.snapshot("acme", "orders", "master", [".go"])
+        assert sorted(snapshot) == ["api/routes.go", "main.go"]
+        assert snapshot.ref == fixture.head.commit.hexsha
+        assert snapshot.contents == {}
+        assert "func main" in snapshot["main.go"]
+        assert list(snapshot.contents) == ["main.go"]
+
+
+def test_snapshot_at_sha():
+    with tempfile.TemporaryDirectory() as root:
+        fixture = make_fixture(root)
+        first = fixture.head.commit.parents[0].hexsha
+        app = GitHubApp(auth_token=None, source_provider=LocalGitSourceProvider(os.path.join(root, "{owner}", "{repo}")))
+        files = app.get_branch_files("acme", "orders", "master", [".go"], sha=first)
+        # Minified, the trailing newline goes
+        assert files["main.go"] == "package main"
+        assert "Error" not in app.get_repo_branch_source("acme", "orders", "master").render()
+
+
+def push(fixture: git.Repo, origin: str, path: str, content: str) -> str:
+    with open(os.path.join(fixture.working_tree_dir, path), "w") as file:
+        file.write(content)
+    fixture.index.add([path])
+    commit = fixture.index.commit(f"Update {path}")
+    fixture.git.push(origin, "HEAD:refs/heads/master")
+    return commit.hexsha
+
+
+def test_mirrors_are_fetched_before_reading():
+    with tempfile.TemporaryDirectory() as root:
+        fixture = make_fixture(root)
+        origin = git.Repo.init(os.path.join(root, "remotes", "acme", "orders.git"), bare=True)
+        fixture.git.push(origin.git_dir, "HEAD:refs/heads/master")
+        mirrors = GitMirrorPool(os.path.join(root, "pool"), url_template="file://" + os.path.join(root, "remotes", "{owner}", "{repo}.git"))
+        provider = LocalGitSourceProvider(mirrors=mirrors)
+        assert provider.snapshot("acme", "orders", "master", [".go"]).ref == fixture.head.commit.hexsha
+
+        # A branch read after a push sees the new commit
+        push(fixture, origin.git_dir, "client.go", "package main\n")
+        assert "client.go" in provider.snapshot("acme", "orders", "master", [".go"])
+
+        # So does a PR head SHA the mirror has not seen yet
+        head = push(fixture, origin.git_dir, "server.go", "package main\n")
+        snapshot = provider.snapshot("acme", "orders", "master", [".go"], sha=head)
+        assert snapshot.ref == head and "server.go" in snapshot
+        fetches = mirrors.stats()["fetches"]
+
+        # A commit the mirror already holds is read without a fetch
+        provider.snapshot("acme", "orders", "master", [".go"], sha=head)
+        assert mirrors.stats()["fetches"] == fetches
+
+
+def test_provider_is_abstract():
+    try:
+        SourceProvider()
+        assert False, "providers must implement snapshot"
+    except TypeError:
+        pass
+
+
+if __name__ == "__main__":
+    test_branch_snapshot_from_disk()
+    test_snapshot_at_sha()
+    test_mirrors_are_fetched_before_reading()
+    test_provider_is_abstract()
+    print("All local source provider tests passed")
@@ -0,0 +1,124 @@
+import json
+
+from adaptutils.minify import Minifier, path_matches, strip_hash_comments, strip_python_comments, strip_slash_comments
+from adaptutils.snapshot import SourceSnapshot
+
+GO_SOURCE = """// Copyright 2024 ACME
+// Licensed under the Apache License
+package main
+
+/* Handlers
+   for users */
+type User struct {
+\tID string `json:"user_id"` // primary key
+}
+
+var docs = "http://example.com // not a comment"
+"""
+
+
+def test_path_matches():
+    assert path_matches("cmd/api/vendor/lib/x.go", "vendor/*")
+    assert path_matches("users/handler_test.go", "*_test.go")
+    assert not path_matches("users/handler.go", "*_test.go")
+
+
+def test_strip_comments():
+    stripped = strip_slash_comments(GO_SOURCE)
+    assert "Copyright" not in stripped and "Handlers" not in stripped and "primary key" not in stripped
+    assert '`json:"user_id"`' in stripped
+    assert "http://example.com // not a comment" in stripped
+    assert strip_hash_comments("x = '#1'  # note\nurl: http://a#b\n") == "x = '#1'\nurl: http://a#b"
+
+
+def test_swaggo_annotations_are_kept():
+    source = """// ListUsers godoc
+// @Summary List users
+// @Param limit query int false "page size"
+// @Router /users [get]
+func ListUsers(c *gin.Context) {} // handler
+"""
+    stripped = strip_slash_comments(source)
+    assert "godoc" not in stripped
+    assert '// @Param limit query int false "page size"' in stripped
+    assert "// @Router /users [get]" in stripped
+    assert stripped.startswith("\n// @Summary List users\n")
+    assert Minifier().rewrite("users/handler.go", source).count("// @") == 3 and "handler\n" not in stripped
+
+
+PY_SOURCE = '''#!/usr/bin/env python
+def handler():  # the handler
+    """Returns 'users' # not a comment"""
+    x = "a\\"b # c"
+    return f"{x} # kept"
+'''
+
+
+def test_hash_comments_respect_strings():
+    assert strip_python_comments(PY_SOURCE) == '''#!/usr/bin/env python
+def handler():
+    """Returns 'users' # not a comment"""
+    x = "a\\"b # c"
+    return f"{x} # kept"'''
+    # Source that does not tokenize is left alone
+    assert strip_python_comments('x = """open # c\n') == 'x = """open # c\n'
+    assert strip_hash_comments('x = "a\\"b # c"  # note') == 'x = "a\\"b # c"'
+    assert strip_hash_comments('desc = """\nline # one\n"""\nport = 8080 # http') == 'desc = """\nline # one\n"""\nport = 8080'
+    assert strip_hash_comments("echo 'a\\' # note", single_quote_escapes=False) == "echo 'a\\'"
+    assert strip_hash_comments("puts 'it\\'s # here'") == "puts 'it\\'s # here'"
+    # An unclosed string means the quoting was not understood
+    assert strip_hash_comments("echo don't # keep") == "echo don't # keep"
+    assert "the handler" not in Minifier().rewrite("api/handler.py", PY_SOURCE)
+
+
+def test_minified_snapshot():
+    files = {
+        "main.go": GO_SOURCE,
+        "main_test.go": "package main\n",
+        "vendor/lib/lib.go": "package lib\n",
+        "docs/swagger.json": "{}",
+        "fixtures/users.json": json.dumps({"users": list(range(5000))}),
+        "internal/legacy.go": "package legacy\n",
+    }
+    minifier = Minifier(max_data_bytes=100)
+    snapshot = minifier.apply(SourceSnapshot.from_files(files), "acme/users", excludes=["internal/*"])
+    assert list(snapshot) == ["main.go", "fixtures/users.json"]
+    assert "4997 more items" in snapshot["fixtures/users.json"]
+    assert "Copyright" not in snapshot["main.go"]
+    report = minifier.stats()["acme/users"]
+    assert report["files_excluded"] == 4
+    assert report["tokens_saved"] > 0
+
+
+def test_specs_are_never_collapsed():
+    project = json.dumps({"endpoints": [{"path": f"/users/{index}", "method": "GET", "description": "x" * 600} for index in range(40)]})
+    openapi = "openapi: 3.0.0\npaths:\n" + "".join(
+        f"  /users/{index}:\n    get:\n      description: |\n        Returns user {index} # with its address\n" for index in range(400)
+    )
+    files = {"users.project.json": project, "api/openapi.yaml": openapi, "config/settings.json": project}
+    minifier = Minifier(max_data_bytes=1024)
+    snapshot = minifier.apply(SourceSnapshot.from_files(files), "acme/users")
+    assert len(json.loads(snapshot["users.project.json"])["endpoints"]) == 40
+    assert len(json.loads(snapshot["config/settings.json"])["endpoints"]) == 40
+    assert snapshot["api/openapi.yaml"].count("get:") == 400
+    assert "Returns user 399 # with its address" in snapshot["api/openapi.yaml"]
+    # A spec under a fixture directory is still a spec
+    assert not minifier.fixture("testdata/swagger.json")
+    assert minifier.fixture("testdata/users.json")
+
+
+def test_verbatim_without_rewrite():
+    minifier = Minifier()
+    snapshot = minifier.apply(SourceSnapshot.from_files({"main.go": GO_SOURCE, "main_test.go": ""}), "acme/users", rewrite=False)
+    assert dict(snapshot.items()) == {"main.go": GO_SOURCE}
+
+
+if __name__ == "__main__":
+    test_path_matches()
+    test_strip_comments()
+    test_swaggo_annotations_are_kept()
+    test_hash_comments_respect_strings()
+    test_minified_snapshot()
+    test_specs_are_never_collapsed()
+    test_verbatim_without_rewrite()
+    print("All minify tests passed")
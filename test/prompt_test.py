@@ -0,0 +1,49 @@
+import json
+import os
+
+from core.llm_handlers.batch import task_request
+from core.llm_handlers.prompt import layered_prompt
+from detection_engine.templates import extratction_system_prompt
+
+
+class Agent:
+    role = "API Specification Extraction Agent"
+    goal = "Extract the API specification"
+    backstory = "You extract API specifications"
+
+
+class Task:
+    """The extraction task of the detection and onboarding crews, rendered like crewai renders it."""
+    def __init__(self):
+        self.agent = Agent()
+        self.description = layered_prompt(
+            "Instructions :\n Steps:\n" + str(extratction_system_prompt["system_prompt"]["instructions"]["steps"]) + "\nExample json outout :{example_output}",
+            variable="The Github Source Code is as follows:\n{source_code}.\nThe list of endpoint specifications to be extracted are {endpoints_list}",
+        )
+        self.expected_output = "Generate the JSON output using the extracted information, shaped like the example json output."
+        self.output_json = None
+
+
+def test_layers_run_from_stable_to_variable():
+    assert layered_prompt("instructions", snapshot="snapshot", variable="variable") == "instructions\nsnapshot\nvariable"
+    assert layered_prompt("instructions", variable="variable") == "instructions\nvariable"
+    assert layered_prompt("instructions") == "instructions"
+
+
+def test_endpoints_share_the_extraction_prefix():
+    example_output = json.dumps(extratction_system_prompt["system_prompt"]["instructions"]["example_output"])
+    prompts = [
+        task_request(endpoint, Task(), {"source_code": source, "example_output": example_output, "endpoints_list": str([{"endpoint": endpoint, "method": "GET"}])}, "qwen").user_prompt
+        for endpoint, source in (("/users", "func ListUsers() {}"), ("/orders", "func ListOrders() {}"))
+    ]
+    prefix = os.path.commonprefix(prompts)
+    # Everything up to the per-endpoint source is shared, the example output included
+    assert prefix.endswith("The Github Source Code is as follows:\nfunc List")
+    assert example_output in prefix
+    assert prompts[0].index("func ListUsers") < prompts[0].index("{'endpoint': '/users'")
+
+
+if __name__ == "__main__":
+    test_layers_run_from_stable_to_variable()
+    test_endpoints_share_the_extraction_prefix()
+    print("All prompt tests passed")
@@ -0,0 +1,162 @@
+import os
+import json
+import time
+import asyncio
+import tempfile
+from pydantic import BaseModel
+
+from core.llm_handlers.interface import LLMInterface
+from core.llm_handlers.replay_handler import RecordingHandler, ReplayHandler, CassetteMissError
+from core.llm_handlers.factory import create_llm_handler
+from core.llm_handlers.context import Stage
+from core.llm_handlers.cascade import kickoff_cascade
+
+
+class Answer(BaseModel):
+    value: int
+
+
+class CountingHandler(LLMInterface):
+    def __init__(self):
+        self.calls = 0
+
+    def generate_text(self, system_prompt: str, user_prompt: str, model_name: str, max_tokens: int = -1) -> str:
+        self.calls += 1
+        time.sleep(0.05)
+        return f"{user_prompt} #{self.calls}"
+
+    def generate_json(self, system_prompt: str, user_prompt: str, json_schema: BaseModel, model_name: str, max_tokens: int = -1) -> BaseModel:
+        self.calls += 1
+        return json_schema(value=self.calls)
+
+
+def record(path: str) -> CountingHandler:
+    live = CountingHandler()
+    recorder = RecordingHandler(live, path, "lmstudio")
+    recorder.generate_text("system", "hello", "model")
+    recorder.generate_text("system", "hello", "model")
+    recorder.generate_json("system", "answer", Answer, "model")
+    return live
+
+
+def test_replay_returns_recordings_in_order():
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "cassette.jsonl")
+        record(path)
+
+        replay = ReplayHandler(path)
+        assert replay.generate_text("system", "hello", "model") == "hello #1"
+        assert replay.generate_text("system", "hello", "model") == "hello #2"
+        # The last recording repeats once the sequence is exhausted
+        assert replay.generate_text("system", "hello", "model") == "hello #2"
+        assert replay.generate_json("system", "answer", Answer, "model") == Answer(value=3)
+
+
+def test_replay_miss_raises():
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "cassette.jsonl")
+        record(path)
+
+        replay = ReplayHandler(path)
+        try:
+            replay.generate_text("system", "not recorded", "model")
+        except CassetteMissError:
+            pass
+        else:
+            raise AssertionError("Expected a CassetteMissError")
+
+
+def test_replay_simulates_latency():
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "cassette.jsonl")
+        record(path)
+
+        replay = ReplayHandler(path, latency_scale=1.0)
+        started_at = time.monotonic()
+        asyncio.run(replay.agenerate_text("system", "hello", "model"))
+        assert time.monotonic() - started_at >= 0.05
+
+
+def test_factory_replay_provider():
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "cassette.jsonl")
+        record(path)
+
+        handler = create_llm_handler(provider="replay", api_key="", api_url=path)
+        assert handler.generate_json("system", "answer", Answer, "model") == Answer(value=3)
+
+
+class LocalLLM:
+    model = "gpt-4o-mini"
+    base_url = None
+
+
+class Agent:
+    role = "API Specification Extraction Agent"
+    goal = "Extract the API specification"
+    backstory = "You extract API specifications"
+
+    def __init__(self):
+        self.llm = LocalLLM()
+
+
+class Task:
+    def __init__(self, agent: Agent):
+        self.agent = agent
+        self.description = "Extract {endpoints_list}"
+        self.expected_output = "JSON"
+        self.output_json = Answer
+
+
+class Crew:
+    """Just enough of a crewai Crew, answering with the number of kickoffs so far unless offline."""
+
+    def __init__(self):
+        self.agents = [Agent()]
+        self.tasks = [Task(self.agents[0])]
+        self.kickoffs = 0
+        self.offline = False
+
+    def kickoff(self, inputs: dict):
+        if self.offline:
+            raise ConnectionError("no network")
+        self.kickoffs += 1
+        answer = {"value": self.kickoffs}
+        return type("CrewOutput", (), {"raw": json.dumps(answer), "json": json.dumps(answer), "json_dict": answer, "token_usage": None})()
+
+
+def test_crew_kickoffs_replay_offline():
+    names = ("LLM_RECORD_CASSETTE", "LLM_REPLAY_CASSETTE", "LLM_REPLAY_CREWS", "LLM_CASCADE_MODELS", "LLM_GATEWAY_URL")
+    saved = {name: os.environ.pop(name, None) for name in names}
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "cassette.jsonl")
+            crew = Crew()
+            os.environ["LLM_RECORD_CASSETTE"] = path
+            assert kickoff_cascade(crew, {"endpoints_list": "/users"}, Stage.SPEC_EXTRACTION) == '{"value": 1}'
+
+            del os.environ["LLM_RECORD_CASSETTE"]
+            os.environ["LLM_REPLAY_CASSETTE"] = path
+            os.environ["LLM_REPLAY_CREWS"] = "true"
+            crew.offline = True
+            assert kickoff_cascade(crew, {"endpoints_list": "/users"}, Stage.SPEC_EXTRACTION) == '{"value": 1}'
+            assert crew.kickoffs == 1
+            try:
+                kickoff_cascade(crew, {"endpoints_list": "/orders"}, Stage.SPEC_EXTRACTION)
+                assert False, "inputs that were not recorded are a miss"
+            except CassetteMissError:
+                pass
+    finally:
+        for name, value in saved.items():
+            os.environ.pop(name, None)
+            if value is not None:
+                os.environ[name] = value
+
+
+if __name__ == "__main__":
+    test_replay_returns_recordings_in_order()
+    test_replay_miss_raises()
+    test_replay_simulates_latency()
+    test_factory_replay_provider()
+    test_crew_kickoffs_replay_offline()
+    print("All replay handler tests passed")
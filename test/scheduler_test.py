@@ -0,0 +1,152 @@
+import time
+import asyncio
+import threading
+
+from core.llm_handlers.context import Stage, llm_stage
+from core.llm_handlers.scheduler import LLMScheduler, TokenBucket
+
+
+class Clock:
+    """Monotonic time that only moves when the test says so."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def advance(scheduler: LLMScheduler, clock: Clock, seconds: float):
+    clock.now += seconds
+    # Waiting tickets sleep on the real clock, wake them to look at the new time
+    with scheduler.condition:
+        scheduler.condition.notify_all()
+
+
+def wait_for(condition, timeout: float = 5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def start(scheduler: LLMScheduler, tokens: int, stage: Stage, admitted: list) -> threading.Thread:
+    def run():
+        with llm_stage(stage):
+            scheduler.acquire(tokens)
+        admitted.append(stage)
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread
+
+
+def test_bucket_refills_with_elapsed_time():
+    clock = Clock()
+    bucket = TokenBucket(60, clock)
+    bucket.consume(60)
+    assert bucket.wait_time(1) == 1.0
+    clock.now += 30
+    bucket.refill(clock())
+    assert bucket.available == 30
+    # Never above capacity
+    clock.now += 3600
+    bucket.refill(clock())
+    assert bucket.available == 60
+    # A request bigger than the bucket only waits for a full one
+    bucket.consume(60)
+    assert bucket.wait_time(600) == 60.0
+    assert TokenBucket(None, clock).wait_time(10 ** 9) == 0.0
+
+
+def test_requests_per_minute():
+    clock = Clock()
+    scheduler = LLMScheduler(requests_per_minute=2, clock=clock)
+    assert scheduler.acquire(10) == 0.0
+    assert scheduler.acquire(10) == 0.0
+    admitted = []
+    thread = start(scheduler, 10, Stage.ONBOARDING, admitted)
+    wait_for(lambda: scheduler.metrics()["queue_depth"] == 1)
+    advance(scheduler, clock, 29)
+    time.sleep(0.05)
+    assert admitted == []
+    advance(scheduler, clock, 1)
+    thread.join(5)
+    assert admitted == [Stage.ONBOARDING]
+    assert scheduler.metrics()["wait_time_by_stage"]["onboarding"]["max_seconds"] == 30
+
+
+def test_tokens_per_minute():
+    clock = Clock()
+    scheduler = LLMScheduler(tokens_per_minute=1000, clock=clock)
+    scheduler.acquire(600)
+    admitted = []
+    thread = start(scheduler, 600, Stage.PR_DETECTION, admitted)
+    wait_for(lambda: scheduler.metrics()["queue_depth"] == 1)
+    # 400 tokens left, 200 more take 12 seconds to refill
+    advance(scheduler, clock, 11)
+    time.sleep(0.05)
+    assert admitted == []
+    advance(scheduler, clock, 1)
+    thread.join(5)
+    assert admitted == [Stage.PR_DETECTION]
+    assert scheduler.metrics()["available_tokens"] == 0
+
+
+def test_most_urgent_stage_is_admitted_first():
+    clock = Clock()
+    scheduler = LLMScheduler(requests_per_minute=1, clock=clock)
+    scheduler.acquire(10)
+    admitted = []
+    threads = []
+    # Queued least urgent first, onboarding and propagation arrive before detection
+    for stage in (Stage.ONBOARDING, Stage.PR_PROPAGATION, Stage.PR_DETECTION):
+        threads.append(start(scheduler, 10, stage, admitted))
+        wait_for(lambda: scheduler.metrics()["queue_depth"] == len(threads))
+    assert scheduler.metrics()["queue_depth_by_stage"] == {"onboarding": 1, "pr_propagation": 1, "pr_detection": 1}
+    for count in (1, 2, 3):
+        advance(scheduler, clock, 60)
+        wait_for(lambda: len(admitted) == count)
+    for thread in threads:
+        thread.join(5)
+    assert admitted == [Stage.PR_DETECTION, Stage.PR_PROPAGATION, Stage.ONBOARDING]
+
+
+def test_async_waiters_do_not_hold_threads():
+    clock = Clock()
+    scheduler = LLMScheduler(requests_per_minute=1, clock=clock)
+    scheduler.acquire(10)
+    admitted = []
+
+    async def call(stage: Stage):
+        with llm_stage(stage):
+            await scheduler.aacquire(10)
+        admitted.append(stage)
+
+    async def main():
+        threads = threading.active_count()
+        tasks = [asyncio.create_task(call(Stage.ONBOARDING)) for _ in range(100)]
+        tasks.append(asyncio.create_task(call(Stage.PR_DETECTION)))
+        while scheduler.metrics()["queue_depth"] < len(tasks):
+            await asyncio.sleep(0.01)
+        assert threading.active_count() == threads
+        clock.now += 60
+        while not admitted:
+            await asyncio.sleep(0.01)
+        assert admitted == [Stage.PR_DETECTION]
+        # Cancelled waiters leave the queue
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        assert scheduler.metrics()["queue_depth"] == 0
+
+    asyncio.run(main())
+
+
+if __name__ == "__main__":
+    test_bucket_refills_with_elapsed_time()
+    test_requests_per_minute()
+    test_tokens_per_minute()
+    test_most_urgent_stage_is_admitted_first()
+    test_async_waiters_do_not_hold_threads()
+    print("All scheduler tests passed")
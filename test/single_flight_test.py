@@ -0,0 +1,123 @@
+import os
+import json
+import time
+import tempfile
+import threading
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+
+from core.llm_handlers.coalesce import SingleFlight
+
+
+def wait_for(condition, timeout: float = 5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def test_followers_share_the_leaders_call():
+    flight = SingleFlight()
+    release = threading.Event()
+    calls = []
+
+    def call() -> str:
+        calls.append(1)
+        release.wait(5)
+        return "answer"
+
+    with ThreadPoolExecutor(8) as pool:
+        futures = [pool.submit(flight.do, "key", call) for _ in range(8)]
+        # Every follower is parked on the leader's future before the leader finishes
+        wait_for(lambda: flight.stats()["shared_in_process"] == 7)
+        release.set()
+        assert [future.result() for future in futures] == ["answer"] * 8
+    assert len(calls) == 1
+    assert flight.stats()["in_flight"] == 0
+    # Once the leader is done the next caller runs the call again
+    assert flight.do("key", lambda: "again") == "again"
+
+
+def test_leader_error_reaches_followers():
+    flight = SingleFlight()
+    release = threading.Event()
+
+    def call() -> str:
+        release.wait(5)
+        raise ConnectionError("provider down")
+
+    with ThreadPoolExecutor(4) as pool:
+        futures = [pool.submit(flight.do, "key", call) for _ in range(4)]
+        wait_for(lambda: flight.stats()["shared_in_process"] == 3)
+        release.set()
+        for future in futures:
+            try:
+                future.result()
+                assert False, "followers see the leader's exception"
+            except ConnectionError:
+                pass
+    assert flight.stats()["calls"] == 1
+
+
+def test_stale_files_are_not_shared():
+    with tempfile.TemporaryDirectory() as root:
+        flight = SingleFlight(lock_dir=root)
+        # A lock file left behind by a crashed process holds no lock, a result from before we started is not in flight
+        open(flight.lock_path("key"), "w").close()
+        with open(flight.result_path("key"), "w") as file:
+            json.dump({"finished_at": time.time() - 60, "value": "stale"}, file)
+        assert flight.do("key", lambda: "fresh") == "fresh"
+        assert flight.stats()["shared_across_processes"] == 0
+
+
+def test_old_results_are_swept():
+    with tempfile.TemporaryDirectory() as root:
+        flight = SingleFlight(lock_dir=root, result_ttl=60)
+        flight.do("old", lambda: "old")
+        past = time.time() - 120
+        os.utime(flight.result_path("old"), (past, past))
+        flight.do("new", lambda: "new")
+        assert not os.path.exists(flight.result_path("old"))
+        assert os.path.exists(flight.result_path("new"))
+        # Lock files stay, another process may hold one
+        assert os.path.exists(flight.lock_path("old"))
+
+
+def run_in_process(lock_dir: str, log_path: str, barrier, results):
+    flight = SingleFlight(lock_dir=lock_dir)
+
+    def call() -> str:
+        with open(log_path, "a") as file:
+            file.write(f"{os.getpid()}\n")
+        time.sleep(0.5)
+        return "answer"
+
+    barrier.wait()
+    results.put((flight.do("key", call), flight.stats()))
+
+
+def test_processes_share_one_call():
+    context = multiprocessing.get_context("fork")
+    with tempfile.TemporaryDirectory() as root:
+        log_path = os.path.join(root, "calls.log")
+        barrier = context.Barrier(4)
+        results = context.Queue()
+        processes = [context.Process(target=run_in_process, args=(root, log_path, barrier, results)) for _ in range(4)]
+        for process in processes:
+            process.start()
+        outcomes = [results.get(timeout=10) for _ in processes]
+        for process in processes:
+            process.join(10)
+        assert [value for value, _ in outcomes] == ["answer"] * 4
+        with open(log_path) as file:
+            assert len(file.read().splitlines()) == 1
+        assert sum(stats["shared_across_processes"] for _, stats in outcomes) == 3
+
+
+if __name__ == "__main__":
+    test_followers_share_the_leaders_call()
+    test_leader_error_reaches_followers()
+    test_stale_files_are_not_shared()
+    test_old_results_are_swept()
+    test_processes_share_one_call()
+    print("All single flight tests passed")
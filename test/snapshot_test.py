@@ -0,0 +1,73 @@
+import json
+
+from adaptutils.snapshot import SourceSnapshot, RENDERERS, register_renderer, render_source
+
+FILES = {"main.go": "package main\n", "api/routes.go": "package api\n", "README.md": "# Orders\n"}
+
+
+class Loader:
+    """Serves FILES and remembers which paths were read."""
+
+    def __init__(self):
+        self.loaded = []
+
+    def __call__(self, path: str) -> str:
+        self.loaded.append(path)
+        return FILES[path]
+
+
+def test_contents_are_loaded_on_first_access():
+    loader = Loader()
+    snapshot = SourceSnapshot(FILES.keys(), loader, ref="master")
+    assert list(snapshot) == ["main.go", "api/routes.go", "README.md"]
+    assert len(snapshot) == 3 and "main.go" in snapshot
+    assert snapshot.glob("api/*") == ["api/routes.go"]
+    assert loader.loaded == []
+    assert snapshot["main.go"] == "package main\n"
+    assert snapshot["main.go"] == "package main\n"
+    assert loader.loaded == ["main.go"]
+    try:
+        snapshot["missing.go"]
+        assert False, "paths outside the index are not loaded"
+    except KeyError:
+        pass
+    assert loader.loaded == ["main.go"]
+
+
+def test_subset_shares_loaded_contents():
+    loader = Loader()
+    snapshot = SourceSnapshot(FILES.keys(), loader, ref="master")
+    snapshot["main.go"]
+    subset = snapshot.subset(["README.md", "main.go", "other.go"])
+    # Snapshot order is kept and paths the snapshot does not have are dropped
+    assert list(subset) == ["main.go", "README.md"]
+    assert subset.ref == "master"
+    assert subset.as_dict() == {"main.go": "package main\n", "README.md": "# Orders\n"}
+    assert loader.loaded == ["main.go", "README.md"]
+    assert "README.md" in snapshot.contents
+
+
+def test_render_json_encodes_once():
+    rendered = SourceSnapshot.from_files(FILES).render("json")
+    assert json.loads(rendered) == FILES
+
+
+def test_registered_renderer_is_used_by_name():
+    register_renderer("paths", lambda files: "\n".join(files))
+    try:
+        assert SourceSnapshot.from_files(FILES).render("paths") == "main.go\napi/routes.go\nREADME.md"
+    finally:
+        del RENDERERS["paths"]
+    try:
+        render_source(FILES, "paths")
+        assert False, "unknown renderers are rejected"
+    except ValueError:
+        pass
+
+
+if __name__ == "__main__":
+    test_contents_are_loaded_on_first_access()
+    test_subset_shares_loaded_contents()
+    test_render_json_encodes_once()
+    test_registered_renderer_is_used_by_name()
+    print("All source snapshot tests passed")
@@ -0,0 +1,142 @@
+import json
+import asyncio
+from typing import List, Optional
+from pydantic import BaseModel
+
+from core.llm_handlers.streaming import IncrementalJSONValidator, StreamDivergenceError, StreamMetrics, iter_sse_deltas, aiter_sse_deltas
+
+
+class Method(BaseModel):
+    method: str
+    description: Optional[str] = None
+
+
+class Endpoint(BaseModel):
+    endpoint: str
+    methods: List[Method]
+    port: int
+    tls: bool
+
+
+DOCUMENT = {"endpoint": "/users/{id}", "methods": [{"method": "GET", "description": None}], "port": 8080, "tls": False}
+
+
+def validate(chunks: List[str], strict: bool = False) -> str:
+    validator = IncrementalJSONValidator(Endpoint, strict=strict)
+    for chunk in chunks:
+        validator.feed(chunk)
+    return validator.finish()
+
+
+def diverges(chunks: List[str], strict: bool = False) -> StreamDivergenceError:
+    try:
+        validate(chunks, strict)
+    except StreamDivergenceError as e:
+        return e
+    raise AssertionError(f"{''.join(chunks)!r} was accepted")
+
+
+def test_character_by_character():
+    text = json.dumps(DOCUMENT)
+    assert validate(list(text)) == text
+    assert Endpoint.model_validate_json(validate([text[:7], text[7:30], text[30:]]))
+
+
+def test_fences_are_stripped():
+    text = json.dumps(DOCUMENT)
+    assert validate(["```", "json\n", text, "\n``", "`"]) == text
+    assert validate(["  \n", text, "\n"]) == text
+    assert "does not start" in str(diverges(["Sure! Here is the JSON: ", text]))
+
+
+def test_tokens_split_across_chunks():
+    # Literals, numbers, escapes and keys cut anywhere still parse
+    text = '{"endpoint": "/a\\"b", "methods": [], "port": 8080, "tls": false}'
+    for cut in range(1, len(text)):
+        assert validate([text[:cut], text[cut:]]) == text
+
+
+def test_escapes_and_unicode():
+    text = '{"endpoint": "/caf\\u00e9\\n\\t\\\\", "methods": [{"method": "G\\u0045T"}], "port": 1, "tls": true}'
+    assert Endpoint.model_validate_json(validate(list(text))).endpoint == "/café\n\t\\"
+    assert "unicode" in str(diverges(['{"endpoint": "\\u00g']))
+    assert "escape" in str(diverges(['{"endpoint": "\\x']))
+    assert "newline" in str(diverges(['{"endpoint": "a\nb"']))
+
+
+def test_type_divergence_is_caught_early():
+    error = diverges(['{"endpoint": "/a", "port": "80', '80"}'])
+    # Detected at the opening quote, before the rest of the stream arrives
+    assert error.position == len('{"endpoint": "/a", "port": ')
+    assert diverges(['{"endpoint": "/a", "methods": {']).position == len('{"endpoint": "/a", "methods": ')
+    assert "Invalid literal" in str(diverges(['{"tls": tru', 'th']))
+    assert "Invalid number" in str(diverges(['{"port": 8a']))
+
+
+def test_missing_required_fields():
+    error = diverges(['{"endpoint": "/a", "methods": [{"description": "x"}]'])
+    assert "['method']" in str(error)
+    assert "['methods', 'port', 'tls']" in str(diverges(['{"endpoint": "/a"}']))
+    assert "ended before" in str(diverges(['{"endpoint": "/a", "methods": []']))
+
+
+def test_unknown_properties_only_in_strict_mode():
+    text = '{"endpoint": "/a", "methods": [], "port": 1, "tls": true, "notes": "x"}'
+    assert validate([text]) == text
+    assert "Unknown property 'notes'" in str(diverges([text], strict=True))
+
+
+def test_trailing_text():
+    text = json.dumps(DOCUMENT)
+    assert "after the JSON document" in str(diverges([text, "\nThis endpoint returns a user."]))
+
+
+def sse(*events) -> List[str]:
+    return [f"data: {json.dumps(event)}" if not isinstance(event, str) else event for event in events]
+
+
+EVENTS = sse(
+    ": keep-alive",
+    "",
+    {"choices": [{"index": 0, "delta": {"role": "assistant"}}]},
+    {"choices": [{"index": 0, "delta": {"content": '{"a": '}}]},
+    {"choices": [{"index": 0, "delta": {"content": "1}"}, "finish_reason": "length"}]},
+    {"choices": [], "usage": {"prompt_tokens": 12, "completion_tokens": 4, "prompt_tokens_details": {"cached_tokens": 8}}},
+    "data: [DONE]",
+    {"choices": [{"index": 0, "delta": {"content": "after done"}}]},
+)
+
+
+def test_sse_parser():
+    metrics = StreamMetrics()
+    assert list(iter_sse_deltas([line.encode() for line in EVENTS], metrics)) == ['{"a": ', "1}"]
+    assert (metrics.chunks, metrics.characters, metrics.finish_reason) == (2, 8, "length")
+    assert (metrics.prompt_tokens, metrics.completion_tokens, metrics.cached_tokens) == (12, 4, 8)
+
+
+def test_async_sse_parser():
+    async def lines():
+        for line in EVENTS:
+            yield line
+
+    async def collect():
+        metrics = StreamMetrics()
+        return [delta async for delta in aiter_sse_deltas(lines(), metrics)], metrics
+
+    deltas, metrics = asyncio.run(collect())
+    assert deltas == ['{"a": ', "1}"]
+    assert metrics.finish_reason == "length"
+
+
+if __name__ == "__main__":
+    test_character_by_character()
+    test_fences_are_stripped()
+    test_tokens_split_across_chunks()
+    test_escapes_and_unicode()
+    test_type_divergence_is_caught_early()
+    test_missing_required_fields()
+    test_unknown_properties_only_in_strict_mode()
+    test_trailing_text()
+    test_sse_parser()
+    test_async_sse_parser()
+    print("All streaming validator tests passed")
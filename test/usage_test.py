@@ -0,0 +1,75 @@
+import os
+import time
+import tempfile
+
+from core.llm_handlers.usage import UsageTracker, UsageRecord
+
+
+def record(stage: str, model: str, wall_time: float = 1.0, success: bool = True, **usage) -> UsageRecord:
+    return UsageRecord(timestamp=time.time(), provider="openai", model=model, stage=stage, wall_time=wall_time, success=success, **usage)
+
+
+def test_summary_groups_by_stage_and_model():
+    tracker = UsageTracker()
+    tracker.record(record("pr_detection", "gpt-4o", prompt_tokens=100, completion_tokens=10, cached_tokens=50))
+    tracker.record(record("pr_detection", "gpt-4o", prompt_tokens=300, completion_tokens=30, requests=2, success=False))
+    tracker.record(record("pr_detection", "gpt-4o-mini", prompt_tokens=10))
+    tracker.record(record("onboarding", "gpt-4o", wall_time=2.0, time_to_first_token=0.5))
+    summaries = tracker.summary()
+    assert [(summary.stage, summary.model) for summary in summaries] == [("onboarding", "gpt-4o"), ("pr_detection", "gpt-4o"), ("pr_detection", "gpt-4o-mini")]
+    detection = summaries[1]
+    assert (detection.calls, detection.failures) == (3, 1)
+    assert (detection.prompt_tokens, detection.completion_tokens, detection.total_tokens) == (400, 40, 440)
+    assert detection.cache_hit_rate == 50 / 400
+    assert detection.avg_time_to_first_token is None
+    assert summaries[0].avg_time_to_first_token == 0.5
+    assert [summary.model for summary in tracker.summary(stage="pr_detection", model="gpt-4o-mini")] == ["gpt-4o-mini"]
+
+
+def test_p95_wall_time():
+    tracker = UsageTracker()
+    for wall_time in range(100, 0, -1):
+        tracker.record(record("onboarding", "gpt-4o", wall_time=float(wall_time)))
+    summary = tracker.summary()[0]
+    assert summary.p95_wall_time == 96.0
+    assert summary.avg_wall_time == 50.5
+
+
+def test_log_is_tailed():
+    with tempfile.TemporaryDirectory() as root:
+        path = os.path.join(root, "usage.jsonl")
+        reader, writer = UsageTracker(path), UsageTracker(path)
+        parsed = []
+        parse = UsageRecord.model_validate_json
+
+        def counted(data, *args, **kwargs):
+            parsed.append(data)
+            return parse(data, *args, **kwargs)
+
+        UsageRecord.model_validate_json = counted
+        try:
+            for _ in range(5):
+                writer.record(record("onboarding", "gpt-4o"))
+            assert len(reader.load()) == 5 and len(parsed) == 5
+            assert len(reader.load()) == 5 and len(parsed) == 5
+            offset = reader.log_offset
+            # Only what other processes appended since is parsed
+            writer.record(record("pr_detection", "gpt-4o"))
+            with open(path, "a") as file:
+                file.write('{"timestamp": 1')
+            assert [item.stage for item in reader.load()] == ["onboarding"] * 5 + ["pr_detection"]
+            assert len(parsed) == 6
+            assert reader.log_offset > offset
+        finally:
+            del UsageRecord.model_validate_json
+        # A rotated log starts over
+        os.replace(path, f"{path}.1")
+        writer.record(record("pr_propagation", "gpt-4o"))
+        assert [item.stage for item in reader.load()] == ["pr_propagation"]
+
+
+if __name__ == "__main__":
+    test_summary_groups_by_stage_and_model()
+    test_p95_wall_time()
+    test_log_is_tailed()
+    print("All usage tests passed")